@@ -0,0 +1,428 @@
+"""Benchmarks of the hot paths of the FLIM pipeline.
+
+Run from the command line::
+
+    python -m pyflim.benchmarks --photons 1e6 1e7 --output results.json
+    python -m pyflim.benchmarks --output new.json --compare results.json
+
+Each case runs in a new process, so that its first call includes the
+numba compilation and its peak RSS is not inflated by previous cases.
+Results are stored as JSON, together with the commit and library
+versions, so that they can be compared between commits with --compare.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numba as nb
+import numpy as np
+
+from .functions import phasor_covariance
+from .io import functions as io_functions
+from .io.becker_hickl import bh_numba
+from .io.becker_hickl.bh_writer import SPCWriter
+from .io.picoquant import pq_header
+from .io.picoquant import pq_numba as pq
+from .io.picoquant.pq_writer import PTUWriter
+
+NUM_TAC_BINS = 1024
+
+
+def _photons(rng, photons, image_size):
+    """Uniformly distributed photons, as int16 arrays like the readers'."""
+    dtime = rng.integers(NUM_TAC_BINS, size=photons).astype(np.int16)
+    x = rng.integers(image_size, size=photons).astype(np.int16)
+    y = rng.integers(image_size, size=photons).astype(np.int16)
+    return dtime, x, y
+
+
+def _write_frame(writer, rng, photons, image_size):
+    """Write a single frame with about photons photons, and return their number."""
+    counts = rng.poisson(photons / image_size ** 2, size=(image_size, image_size))
+    writer.write_frame(counts, rng.integers(NUM_TAC_BINS, size=counts.sum()))
+    return int(counts.sum())
+
+
+def _phasors(rng, image_size):
+    """Photon counts and phasors at harmonics 1 and 2 of a lifetime image."""
+    N = rng.poisson(100, size=(image_size, image_size)).astype(float)
+    tau = rng.uniform(0.05, 0.5, size=N.shape)
+    r1 = 1 / (1 - 2j * np.pi * tau)
+    r2 = 1 / (1 - 4j * np.pi * tau)
+    return N, r1, r2
+
+
+# Each setup function returns a callable to time, and the number of
+# photons and pixels processed by each call.
+
+
+def setup_read_events(rng, directory, photons, image_size):
+    file = pathlib.Path(directory, "benchmark.ptu")
+    with PTUWriter(file, image_size, image_size) as writer:
+        photons = _write_frame(writer, rng, photons, image_size)
+    header, records_start = pq_header.read_header_ptu(file)
+    num_records = header["TTResult_NumberOfRecords"]
+
+    def func():
+        return pq.read_records(file, num_records, records_start)
+
+    return func, photons, image_size ** 2
+
+
+def setup_interpret_LSM(rng, directory, photons, image_size):
+    file = pathlib.Path(directory, "benchmark.ptu")
+    with PTUWriter(file, image_size, image_size) as writer:
+        photons = _write_frame(writer, rng, photons, image_size)
+    header, records_start = pq_header.read_header_ptu(file)
+    channel, dtime, macrotime = pq.read_records(
+        file, header["TTResult_NumberOfRecords"], records_start
+    )
+    markers = [
+        1 << (header[f"ImgHdr_{name}"] - 1)
+        for name in ("Frame", "LineStart", "LineStop")
+    ]
+
+    def func():
+        # interpret_LSM overwrites dtime with the photons inside lines.
+        return pq.interpret_LSM(
+            channel, dtime.copy(), macrotime, image_size, image_size, *markers
+        )
+
+    return func, photons, image_size ** 2
+
+
+def setup_interpret_AI(rng, directory, photons, image_size):
+    file = pathlib.Path(directory, "benchmark.spc")
+    with SPCWriter(file) as writer:
+        photons = _write_frame(writer, rng, photons, image_size)
+    records = np.fromfile(file, dtype=np.uint32, offset=4)
+    channel, dtime, macrotime = bh_numba._read_events(records, records.size)
+    markers = (writer.lsm_frame, writer.lsm_line_start, writer.lsm_pixel_start)
+
+    def func():
+        # interpret_AI overwrites dtime with the photons inside pixels.
+        return bh_numba.interpret_AI(
+            channel, dtime.copy(), macrotime, 0, 0, *markers, 0
+        )
+
+    return func, photons, image_size ** 2
+
+
+def setup_histogram(rng, directory, photons, image_size):
+    dtime, x, y = _photons(rng, photons, image_size)
+
+    def func():
+        return io_functions.histogram(dtime, x, y, NUM_TAC_BINS)
+
+    return func, photons, image_size ** 2
+
+
+def setup_fourier_image(rng, directory, photons, image_size, harmonics):
+    dtime, x, y = _photons(rng, photons, image_size)
+
+    def func():
+        return io_functions.fourier_image(
+            (image_size, image_size),
+            range(harmonics + 1),
+            dtime,
+            x,
+            y,
+            NUM_TAC_BINS,
+            NUM_TAC_BINS,
+        )
+
+    return func, photons, image_size ** 2
+
+
+def setup_phasor_covariance(rng, directory, image_size):
+    N, r1, r2 = _phasors(rng, image_size)
+
+    def func():
+        return phasor_covariance(N, r1, r2)
+
+    return func, None, image_size ** 2
+
+
+def setup_pawflim(rng, directory, image_size, levels):
+    from .pawflim import pawflim
+
+    N, r1, r2 = _phasors(rng, image_size)
+
+    def func():
+        return pawflim(N, N * r1, N * r2, levels)
+
+    return func, None, image_size ** 2
+
+
+# Name: (setup function, parameters of the cases).
+BENCHMARKS = {
+    "read_events": (setup_read_events, ("photons", "image_size")),
+    "interpret_LSM": (setup_interpret_LSM, ("photons", "image_size")),
+    "interpret_AI": (setup_interpret_AI, ("photons", "image_size")),
+    "histogram": (setup_histogram, ("photons", "image_size")),
+    "fourier_image": (setup_fourier_image, ("photons", "image_size", "harmonics")),
+    "phasor_covariance": (setup_phasor_covariance, ("image_size",)),
+    "pawflim": (setup_pawflim, ("image_size", "levels")),
+}
+
+
+def _peak_rss():
+    """Peak resident set size of the process in bytes, or None if unknown."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(name, params, repeat=5, seed=0):
+    """Run a benchmark case in the current process.
+
+    Parameters
+    ----------
+    name : str
+        Key of BENCHMARKS.
+    params : dict
+        Parameters of the setup function.
+    repeat : int, optional
+        Number of timed calls after the first one.
+    seed : int, optional
+        Seed of the input data.
+
+    Returns
+    -------
+    result : dict
+        first_time is the duration of the first call, which includes the
+        JIT compilation if the kernels were not compiled before. times
+        are the durations of the following calls, whose median is the
+        steady-state time. jit_time is their difference.
+    """
+    setup, _ = BENCHMARKS[name]
+    result = {"benchmark": name, "params": params}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            func, photons, pixels = setup(
+                np.random.default_rng(seed), directory, **params
+            )
+            result["setup_peak_rss"] = _peak_rss()
+
+            start = time.perf_counter()
+            func()
+            first_time = time.perf_counter() - start
+
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+    except Exception as e:
+        result["error"] = repr(e)
+        return result
+
+    median = statistics.median(times)
+    result.update(
+        first_time=first_time,
+        times=times,
+        median=median,
+        jit_time=max(first_time - median, 0.0),
+        photons=photons,
+        photons_per_s=None if photons is None else photons / median,
+        pixels=pixels,
+        pixels_per_s=pixels / median,
+        peak_rss=_peak_rss(),
+    )
+    return result
+
+
+def _run_case(args):
+    return run_case(*args)
+
+
+def cases(benchmarks, **param_values):
+    """Yield (name, params) of the cartesian product of the relevant parameters.
+
+    Parameters
+    ----------
+    benchmarks : iterable of str
+        Keys of BENCHMARKS.
+    param_values : lists
+        Values of each parameter.
+    """
+    for name in benchmarks:
+        _, param_names = BENCHMARKS[name]
+        values = [param_values[param] for param in param_names]
+        for combination in itertools.product(*values):
+            yield name, dict(zip(param_names, combination))
+
+
+def run(benchmarks, repeat=5, seed=0, callback=None, **param_values):
+    """Run each benchmark case in a new process.
+
+    Parameters
+    ----------
+    benchmarks : iterable of str
+        Keys of BENCHMARKS.
+    repeat, seed : int, optional
+        See run_case.
+    callback : callable, optional
+        Called with each result, as soon as it is available.
+    param_values : lists
+        Values of each parameter, as in cases.
+
+    Returns
+    -------
+    results : list of dicts
+        As returned by run_case.
+    """
+    args = [
+        (name, params, repeat, seed)
+        for name, params in cases(benchmarks, **param_values)
+    ]
+    results = []
+    # A fresh process per case, started with spawn, which is safe with numba threads.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(_run_case, args, chunksize=1):
+            if callback is not None:
+                callback(result)
+            results.append(result)
+    return results
+
+
+def metadata():
+    """Commit, library versions and machine of a run."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=pathlib.Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": nb.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numba_threads": nb.get_num_threads(),
+    }
+
+
+def _case_key(result):
+    return result["benchmark"], tuple(sorted(result["params"].items()))
+
+
+def compare(results, baseline):
+    """Ratio of the steady-state time to that of the baseline, for each case.
+
+    Parameters
+    ----------
+    results, baseline : lists of dicts
+        As returned by run.
+
+    Returns
+    -------
+    ratios : dict
+        Maps (benchmark, params) to median / baseline median, for cases
+        without errors in both.
+    """
+    baseline = {_case_key(r): r for r in baseline if "error" not in r}
+    ratios = {}
+    for result in results:
+        key = _case_key(result)
+        if "error" not in result and key in baseline:
+            ratios[key] = result["median"] / baseline[key]["median"]
+    return ratios
+
+
+def format_result(result):
+    params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+    line = f"{result['benchmark']:<18} {params:<45}"
+    if "error" in result:
+        return f"{line} error: {result['error']}"
+
+    line += f" {result['median'] * 1e3:10.3f} ms  JIT {result['jit_time']:6.2f} s"
+    if result["photons_per_s"] is not None:
+        line += f"  {result['photons_per_s']:9.3g} photons/s"
+    line += f"  {result['pixels_per_s']:9.3g} pixels/s"
+    if result["peak_rss"] is not None:
+        line += f"  peak RSS {result['peak_rss'] / 2 ** 20:7.0f} MiB"
+    return line
+
+
+def main(argv=None):
+    def count(s):
+        return int(float(s))  # Accept 1e6.
+
+    parser = argparse.ArgumentParser(
+        prog="python -m pyflim.benchmarks", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"Benchmarks to run, among {', '.join(BENCHMARKS)}. By default, all.",
+    )
+    parser.add_argument("--photons", nargs="+", type=count, default=[10 ** 6])
+    parser.add_argument("--image-size", nargs="+", type=int, default=[256])
+    parser.add_argument(
+        "--harmonics",
+        nargs="+",
+        type=int,
+        default=[2],
+        help="Highest harmonic of fourier_image, which computes 0 to n.",
+    )
+    parser.add_argument("--levels", nargs="+", type=int, default=[3])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file of results.")
+    parser.add_argument(
+        "--compare", type=pathlib.Path, help="JSON file of baseline results."
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(
+        args.benchmarks or list(BENCHMARKS),
+        repeat=args.repeat,
+        seed=args.seed,
+        callback=lambda result: print(format_result(result), flush=True),
+        photons=args.photons,
+        image_size=args.image_size,
+        harmonics=args.harmonics,
+        levels=args.levels,
+    )
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"metadata": metadata(), "results": results}, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"\nCompared to {baseline['metadata']['commit']}:")
+        for (name, params), ratio in compare(results, baseline["results"]).items():
+            params = ", ".join(f"{k}={v}" for k, v in params)
+            print(f"{name:<18} {params:<45} {ratio:6.2f}x time")
+
+
+if __name__ == "__main__":
+    main()
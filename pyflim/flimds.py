@@ -1,3 +1,6 @@
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
 
 from .functions import (
@@ -31,7 +34,23 @@ class UncorrectedFLIMds:
         """
         raise NotImplementedError
 
-    def fourier_image(self, harmonics, mask=None):
+    def decay_image(self, TAC_binning=1, mask=None):
+        """Computes the histogram of arrival times for every pixel.
+
+        Parameters
+        ----------
+        TAC_binning : int
+            Number of consecutive TAC bins summed in each bin.
+        mask : array_like
+            Histograms are only computed where mask == True.
+
+        Returns
+        -------
+        decay_image : array_like of shape (bins, *image.shape)
+        """
+        raise NotImplementedError
+
+    def fourier_image(self, harmonics, mask=None, parallel=False, method="photons"):
         """Computes complex Fourier coefficients for specified harmonics.
 
         Parameters
@@ -40,6 +59,29 @@ class UncorrectedFLIMds:
             Harmonics to compute.
         mask : array_like
             Coefficients are only computed where mask == True.
+        parallel : bool
+            If True, photons are accumulated using all numba threads.
+        method : {"photons", "decay"}
+            If "decay", coefficients are computed from decay_image with
+            a single matrix product, which is faster for many harmonics.
+        """
+        raise NotImplementedError
+
+    def fourier_stack(self, harmonics, frame_binning=1, mask=None):
+        """Computes complex Fourier coefficients for every frame.
+
+        Parameters
+        ----------
+        harmonics : array_like
+            Harmonics to compute.
+        frame_binning : int
+            Number of consecutive frames summed in each element of the stack.
+        mask : array_like
+            Coefficients are only computed where mask == True.
+
+        Returns
+        -------
+        fourier_stack : array_like of shape (frames, harmonics, *image.shape)
         """
         raise NotImplementedError
 
@@ -77,10 +119,135 @@ class UncorrectedFLIMds:
         else:
             return r
 
+    def phasor_stack(self, harmonics, frame_binning=1, mask=None, ret_N=False):
+        """Computes the phasor image of every frame for specified harmonics.
+
+        Parameters
+        ----------
+        harmonics : array_like
+            Harmonics to compute. If harmonics[0] is not 0,
+            it is included to compute the number of counts.
+        frame_binning : int
+            Number of consecutive frames summed in each element of the stack.
+        mask : array_like
+            Coefficients are only computed where mask == True.
+        ret_N : bool
+            If True, return number of counts.
+
+        Returns
+        -------
+        phasor_stack : array_like of shape (frames, harmonics, *image.shape)
+
+        If ret_N, returns (counts, phasor_stack).
+        """
+        if harmonics[0] != 0:
+            harmonics = (0, *harmonics)
+
+        R = self.fourier_stack(harmonics, frame_binning=frame_binning, mask=mask)
+        N, R = R[:, 0].real, R[:, 1:]
+        r = np.zeros_like(R)
+        r = np.divide(R, N[:, None], where=N[:, None] > 0, out=r)
+
+        if ret_N:
+            return N, r
+        else:
+            return r
+
+    def region_histograms(self, labels):
+        """Compute the histogram of every labeled region in a single pass.
+
+        Parameters
+        ----------
+        labels : array_like of non-negative ints
+            Region of each pixel, of the same shape as the image.
+
+        Returns
+        -------
+        bins, hists : tuple of ndarrays
+            hists has shape (labels.max() + 1, bins.size).
+        """
+        raise NotImplementedError
+
+    def region_fourier(self, labels, harmonics):
+        """Sum of complex Fourier coefficients of every labeled region.
+
+        Parameters
+        ----------
+        labels : array_like of non-negative ints
+            Region of each pixel, of the same shape as the image.
+        harmonics : array_like
+            Harmonics to compute.
+
+        Returns
+        -------
+        region_fourier : array_like of shape (harmonics, labels.max() + 1)
+        """
+        labels = np.asarray(labels)
+        R = self.fourier_image(harmonics)
+        out = np.zeros((len(harmonics), labels.max() + 1), dtype=complex)
+        np.add.at(out.T, labels.ravel(), R.reshape(len(harmonics), -1).T)
+        return out
+
+    def region_phasors(self, labels, harmonics, ret_N=False):
+        """Computes the mean phasor of every labeled region in a single pass.
+
+        For a single harmonic h, the k-th element is the same as
+        mean_phasor((h,), mask=labels == k).
+
+        Parameters
+        ----------
+        labels : array_like of non-negative ints
+            Region of each pixel, of the same shape as the image.
+        harmonics : array_like
+            Harmonics to compute. If harmonics[0] is not 0,
+            it is included to compute the number of counts.
+        ret_N : bool
+            If True, return number of counts.
+
+        Returns
+        -------
+        region_phasors : array_like of shape (harmonics, labels.max() + 1)
+
+        If ret_N, returns (counts, region_phasors).
+        """
+        if harmonics[0] != 0:
+            harmonics = (0, *harmonics)
+
+        R = self.region_fourier(labels, harmonics)
+        N, R = R[0].real, R[1:]
+        r = np.zeros_like(R)
+        r = np.divide(R, N, where=N > 0, out=r)
+
+        if ret_N:
+            return N, r
+        else:
+            return r
+
+    def fourier_sum(self, harmonics, mask=None):
+        """Sum of complex Fourier coefficients over all pixels.
+
+        Parameters
+        ----------
+        harmonics : array_like
+            Harmonics to compute.
+        mask : array_like
+            Coefficients are only summed where mask == True.
+
+        Returns
+        -------
+        fourier_sum : array_like of shape (harmonics,)
+        """
+        R = self.fourier_image(harmonics, mask=mask)
+        return R.reshape(len(harmonics), -1).sum(axis=1)
+
     def mean_phasor(self, harmonics, mask=None):
         """Computes the weighted mean phasor."""
-        N, R = self.phasor_image(harmonics, mask=mask, ret_N=True)
-        return np.sum(N * R) / np.sum(N)
+        if harmonics[0] != 0:
+            harmonics = (0, *harmonics)
+
+        R = self.fourier_sum(harmonics, mask=mask)
+        N, R = R[0].real, R[1:]
+        return np.sum(R) / N
 
     def to_corrected(self, irf, bg):
         """Calculate and return a corrected FLIM dataset.
@@ -103,22 +270,72 @@ class Constant(UncorrectedFLIMds):
             harmonics = range(len(coeffs))
         self.coeffs = dict(zip(harmonics, coeffs))
 
-    def fourier_image(self, harmonics, mask=None):
+    def fourier_image(self, harmonics, mask=None, parallel=False, method="photons"):
         return np.fromiter(
             (self.coeffs[h] for h in harmonics), dtype=complex, count=len(harmonics)
         )
 
 
+def _cache_key(harmonics, mask):
+    """Hashable key for harmonics and the contents of mask."""
+    harmonics = tuple(np.asarray(harmonics).tolist())
+    if mask is None:
+        return harmonics, None
+    mask = np.ascontiguousarray(mask)
+    digest = hashlib.sha1(mask.view(np.uint8)).hexdigest()
+    return harmonics, (mask.shape, mask.dtype.str, digest)
+
+
 class CorrectedFLIMds:
-    """An IRF and background-corrected FLIM dataset."""
+    """An IRF and background-corrected FLIM dataset.
+
+    Phasor images are cached by harmonics and mask contents, so that
+    derived images (lifetimes, fractions) reuse a single computation.
 
-    def __init__(self, ufds, irf, bg):
+    Parameters
+    ----------
+    ufds, irf, bg : UncorrectedFLIMds
+        Datasets for sample, IRF and background.
+    cache_size : int, optional
+        Maximum number of cached phasor images. The least recently used
+        are discarded first. If 0, nothing is cached.
+    """
+
+    def __init__(self, ufds, irf, bg, cache_size=8):
         self.ufds = ufds
         self.irf = irf
         self.bg = bg
+        self.cache_size = cache_size
+        self._phasor_cache = OrderedDict()
+
+    def clear_cache(self):
+        """Discard cached phasor images, e.g. after the datasets change."""
+        self._phasor_cache.clear()
 
     def phasor_image(self, harmonics, mask=None):
-        """Calculate normalized fourier coefficient."""
+        """Calculate normalized fourier coefficient.
+
+        The returned array is a copy of the cached one, and can be
+        modified in place.
+        """
+        return self._cached_phasor_image(harmonics, mask=mask).copy()
+
+    def _cached_phasor_image(self, harmonics, mask=None):
+        """Phasor image shared with the cache, which is read-only if cached."""
+        key = _cache_key(harmonics, mask)
+        if key in self._phasor_cache:
+            self._phasor_cache.move_to_end(key)
+            return self._phasor_cache[key]
+
+        r = self._phasor_image(harmonics, mask=mask)
+        if self.cache_size > 0:
+            r.flags.writeable = False
+            self._phasor_cache[key] = r
+            while len(self._phasor_cache) > self.cache_size:
+                self._phasor_cache.popitem(last=False)
+        return r
+
+    def _phasor_image(self, harmonics, mask=None):
         if harmonics[0] != 0:
             harmonics = (0, *harmonics)
 
@@ -132,25 +349,25 @@ class CorrectedFLIMds:
     def mlt_image(self, harmonics, mask=None):
         """Calculate modulation lifetime image."""
         return modulation_lifetime(
-            self.phasor_image(harmonics, mask=mask), self.ufds.frequency
+            self._cached_phasor_image(harmonics, mask=mask), self.ufds.frequency
         )
 
     def plt_image(self, harmonics, mask=None):
         """Calculate phase lifetime image."""
         return phase_lifetime(
-            self.phasor_image(harmonics, mask=mask), self.ufds.frequency
+            self._cached_phasor_image(harmonics, mask=mask), self.ufds.frequency
         )
 
     def nlt_image(self, harmonics, mask=None):
         """Calculate normal lifetime image."""
         return normal_lifetime(
-            self.phasor_image(harmonics, mask=mask), self.ufds.frequency
+            self._cached_phasor_image(harmonics, mask=mask), self.ufds.frequency
         )
 
 
 class FRETFLIMds(CorrectedFLIMds):
-    def __init__(self, ufds, irf, bg, r_fret, r_donor):
-        super().__init__(ufds, irf, bg)
+    def __init__(self, ufds, irf, bg, r_fret, r_donor, cache_size=8):
+        super().__init__(ufds, irf, bg, cache_size=cache_size)
         self.r_fret = r_fret
         self.r_donor = r_donor
 
@@ -162,12 +379,14 @@ class FRETFLIMds(CorrectedFLIMds):
     @classmethod
     def from_cfds(cls, cfds, r_fret, r_donor):
         """Loads the dataset from a corrected flim dataset."""
-        return cls(cfds.ufds, cfds.irf, cfds.bg, r_fret, r_donor)
+        return cls(
+            cfds.ufds, cfds.irf, cfds.bg, r_fret, r_donor, cache_size=cfds.cache_size
+        )
 
     def p_image(self, harmonics, mask=None):
         """Calculate and return a photon fraction image."""
         return photon_fraction(
-            self.phasor_image(harmonics, mask=mask), self.r_fret, self.r_donor
+            self._cached_phasor_image(harmonics, mask=mask), self.r_fret, self.r_donor
         )
 
     def m_image(self, harmonics, mask=None):
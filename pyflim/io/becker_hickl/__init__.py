@@ -3,27 +3,51 @@
 import numpy as np
 
 from ...flimds import UncorrectedFLIMds
-from ..functions import fourier_image, histogram
+from ..cache import as_cache
+from ..functions import (
+    PixelIndex,
+    check_range,
+    complex_exp,
+    decay_image,
+    fourier_image,
+    fourier_stack,
+    histogram,
+    region_fourier,
+    region_histograms,
+)
 from .bh_header import read_header_spc
-from .bh_numba import interpret_AI, read_records
+from .bh_numba import index_AI_markers, interpret_AI, read_AI_range, read_records
 
 
 class SPC(UncorrectedFLIMds):
-    """Becker&Hickl .spc file"""
+    """Becker&Hickl .spc file
+
+    Parameters
+    ----------
+    fname : os.PathLike
+    tac_range : float
+        TAC range in s.
+    parallel : bool, optional
+        If True, records are decoded using all numba threads. It is also
+        the default for the parallel argument of fourier_image.
+    cache : PhotonCache or os.PathLike, optional
+        If given, interpreted photons are stored in and loaded from
+        this cache, so that reopening the file only memory-maps them.
+
+    Only the header is read on construction. Records are decoded the
+    first time photons are needed, e.g. by histogram, fourier_image or
+    the x, y, f and dtime attributes.
+    """
 
     def load_TTTR(self):
-        channel, dtime, truetime = read_records(
-            self.filename,
-            self.nb_records,
-            self.recstart,
-            self.syncrate,
-            self.resolution,
+        channel, dtime, macrotime = read_records(
+            self.filename, self.nb_records, self.recstart, parallel=self.parallel
         )
 
         self.x, self.y, self.f, self.dtime, _, self.pixY = interpret_AI(
             channel,
             dtime,
-            truetime,
+            macrotime,
             0,
             0,
             self.lsm_frame,
@@ -34,8 +58,10 @@ class SPC(UncorrectedFLIMds):
         self.dtime -= 1
         self.pixX = self.x.max() + 1
 
-    def __init__(self, fname, tac_range):
+    def __init__(self, fname, tac_range, parallel=False, cache=None):
         self.filename = fname
+        self.parallel = parallel
+        self.cache = as_cache(cache)
         self.header, self.recstart = read_header_spc(fname)
 
         self.syncrate = 1 / self.header["macro_clock"]
@@ -77,8 +103,115 @@ class SPC(UncorrectedFLIMds):
         self.binning = 1
         self.tacbinmax = -1
         self.type = "bh"
+        self._marker_index = None
+        self._pixel_index = None
+        self._loaded = False
+
+    # Attributes computed from the records, on first use.
+    _lazy_attributes = ("x", "y", "f", "dtime", "pixX", "pixY")
+
+    def __getattr__(self, name):
+        # Only called if name is not found. Records are loaded at most once.
+        if name in self._lazy_attributes and not self.__dict__.get("_loaded", True):
+            self._load()
+            return getattr(self, name)
+        raise AttributeError(f"{type(self).__name__!r} has no attribute {name!r}")
+
+    def _load(self):
+        """Decode and interpret the records."""
+        if self.cache is None:
+            self.load_TTTR()
+        else:
+            self._load_cached()
+        self._loaded = True
+
+    def _load_cached(self):
+        key = self.cache.key(
+            self.filename,
+            reader="SPC",
+            lsm_frame=self.lsm_frame,
+            lsm_line_start=self.lsm_line_start,
+            lsm_pixel_start=self.lsm_pixel_start,
+            pixel_dwell_time=self.pixel_dwell_time,
+        )
+        cached = self.cache.load(key)
+        if cached is None:
+            self.load_TTTR()
+            self.cache.save(
+                key,
+                {"x": self.x, "y": self.y, "f": self.f, "dtime": self.dtime},
+                pixX=int(self.pixX),
+                pixY=int(self.pixY),
+            )
+        else:
+            arrays, attrs = cached
+            self.x, self.y, self.f, self.dtime = (
+                arrays[k] for k in ("x", "y", "f", "dtime")
+            )
+            self.pixX = attrs["pixX"]
+            self.pixY = attrs["pixY"]
+
+    def _records(self):
+        records = np.memmap(
+            self.filename, dtype="uint32", mode="r", offset=self.recstart
+        )
+        return records[: self.nb_records]
+
+    @property
+    def marker_index(self):
+        """Record offsets and macrotimes of frame and line markers."""
+        if self._marker_index is None:
+            self._marker_index = index_AI_markers(
+                self._records(), self.lsm_frame, self.lsm_line_start
+            )
+        return self._marker_index
+
+    @property
+    def pixel_index(self):
+        """Photons sorted by pixel, used by queries with a mask.
+
+        Built on first use. Requires photons in memory.
+        """
+        if self._pixel_index is None:
+            self._pixel_index = PixelIndex.from_photons(
+                (self.pixY, self.pixX), self.dtime, self.x, self.y
+            )
+        return self._pixel_index
+
+    def read_frames(self, start, stop=None):
+        """Decode and interpret only some frames.
+
+        Parameters
+        ----------
+        start, stop : int
+            Range of frames, as numbered in the f attribute.
+            By default, only frame start.
 
-        self.load_TTTR()
+        Returns
+        -------
+        x, y, f, dtime : int16 arrays
+            Coordinates, frame and TAC bin of photons.
+
+        Raises
+        ------
+        IndexError
+            If start is not a frame, or stop <= start.
+        """
+        if stop is None:
+            stop = start + 1
+        check_range(start, stop, self.marker_index.frame_offsets.size)
+        x, y, f, dtime = read_AI_range(
+            self._records(),
+            self.marker_index,
+            start,
+            stop,
+            self.lsm_frame,
+            self.lsm_line_start,
+            self.lsm_pixel_start,
+            self.pixel_dwell_time,
+        )
+        dtime -= 1
+        return x, y, f, dtime
 
     @property
     def num_TAC_bins(self):
@@ -89,11 +222,42 @@ class SPC(UncorrectedFLIMds):
         return self.syncrate
 
     def histogram(self, mask=None):
-        hist = histogram(self.dtime, self.x, self.y, self.num_TAC_bins, mask=mask)
+        if mask is not None:
+            hist = self.pixel_index.histogram(self.num_TAC_bins, mask=mask)
+        else:
+            hist = histogram(self.dtime, self.x, self.y, self.num_TAC_bins)
         bins = np.arange(hist.size) * self.resolution
         return bins, hist
 
-    def fourier_image(self, harmonics, mask=None):
+    def decay_image(self, TAC_binning=1, mask=None):
+        if mask is not None:
+            return self.pixel_index.decay_image(
+                self.num_TAC_bins, TAC_binning=TAC_binning, mask=mask
+            )
+
+        return decay_image(
+            (self.pixY, self.pixX),
+            self.dtime,
+            self.x,
+            self.y,
+            self.num_TAC_bins,
+            TAC_binning=TAC_binning,
+            mask=mask,
+        )
+
+    def fourier_image(self, harmonics, mask=None, parallel=None, method="photons"):
+        if parallel is None:
+            parallel = self.parallel
+
+        if method == "photons" and mask is not None:
+            return self.pixel_index.fourier_image(
+                harmonics,
+                self.num_TAC_bins,
+                self.TAC_period,
+                mask=mask,
+                parallel=parallel,
+            )
+
         return fourier_image(
             (self.pixY, self.pixX),
             harmonics,
@@ -103,4 +267,43 @@ class SPC(UncorrectedFLIMds):
             self.num_TAC_bins,
             self.TAC_period,
             mask=mask,
+            parallel=parallel,
+            method=method,
+        )
+
+    def fourier_sum(self, harmonics, mask=None):
+        # Reduced from the histogram, in O(num_TAC_bins) memory.
+        _, hist = self.histogram(mask=mask)
+        return hist @ complex_exp(harmonics, hist.size, self.TAC_period)
+
+    def region_histograms(self, labels):
+        hists = region_histograms(
+            np.asarray(labels), self.dtime, self.x, self.y, self.num_TAC_bins
+        )
+        bins = np.arange(self.num_TAC_bins) * self.resolution
+        return bins, hists
+
+    def region_fourier(self, labels, harmonics):
+        return region_fourier(
+            np.asarray(labels),
+            harmonics,
+            self.dtime,
+            self.x,
+            self.y,
+            self.num_TAC_bins,
+            self.TAC_period,
+        )
+
+    def fourier_stack(self, harmonics, frame_binning=1, mask=None):
+        return fourier_stack(
+            (self.pixY, self.pixX),
+            harmonics,
+            self.dtime,
+            self.x,
+            self.y,
+            self.f,
+            self.num_TAC_bins,
+            self.TAC_period,
+            frame_binning=frame_binning,
+            mask=mask,
         )
@@ -54,3 +54,23 @@ def read_header_spc(fname):
     # rec_start is always afer 4 bytes
     rec_start = 4
     return header, rec_start
+
+
+def write_header_spc(fp, macro_clock, routing_bits=2):
+    """
+    write the header of an .spc file
+
+    Parameters
+    ----------
+
+    fp: binary file object, open for writing at its start.
+
+    macro_clock: macro time clock in s, a multiple of 0.1 ns.
+
+    routing_bits: number of routing bits.
+    """
+    clock = int(round(macro_clock / 0.1e-9))
+    if not 0 < clock < 2 ** 24:
+        raise ValueError("macro_clock must be between 0.1 ns and 1.6 ms.")
+    h = 0x80000000 | (routing_bits << 27) | clock
+    fp.write(struct.pack("<I", h))
@@ -1,3 +1,5 @@
+from typing import NamedTuple
+
 import numba as nb
 import numpy as np
 
@@ -25,7 +27,7 @@ def _bit_get_reverse(value, shift, length):
 
 
 @nb.njit
-def _read_events(records, nb_records, syncrate, resolution):
+def _read_events(records, nb_records):
     """
     read the BH records from an array-like object
 
@@ -36,10 +38,6 @@ def _read_events(records, nb_records, syncrate, resolution):
 
     nb_records: number of records in file.
 
-    syncrate: synchronization rate in Hz.
-
-    resolution: TAC resolution in s.
-
     Returns
     --------
 
@@ -47,19 +45,42 @@ def _read_events(records, nb_records, syncrate, resolution):
 
     dtime: int16 array
 
-    truetime: double array
+    macrotime: int64 array, in number of macro clock periods
     """
 
-    syncperiod = 1.0e9 / syncrate
-    ofltime = np.uint64(0)
-    truensync = 0.0
-    event = 0
+    records = records[:nb_records]
+    channels = np.empty(len(records), dtype=np.int16)
+    dtimes = np.empty(len(records), dtype=np.int16)
+    macrotimes = np.empty(len(records), dtype=np.int64)
+
+    event = _decode_events(records, 0, channels, dtimes, macrotimes)
+    return channels[:event], dtimes[:event], macrotimes[:event]
+
+
+@nb.njit
+def _decode_events(records, ofltime, channels, dtimes, macrotimes):
+    """
+    decode BH records into preallocated arrays
+
+    Parameters
+    -----------
+
+    records: an array like object over the uint32 records.
+
+    ofltime: macro time overflow accumulated up to the first record.
+
+    channels, dtimes, macrotimes: output arrays.
+
+    Returns
+    --------
 
-    channels = np.empty(nb_records, dtype=np.int16)
-    dtimes = np.empty(nb_records, dtype=np.int16)
-    truetimes = np.empty(nb_records, dtype=np.double)
+    event: number of events written.
+    """
+
+    ofltime = np.int64(ofltime)
+    event = 0
 
-    for n in range(nb_records):
+    for n in range(len(records)):
 
         record = records[n]
 
@@ -77,7 +98,6 @@ def _read_events(records, nb_records, syncrate, resolution):
         if has_mtov:
             ofltime += 0x1000
 
-        truensync = 1.0 * ofltime + 1.0 * (record & 0x00000FFF)
         chan = _bit_get(record, 12, 4)
 
         if is_marker:
@@ -87,14 +107,102 @@ def _read_events(records, nb_records, syncrate, resolution):
             dtimes[event] = 4096 - _bit_get(record, 16, 12)
 
         channels[event] = chan
-        dtime = 4096 - _bit_get(record, 32 - 16, 12)
-        truetimes[event] = truensync * syncperiod + dtime * resolution
+        macrotimes[event] = ofltime + (record & 0x00000FFF)
         event += 1
 
-    return channels[:event], dtimes[:event], truetimes[:event]
+    return event
 
 
-def read_records(fname_or_fp, nb_records, offset, syncrate, resolution):
+@nb.njit
+def _count_events(records):
+    """
+    count the macro time overflow and number of events in BH records
+
+    Returns
+    --------
+
+    ofltime: macro time overflow accumulated over the records.
+
+    events: number of events that _decode_events would write.
+    """
+    ofltime = 0
+    events = 0
+    for n in range(len(records)):
+        record = records[n]
+
+        is_invalid = 0 != _bit_get(record, 31, 1)
+        has_mtov = 0 != _bit_get(record, 30, 1)
+        is_marker = 0 != _bit_get(record, 28, 1)
+
+        if is_invalid and not is_marker:
+            if has_mtov:
+                ofltime += 0x1000 * (record & 0x0FFFFFFF)
+            continue
+
+        if has_mtov:
+            ofltime += 0x1000
+        events += 1
+
+    return ofltime, events
+
+
+@nb.njit(parallel=True)
+def _read_events_parallel(records, nb_records, nb_chunks):
+    """
+    read the BH records from an array-like object using multiple threads
+
+    The records are split in chunks, whose overflow and number of events are
+    counted in parallel. Their cumulative sums give the starting overflow and
+    output position of each chunk, which are then decoded independently.
+    The result is identical to _read_events.
+
+    Parameters
+    -----------
+
+    records: an array like object over the uint32 records.
+
+    nb_records: number of records in file.
+
+    nb_chunks: number of chunks to split the records into.
+
+    Returns
+    --------
+
+    channel: int16 array
+
+    dtime: int16 array
+
+    macrotime: int64 array, in number of macro clock periods
+    """
+    records = records[:nb_records]
+    bounds = np.linspace(0, len(records), nb_chunks + 1).astype(np.int64)
+
+    ofltimes = np.zeros(nb_chunks + 1, dtype=np.int64)
+    events = np.zeros(nb_chunks + 1, dtype=np.int64)
+    for c in nb.prange(nb_chunks):
+        ofltimes[c + 1], events[c + 1] = _count_events(
+            records[bounds[c] : bounds[c + 1]]
+        )
+    ofltimes = np.cumsum(ofltimes)
+    events = np.cumsum(events)
+
+    channels = np.empty(events[-1], dtype=np.int16)
+    dtimes = np.empty(events[-1], dtype=np.int16)
+    macrotimes = np.empty(events[-1], dtype=np.int64)
+    for c in nb.prange(nb_chunks):
+        start, stop = events[c], events[c + 1]
+        _decode_events(
+            records[bounds[c] : bounds[c + 1]],
+            ofltimes[c],
+            channels[start:stop],
+            dtimes[start:stop],
+            macrotimes[start:stop],
+        )
+
+    return channels, dtimes, macrotimes
+
+
+def read_records(fname_or_fp, nb_records, offset, parallel=False):
     """
     read records of a pt3/ptu file
 
@@ -107,10 +215,7 @@ def read_records(fname_or_fp, nb_records, offset, syncrate, resolution):
 
     offset: number of bytes to skip until the start of the records.
 
-    syncrate: synchronization rate in Hz.
-
-    resolution: TAC resolution in s.
-
+    parallel: if True, records are decoded using all numba threads.
 
     Returns
     -------
@@ -119,28 +224,183 @@ def read_records(fname_or_fp, nb_records, offset, syncrate, resolution):
 
     dtime: int16 array
 
-    truetime: double array
+    macrotime: int64 array
     """
 
     if isinstance(fname_or_fp, str):
         with open(fname_or_fp, mode="rb") as fp:
-            read_records(fp, nb_records, offset, syncrate, resolution)
+            read_records(fp, nb_records, offset, parallel)
 
     fp = fname_or_fp
 
     records = np.memmap(fp, dtype="uint32", mode="r", offset=offset)
-    channels, dtimes, truetimes = _read_events(
-        records, nb_records, syncrate, resolution
+    if parallel:
+        channels, dtimes, macrotimes = _read_events_parallel(
+            records, nb_records, 4 * nb.get_num_threads()
+        )
+    else:
+        channels, dtimes, macrotimes = _read_events(records, nb_records)
+
+    return channels, dtimes, macrotimes
+
+
+class MarkerIndex(NamedTuple):
+    """Record offsets and macrotimes of frame and line markers."""
+
+    frame_offsets: np.ndarray
+    frame_times: np.ndarray
+    line_start_offsets: np.ndarray
+    line_start_times: np.ndarray
+
+
+@nb.njit
+def _index_markers(records, lsm_frame, lsm_line_start):
+    """
+    find the record offset and macrotime of frame and line markers
+
+    Returns
+    --------
+
+    offsets: int64 array of record offsets.
+
+    macrotimes: int64 array of macrotimes.
+
+    is_frame: bool array, True for frame markers.
+
+    is_line: bool array, True for line start markers.
+    """
+    offsets = nb.typed.List.empty_list(nb.int64)
+    macrotimes = nb.typed.List.empty_list(nb.int64)
+    kinds = nb.typed.List.empty_list(nb.int64)
+
+    ofltime = np.int64(0)
+    for n in range(len(records)):
+        record = records[n]
+
+        is_invalid = 0 != _bit_get(record, 31, 1)
+        has_mtov = 0 != _bit_get(record, 30, 1)
+        is_marker = 0 != _bit_get(record, 28, 1)
+
+        if is_invalid and not is_marker:
+            if has_mtov:
+                ofltime += 0x1000 * (record & 0x0FFFFFFF)
+            continue
+
+        if has_mtov:
+            ofltime += 0x1000
+
+        if is_marker:
+            chan = _bit_get(record, 12, 4)
+            if chan & (lsm_frame | lsm_line_start):
+                offsets.append(n)
+                macrotimes.append(ofltime + (record & 0x00000FFF))
+                kinds.append(chan)
+
+    nb_markers = len(offsets)
+    out = np.empty((3, nb_markers), dtype=np.int64)
+    for i in range(nb_markers):
+        out[0, i] = offsets[i]
+        out[1, i] = macrotimes[i]
+        out[2, i] = kinds[i]
+    return out[0], out[1], (out[2] & lsm_frame) != 0, (out[2] & lsm_line_start) != 0
+
+
+def index_AI_markers(records, lsm_frame, lsm_line_start):
+    """
+    build an index of the frame and line markers of BH records
+
+    Parameters
+    ----------
+
+    records: uint32 array of records.
+
+    lsm_frame: marker for lsm frame
+
+    lsm_line_start: marker for lsm line start
+
+    Returns
+    --------
+
+    MarkerIndex
+    """
+    offsets, macrotimes, is_frame, is_line = _index_markers(
+        records, lsm_frame, lsm_line_start
     )
+    return MarkerIndex(
+        offsets[is_frame], macrotimes[is_frame], offsets[is_line], macrotimes[is_line]
+    )
+
+
+def read_AI_range(
+    records,
+    index,
+    start,
+    stop,
+    lsm_frame,
+    lsm_line_start,
+    lsm_pixel_start,
+    pixel_dwell_time,
+):
+    """
+    decode and interpret only the frames between two frame markers
+
+    Parameters
+    ----------
 
-    return channels, dtimes, truetimes
+    records: uint32 array of records.
+
+    index: MarkerIndex, as returned by index_AI_markers.
+
+    start: first frame.
+
+    stop: frame after the last one.
+
+    Returns
+    --------
+
+    x: x coordinates of photons
+
+    y: y coordinates of photons
+
+    f: frame
+
+    d: dtime
+    """
+    offsets = index.frame_offsets
+    first = offsets[start]
+    last = offsets[stop] if stop < offsets.size else len(records)
+
+    record = int(records[first])
+    ofltime = index.frame_times[start] - (record & 0x00000FFF)
+    if _bit_get(record, 30, 1):
+        ofltime -= 0x1000
+
+    chunk = records[first:last]
+    channels = np.empty(len(chunk), dtype=np.int16)
+    dtimes = np.empty(len(chunk), dtype=np.int16)
+    macrotimes = np.empty(len(chunk), dtype=np.int64)
+    event = _decode_events(chunk, ofltime, channels, dtimes, macrotimes)
+
+    x, y, f, d, _, _ = interpret_AI(
+        channels[:event],
+        dtimes[:event],
+        macrotimes[:event],
+        0,
+        0,
+        lsm_frame,
+        lsm_line_start,
+        lsm_pixel_start,
+        pixel_dwell_time,
+    )
+    f += start
+    return x, y, f, d
 
 
 @nb.njit
 def interpret_AI(
     channel,
     dtime,
-    truetime,
+    macrotime,
     pixX,
     pixY,
     lsm_frame,
@@ -149,7 +409,7 @@ def interpret_AI(
     pixel_dwell_time,
 ):
     """
-    calculate the x, y position and the frame from truetime
+    calculate the x, y position and the frame from pixel markers
 
     Parameters
     ----------
@@ -158,7 +418,7 @@ def interpret_AI(
 
     dtime: int16 array
 
-    truetime: double array
+    macrotime: int64 array
 
     pixX: pixels in x
 
@@ -237,7 +497,7 @@ def interpret_AI(
                 x_pos += 1
 
         elif frame >= 0 and line >= 0 and x_pos >= 0:
-            # x_pos = (truetime[i] - line_start) / line_time * 1.0 * (pixX - 1)
+            # x_pos = (macrotime[i] - line_start) / line_time * 1.0 * (pixX - 1)
             x[events_in_range] = np.int16(x_pos)
             y[events_in_range] = line
             f[events_in_range] = frame
@@ -0,0 +1,223 @@
+"""Writer of synthetic Becker&Hickl .spc files."""
+
+import numba as nb
+import numpy as np
+
+from ..functions import WRITER_TAC_BINS
+from .bh_header import write_header_spc
+
+MACRO_WRAP_AROUND = 0x1000
+
+INVALID = 0x80000000
+MTOV = 0x40000000
+MARK = 0x10000000
+
+
+@nb.njit
+def _append_record(records, n, ofltime, macrotime, value):
+    """
+    append a record, preceded by a macro time overflow record if needed
+
+    Returns
+    --------
+
+    n: number of records written.
+
+    ofltime: overflow time after the record.
+    """
+    overflows = (macrotime - ofltime) // MACRO_WRAP_AROUND
+    if overflows > 0:
+        records[n] = INVALID | MTOV | overflows
+        ofltime += overflows * MACRO_WRAP_AROUND
+        n += 1
+    records[n] = value | (macrotime - ofltime)
+    return n + 1, ofltime
+
+
+@nb.njit
+def _encode_AI_frame(
+    counts,
+    dtime,
+    channel,
+    pixel_clocks,
+    macrotime,
+    ofltime,
+    lsm_frame,
+    lsm_line_start,
+    lsm_pixel_start,
+    records,
+):
+    """
+    encode a frame of a scan as BH records with frame, line and pixel markers
+
+    The frame marker is followed, for each line, by a line start marker
+    and the photons of each pixel, each pixel ending with a pixel marker.
+    Hence, interpret_AI counts the pixel markers since the line start as
+    the x coordinate.
+
+    Parameters
+    ----------
+
+    counts: int array of shape (pixY, pixX), number of photons per pixel.
+
+    dtime: int array of TAC bins of the photons, sorted by pixel, as
+        read by SPC (ADC value 4095 - dtime).
+
+    channel: routing channel, from 0 to 15.
+
+    pixel_clocks: pixel dwell time in macro clock periods.
+
+    macrotime: macro clock periods since the start, at the frame marker.
+
+    ofltime: overflow time up to the previous record.
+
+    records: uint32 output array, large enough for the frame.
+
+    Returns
+    --------
+
+    n: number of records written.
+
+    macrotime: at the start of the next frame.
+
+    ofltime: overflow time after the last record.
+    """
+    pixY, pixX = counts.shape
+    photon = np.uint32(channel) << 12
+
+    n, ofltime = _append_record(
+        records, 0, ofltime, macrotime, np.uint32(INVALID | MARK | (lsm_frame << 12))
+    )
+    i = 0
+    for y in range(pixY):
+        line_start = macrotime + y * pixel_clocks * pixX
+        n, ofltime = _append_record(
+            records,
+            n,
+            ofltime,
+            line_start,
+            np.uint32(INVALID | MARK | (lsm_line_start << 12)),
+        )
+        for x in range(pixX):
+            num = counts[y, x]
+            pixel_start = line_start + x * pixel_clocks
+            for k in range(num):
+                n, ofltime = _append_record(
+                    records,
+                    n,
+                    ofltime,
+                    pixel_start + (k * pixel_clocks) // num,
+                    photon | (np.uint32(WRITER_TAC_BINS - 1 - dtime[i]) << 16),
+                )
+                i += 1
+            n, ofltime = _append_record(
+                records,
+                n,
+                ofltime,
+                pixel_start + pixel_clocks,
+                np.uint32(INVALID | MARK | (lsm_pixel_start << 12)),
+            )
+
+    return n, macrotime + pixY * pixel_clocks * pixX, ofltime
+
+
+class SPCWriter:
+    """Stream a synthetic scan to a Becker&Hickl .spc file.
+
+    Frames are encoded and appended one at a time, so that files larger
+    than memory can be written. Markers follow the defaults of SPC:
+    frame 0x04, line start 0x02 and pixel 0x01. Use as a context manager::
+
+        with SPCWriter("synthetic.spc", macro_clock=12.5e-9) as writer:
+            for counts, dtime in frames:
+                writer.write_frame(counts, dtime)
+
+    The file is read with SPC(file, tac_range=writer.tac_range).
+
+    Parameters
+    ----------
+    file : os.PathLike
+    macro_clock : float, optional
+        Macro time clock in s, a multiple of 0.1 ns, which is the
+        inverse of syncrate.
+    tac_range : float, optional
+        TAC range in s, spanning 4096 TAC bins. By default, macro_clock.
+    pixel_clocks : int, optional
+        Pixel dwell time in macro clock periods.
+    channel : int, optional
+        Routing channel of the photons, from 0 to 15.
+    """
+
+    lsm_frame = 0x04
+    lsm_line_start = 0x02
+    lsm_pixel_start = 0x01
+
+    def __init__(
+        self, file, macro_clock=12.5e-9, tac_range=None, pixel_clocks=80, channel=0
+    ):
+        if pixel_clocks < 1:
+            raise ValueError("pixel_clocks must be at least 1.")
+        if not 0 <= channel <= 15:
+            raise ValueError("channel must be between 0 and 15.")
+
+        self.macro_clock = macro_clock
+        self.tac_range = macro_clock if tac_range is None else tac_range
+        self.syncrate = 1 / macro_clock
+        self.resolution = self.tac_range / WRITER_TAC_BINS
+        self.pixel_clocks = pixel_clocks
+        self.channel = channel
+        self.num_records = 0
+        self.num_frames = 0
+        self._macrotime = 0
+        self._ofltime = 0
+
+        self._file = open(file, "wb")
+        write_header_spc(self._file, macro_clock)
+
+    def write_frame(self, counts, dtime):
+        """Append a frame.
+
+        Parameters
+        ----------
+        counts : int array of shape (pixY, pixX)
+            Number of photons of each pixel.
+        dtime : int array
+            TAC bins of the photons, sorted by pixel in C order.
+        """
+        counts = np.asarray(counts)
+        dtime = np.asarray(dtime)
+        if counts.ndim != 2:
+            raise ValueError("counts must be 2D.")
+        if dtime.size != counts.sum():
+            raise ValueError("dtime must have one TAC bin per photon.")
+        if dtime.size > 0 and not 0 <= dtime.min() <= dtime.max() < WRITER_TAC_BINS:
+            raise ValueError(f"dtime must be between 0 and {WRITER_TAC_BINS - 1}.")
+
+        # One marker per frame, line and pixel, and at most one overflow
+        # record before each record.
+        max_records = 2 * (dtime.size + counts.size + counts.shape[0] + 1)
+        records = np.empty(max_records, dtype=np.uint32)
+        n, self._macrotime, self._ofltime = _encode_AI_frame(
+            counts,
+            dtime,
+            self.channel,
+            self.pixel_clocks,
+            self._macrotime,
+            self._ofltime,
+            self.lsm_frame,
+            self.lsm_line_start,
+            self.lsm_pixel_start,
+            records,
+        )
+        records[:n].tofile(self._file)
+        self.num_records += n
+        self.num_frames += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,136 @@
+"""Persistent cache of interpreted photon tables."""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class PhotonCache:
+    """On-disk cache of photon arrays, stored as memory-mappable .npy files.
+
+    Each entry is a directory named after its key, holding one .npy file
+    per array and a meta.json with scalar attributes.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+        Cache directory. Created if it does not exist.
+    max_size : int, optional
+        Maximum total size in bytes. When exceeded, the least recently
+        used entries are evicted. By default, the size is unbounded.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = pathlib.Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(path, **params):
+        """Key identifying a file by path, size and modification time.
+
+        Parameters
+        ----------
+        path : os.PathLike
+            File from which the arrays are computed.
+        params : dict
+            Reader parameters affecting the arrays.
+        """
+        stat = os.stat(path)
+        identity = (
+            str(pathlib.Path(path).resolve()),
+            stat.st_size,
+            stat.st_mtime_ns,
+            sorted(params.items()),
+        )
+        return hashlib.sha1(repr(identity).encode()).hexdigest()
+
+    def load(self, key):
+        """Load an entry.
+
+        Returns
+        -------
+        arrays : dict of read-only memory-mapped ndarrays
+        attrs : dict
+        If there is no entry for key, returns None. Unreadable entries,
+        e.g. truncated by an interrupted save, are removed.
+        """
+        entry = self.directory / key
+        try:
+            with open(entry / "meta.json") as file:
+                meta = json.load(file)
+            arrays = {
+                name: np.load(entry / f"{name}.npy", mmap_mode="r")
+                for name in meta["arrays"]
+            }
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        os.utime(entry)  # Mark as recently used.
+        return arrays, meta["attrs"]
+
+    def save(self, key, arrays, **attrs):
+        """Save an entry, and evict old ones if the cache is over max_size.
+
+        Parameters
+        ----------
+        key : str
+        arrays : dict of ndarrays
+        attrs : JSON-serializable scalars
+        """
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.directory))
+        for name, array in arrays.items():
+            np.save(tmp / f"{name}.npy", array)
+        with open(tmp / "meta.json", "w") as file:
+            json.dump({"arrays": list(arrays), "attrs": attrs}, file)
+
+        try:
+            os.replace(tmp, self.directory / key)
+        except OSError:  # Saved concurrently by another process.
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def _entries(self):
+        """Entries sorted from least to most recently used, with their size."""
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            size = sum(file.stat().st_size for file in entry.iterdir())
+            entries.append((entry.stat().st_mtime, entry, size))
+        entries.sort()
+        return [(entry, size) for _, entry, size in entries]
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until size <= max_size."""
+        if self.max_size is None:
+            return
+
+        entries = self._entries()
+        total = sum(size for _, size in entries)
+        for entry, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for entry, _ in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def as_cache(cache):
+    """Convert a directory to a PhotonCache. None and PhotonCache pass through."""
+    if cache is None or isinstance(cache, PhotonCache):
+        return cache
+    return PhotonCache(cache)
@@ -0,0 +1,208 @@
+"""Index of the headers of the FLIM files in a directory tree.
+
+The catalog is a NumPy structured array with one row per file, so that
+queries are array filters. For instance, to find all 256x256 LSM
+acquisitions at 80 MHz::
+
+    catalog = update_catalog("path/to/archive")
+    selected = catalog[
+        (catalog["pixX"] == 256)
+        & (catalog["pixY"] == 256)
+        & (catalog["scanner"] == 3)
+        & np.isclose(catalog["syncrate"], 80e6)
+    ]
+"""
+
+import multiprocessing
+import os
+import pathlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .becker_hickl.bh_header import read_header_spc
+from .picoquant import pq_header
+
+SUFFIXES = (".ptu", ".pt3", ".spc")
+
+CATALOG_FILENAME = ".pyflim-catalog.npy"
+
+# Header fields. Unknown values are -1 for integers and nan for floats.
+# path is added with the width of the longest path.
+HEADER_FIELDS = [
+    ("format", "U3"),
+    ("size", "i8"),
+    ("mtime_ns", "i8"),
+    ("num_records", "i8"),
+    ("syncrate", "f8"),
+    ("resolution", "f8"),
+    ("scanner", "i4"),
+    ("pixX", "i4"),
+    ("pixY", "i4"),
+]
+
+PTU_TAGS = (
+    "TTResult_NumberOfRecords",
+    "TTResult_SyncRate",
+    "MeasDesc_Resolution",
+    "ImgHdr_Ident",
+    "ImgHdr_PixX",
+    "ImgHdr_PixY",
+)
+
+
+def catalog_dtype(path_length=1):
+    return np.dtype([("path", f"U{max(path_length, 1)}")] + HEADER_FIELDS)
+
+
+def read_entry(path):
+    """Read the catalog fields of a file from its header.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        A .ptu, .pt3 or .spc file.
+
+    Returns
+    -------
+    entry : tuple
+        Values of HEADER_FIELDS.
+    """
+    path = pathlib.Path(path)
+    stat = path.stat()
+    file_format = path.suffix.lower()[1:]
+
+    if file_format == "ptu":
+        header, _ = pq_header.read_header_ptu(path, tags=PTU_TAGS)
+        num_records = header.get("TTResult_NumberOfRecords", -1)
+        syncrate = header.get("TTResult_SyncRate", np.nan)
+        resolution = header.get("MeasDesc_Resolution", np.nan)
+        scanner = header.get("ImgHdr_Ident", -1)
+        pixX = header.get("ImgHdr_PixX", -1)
+        pixY = header.get("ImgHdr_PixY", -1)
+    elif file_format == "pt3":
+        header, _ = pq_header.read_header_pt3(path)
+        num_records = header["Records"]
+        syncrate = header["CntRate0"]
+        resolution = header["Resolution"] * 1e-9  # Header value in ns, resolution in s.
+        scanner = header["Ident"]
+        pixX = header.get("PixX", -1)
+        pixY = header.get("PixY", -1)
+    elif file_format == "spc":
+        # TAC range and image size are not stored in .spc headers.
+        header, _ = read_header_spc(path)
+        num_records = header["num_records"]
+        syncrate = 1 / header["macro_clock"]
+        resolution = np.nan
+        scanner = pixX = pixY = -1
+    else:
+        raise ValueError(f"Unknown file format: {path.suffix}")
+
+    return (
+        file_format,
+        stat.st_size,
+        stat.st_mtime_ns,
+        num_records,
+        syncrate,
+        resolution,
+        scanner,
+        pixX,
+        pixY,
+    )
+
+
+def _try_read_entry(path):
+    try:
+        return read_entry(path)
+    except Exception as e:
+        return e
+
+
+def find_files(directory):
+    """Yield the .ptu, .pt3 and .spc files under directory, recursively."""
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(SUFFIXES):
+                yield pathlib.Path(root, filename)
+
+
+def load_catalog(file):
+    """Load a catalog saved by update_catalog."""
+    return np.load(file, allow_pickle=False)
+
+
+def update_catalog(directory, catalog_file=None, n_workers=None):
+    """Index the headers of the FLIM files in a directory tree.
+
+    Only files that are new or changed since the last update, as given
+    by their size and modification time, have their headers read, using
+    a pool of processes. Files that cannot be read are skipped with a
+    warning.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+    catalog_file : os.PathLike, optional
+        Where the catalog is stored. By default, CATALOG_FILENAME inside
+        directory. If the file exists, it is updated.
+    n_workers : int, optional
+        Number of processes. By default, os.cpu_count(). If 1, headers
+        are read in the current process.
+
+    Returns
+    -------
+    catalog : structured ndarray
+        One row per file, sorted by path, which is relative to directory.
+    """
+    directory = pathlib.Path(directory)
+    if catalog_file is None:
+        catalog_file = directory / CATALOG_FILENAME
+
+    previous = {}
+    if os.path.exists(catalog_file):
+        for row in load_catalog(catalog_file):
+            previous[row["path"]] = row
+
+    entries, pending = {}, []
+    for path in find_files(directory):
+        relpath = path.relative_to(directory).as_posix()
+        stat = path.stat()
+        row = previous.get(relpath)
+        if (
+            row is not None
+            and row["size"] == stat.st_size
+            and row["mtime_ns"] == stat.st_mtime_ns
+        ):
+            entries[relpath] = tuple(row[name] for name, _ in HEADER_FIELDS)
+        else:
+            pending.append(relpath)
+
+    paths = [directory / relpath for relpath in pending]
+    if n_workers == 1 or len(paths) <= 1:
+        results = list(map(_try_read_entry, paths))
+    else:
+        n_workers = n_workers or os.cpu_count()
+        chunksize = max(1, len(paths) // (4 * n_workers))
+        # Forking a process after numba threads were started can deadlock.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+            results = list(executor.map(_try_read_entry, paths, chunksize=chunksize))
+
+    for relpath, result in zip(pending, results):
+        if isinstance(result, Exception):
+            warnings.warn(f"Skipping {relpath}: {result!r}")
+        else:
+            entries[relpath] = result
+
+    path_length = max(map(len, entries), default=1)
+    catalog = np.array(
+        [(relpath, *entries[relpath]) for relpath in sorted(entries)],
+        dtype=catalog_dtype(path_length),
+    )
+
+    # Write and rename, so that readers never see a partial catalog.
+    tmp_file = pathlib.Path(f"{catalog_file}.tmp.npy")
+    np.save(tmp_file, catalog)
+    os.replace(tmp_file, catalog_file)
+    return catalog
@@ -1,6 +1,46 @@
+from typing import NamedTuple
+
 import numba as nb
 import numpy as np
 
+# Number of TAC bins of the 12-bit records written by PTUWriter and SPCWriter.
+WRITER_TAC_BINS = 4096
+
+
+def truetime(macrotime, dtime, syncrate, resolution):
+    """Compute photon arrival times in seconds.
+
+    Parameters
+    ----------
+    macrotime : array_like
+        Number of synchronization periods since the start of the measurement.
+    dtime : array_like
+        TAC bin.
+    syncrate : float
+        Synchronization rate in Hz.
+    resolution : float
+        TAC resolution in s.
+    """
+    return macrotime / syncrate + dtime * resolution
+
+
+def check_range(start, stop, size, first=0):
+    """Raise IndexError unless first <= start < size and start < stop.
+
+    Parameters
+    ----------
+    start, stop : int
+        Range of frames or lines.
+    size : int
+        Number of frames or lines.
+    first : int, optional
+        Smallest valid start.
+    """
+    if not first <= start < size:
+        raise IndexError(f"start={start} is out of range [{first}, {size}).")
+    if stop <= start:
+        raise IndexError(f"stop={stop} must be greater than start={start}.")
+
 
 def histogram(dtime, x, y, num_TAC_bins, mask=None):
     """Compute the histogram of the measurement.
@@ -20,7 +60,16 @@ def histogram(dtime, x, y, num_TAC_bins, mask=None):
 
 
 def fourier_image(
-    image_shape, harmonics, dtime, x, y, num_TAC_bins, TAC_period, mask=None
+    image_shape,
+    harmonics,
+    dtime,
+    x,
+    y,
+    num_TAC_bins,
+    TAC_period,
+    mask=None,
+    parallel=False,
+    method="photons",
 ):
     """Compute complex fourier coefficients for every pixel in the image.
 
@@ -40,18 +89,288 @@ def fourier_image(
         the laser stability some photons can arrive later.
     mask : ndarray of bools of shape (y_dim, x_dim), optional
         Image will be calculated only where mask == True.
+    parallel : bool, optional
+        If True, photons are split across numba threads, each one
+        accumulating into its own partial image, which are summed at
+        the end. Requires an extra image per thread.
+    method : {"photons", "decay"}, optional
+        If "photons", coefficients are accumulated photon by photon,
+        with a cost proportional to the number of harmonics. If "decay",
+        photons are first binned into a decay image, which is then
+        contracted with complex_exp in a single matrix product.
 
     Returns
     -------
     image : ndarray of shape (num_harmonics, y_dim, x_dim)
     """
+    if method == "decay":
+        decay = decay_image(image_shape, dtime, x, y, num_TAC_bins, mask=mask)
+        return fourier_from_decay(decay, harmonics, TAC_period)
+    elif method != "photons":
+        raise ValueError(f"Unknown method: {method}")
+
     image = np.zeros((len(harmonics), *image_shape), dtype=complex)
-    _fourier_image(
-        image, complex_exp(harmonics, num_TAC_bins, TAC_period), dtime, x, y, mask=mask
-    )
+    exp = complex_exp(harmonics, num_TAC_bins, TAC_period)
+    if parallel:
+        _fourier_image_parallel(
+            image, exp, dtime, x, y, nb.get_num_threads(), mask=mask
+        )
+    else:
+        _fourier_image(image, exp, dtime, x, y, mask=mask)
     return image
 
 
+def decay_image(
+    image_shape,
+    dtime,
+    x,
+    y,
+    num_TAC_bins,
+    TAC_binning=1,
+    mask=None,
+    dtype=np.uint32,
+):
+    """Compute the histogram of photon arrival times for every pixel.
+
+    Parameters
+    ----------
+    image_shape : tuple of ints (y_dim, x_dim)
+        Output image shape.
+    dtime, x, y: array_like
+        TAC bin, x and y coordinates of photons
+    num_TAC_bins : int
+        Number of bins with non-zero photons (dtime.max + 1)
+    TAC_binning : int, optional
+        Number of consecutive TAC bins summed in each bin of the output.
+    mask : ndarray of bools of shape (y_dim, x_dim), optional
+        Image will be calculated only where mask == True.
+    dtype : integer dtype, optional
+        Output dtype. A smaller dtype, such as np.uint16, reduces memory
+        usage, but overflows if a bin has more photons than it can hold.
+
+    Returns
+    -------
+    decay : ndarray of shape (num_bins, y_dim, x_dim)
+        where num_bins = ceil(num_TAC_bins / TAC_binning).
+    """
+    num_bins = -(-num_TAC_bins // TAC_binning)
+    decay = np.zeros((num_bins, *image_shape), dtype=dtype)
+    _decay_image(decay, dtime, x, y, TAC_binning, mask=mask)
+    return decay
+
+
+def fourier_from_decay(
+    decay, harmonics, TAC_period, TAC_binning=1, pixels_per_block=4096
+):
+    """Compute complex fourier coefficients from a decay image.
+
+    Parameters
+    ----------
+    decay : ndarray of shape (num_bins, ...)
+        Decay image, as returned by decay_image.
+    harmonics : array_like
+        Harmonics to compute.
+    TAC_period : float
+        Number of bins corresponding to time between laser pulses.
+    TAC_binning : int, optional
+        TAC binning of decay. If larger than 1, the complex exponential
+        is averaged over the TAC bins in each bin of decay, which
+        assumes photons are uniformly distributed within a bin.
+    pixels_per_block : int, optional
+        Number of pixels cast to float at a time, which bounds the
+        temporary memory to num_bins * pixels_per_block floats.
+
+    Returns
+    -------
+    image : ndarray of shape (num_harmonics, ...)
+    """
+    num_bins = decay.shape[0]
+    exp = complex_exp(harmonics, num_bins * TAC_binning, TAC_period)
+    exp = exp.reshape(num_bins, TAC_binning, -1).mean(axis=1)
+
+    # Real matrix products, to avoid casting decay to complex.
+    exp_T = np.concatenate((exp.real.T, exp.imag.T))
+    flat_decay = decay.reshape(num_bins, -1)
+    num_harmonics = exp.shape[1]
+    image = np.empty((num_harmonics, flat_decay.shape[1]), dtype=complex)
+    for start in range(0, flat_decay.shape[1], pixels_per_block):
+        block = slice(start, start + pixels_per_block)
+        product = exp_T @ flat_decay[:, block].astype(float)
+        image.real[:, block] = product[:num_harmonics]
+        image.imag[:, block] = product[num_harmonics:]
+    return image.reshape(num_harmonics, *decay.shape[1:])
+
+
+def fourier_stack(
+    image_shape,
+    harmonics,
+    dtime,
+    x,
+    y,
+    f,
+    num_TAC_bins,
+    TAC_period,
+    frame_range=None,
+    frame_binning=1,
+    mask=None,
+):
+    """Compute complex fourier coefficients for every pixel of every frame.
+
+    Parameters
+    ----------
+    image_shape : tuple of ints (y_dim, x_dim)
+        Output image shape.
+    harmonics : array_like
+        Harmonics to compute.
+    dtime, x, y, f: array_like
+        TAC bin, x and y coordinates and frame of photons
+    num_TAC_bins : int
+        Number of bins with non-zero photons (dtime.max + 1)
+    TAC_period : float
+        Number of bins corresponding to time between laser pulses.
+    frame_range : tuple of ints (first, last), optional
+        Frames to include. By default, (f.min(), f.max()).
+    frame_binning : int, optional
+        Number of consecutive frames summed in each image of the stack.
+    mask : ndarray of bools of shape (y_dim, x_dim), optional
+        Image will be calculated only where mask == True.
+
+    Returns
+    -------
+    stack : ndarray of shape (num_frames, num_harmonics, y_dim, x_dim)
+    """
+    if frame_range is None:
+        frame_range = (f.min(), f.max()) if f.size > 0 else (0, -1)
+    first, last = frame_range
+    num_frames = (last - first) // frame_binning + 1
+    stack = np.zeros((num_frames, len(harmonics), *image_shape), dtype=complex)
+    _fourier_stack(
+        stack,
+        complex_exp(harmonics, num_TAC_bins, TAC_period),
+        dtime,
+        x,
+        y,
+        f,
+        first,
+        frame_binning,
+        mask=mask,
+    )
+    return stack
+
+
+def region_histograms(labels, dtime, x, y, num_TAC_bins):
+    """Compute the histogram of every labeled region.
+
+    Parameters
+    ----------
+    labels : ndarray of non-negative ints of shape (y_dim, x_dim)
+        Region of each pixel.
+    dtime, x, y: array_like
+        TAC bin, x and y coordinates of photons
+    num_TAC_bins : int
+        Number of bins with non-zero photons (dtime.max + 1)
+
+    Returns
+    -------
+    hists : ndarray of shape (labels.max() + 1, num_TAC_bins)
+    """
+    hists = np.zeros((labels.max() + 1, num_TAC_bins), dtype=int)
+    _region_histograms(hists, labels, dtime, x, y)
+    return hists
+
+
+def region_fourier(labels, harmonics, dtime, x, y, num_TAC_bins, TAC_period):
+    """Compute the sum of complex fourier coefficients of every labeled region.
+
+    Parameters
+    ----------
+    labels : ndarray of non-negative ints of shape (y_dim, x_dim)
+        Region of each pixel.
+    harmonics : array_like
+        Harmonics to compute.
+    dtime, x, y: array_like
+        TAC bin, x and y coordinates of photons
+    num_TAC_bins : int
+        Number of bins with non-zero photons (dtime.max + 1)
+    TAC_period : float
+        Number of bins corresponding to time between laser pulses.
+
+    Returns
+    -------
+    R : ndarray of shape (num_harmonics, labels.max() + 1)
+    """
+    R = np.zeros((len(harmonics), labels.max() + 1), dtype=complex)
+    _region_fourier(
+        R, labels, complex_exp(harmonics, num_TAC_bins, TAC_period), dtime, x, y
+    )
+    return R
+
+
+class PixelIndex(NamedTuple):
+    """Photons sorted by pixel, in compressed sparse row format.
+
+    The TAC bins of the photons in pixel p = y * x_dim + x are
+    dtime[offsets[p]:offsets[p + 1]], in order of arrival. Queries
+    restricted by a mask only visit the photons in the masked pixels.
+    """
+
+    image_shape: tuple
+    offsets: np.ndarray
+    dtime: np.ndarray
+
+    @classmethod
+    def from_photons(cls, image_shape, dtime, x, y):
+        """Sort photons by pixel.
+
+        Parameters
+        ----------
+        image_shape : tuple of ints (y_dim, x_dim)
+        dtime, x, y: array_like
+            TAC bin, x and y coordinates of photons
+        """
+        offsets = np.zeros(image_shape[0] * image_shape[1] + 1, dtype=np.int64)
+        dtime = _sort_by_pixel(offsets, dtime, x, y, image_shape[1])
+        return cls(tuple(image_shape), offsets, dtime)
+
+    def _pixels(self, mask):
+        if mask is None:
+            return np.arange(self.offsets.size - 1)
+        return np.flatnonzero(mask)
+
+    def histogram(self, num_TAC_bins, mask=None):
+        """Same as histogram, for the indexed photons."""
+        hist = np.zeros(num_TAC_bins, dtype=int)
+        _histogram_csr(hist, self.offsets, self.dtime, self._pixels(mask))
+        return hist
+
+    def decay_image(self, num_TAC_bins, TAC_binning=1, mask=None, dtype=np.uint32):
+        """Same as decay_image, for the indexed photons."""
+        num_bins = -(-num_TAC_bins // TAC_binning)
+        decay = np.zeros((num_bins, *self.image_shape), dtype=dtype)
+        _decay_image_csr(
+            decay, self.offsets, self.dtime, self._pixels(mask), TAC_binning
+        )
+        return decay
+
+    def fourier_image(
+        self, harmonics, num_TAC_bins, TAC_period, mask=None, parallel=False
+    ):
+        """Same as fourier_image, for the indexed photons.
+
+        If parallel, pixels are split across numba threads.
+        """
+        image = np.zeros((len(harmonics), *self.image_shape), dtype=complex)
+        kernel = _fourier_image_csr_parallel if parallel else _fourier_image_csr
+        kernel(
+            image,
+            complex_exp(harmonics, num_TAC_bins, TAC_period),
+            self.offsets,
+            self.dtime,
+            self._pixels(mask),
+        )
+        return image
+
+
 def complex_exp(harmonics, num_TAC_bins, TAC_period):
     """Generate a matrix for calculation of Fourier coefficients.
 
@@ -98,6 +417,103 @@ def _fourier_image(image, complex_exp, dtime, x, y, mask=None):
                     image[h, yi, xi] += complex_exp[dt, h]
 
 
+@nb.njit(parallel=True)
+def _fourier_image_parallel(image, complex_exp, dtime, x, y, num_chunks, mask=None):
+    """Numba-compiled function to compute fourier_image in parallel.
+
+    Photons are split in num_chunks contiguous chunks, accumulated into
+    one partial image each, which are then added to image.
+    """
+    partial = np.zeros((num_chunks,) + image.shape, dtype=image.dtype)
+    size = dtime.size
+    for i in nb.prange(num_chunks):
+        start = i * size // num_chunks
+        stop = (i + 1) * size // num_chunks
+        _fourier_image(
+            partial[i],
+            complex_exp,
+            dtime[start:stop],
+            x[start:stop],
+            y[start:stop],
+            mask=mask,
+        )
+
+    flat_image = image.reshape(-1)
+    flat_partial = partial.reshape(num_chunks, -1)
+    for j in nb.prange(flat_image.size):
+        for i in range(num_chunks):
+            flat_image[j] += flat_partial[i, j]
+
+
+@nb.njit
+def _fourier_stack(
+    stack, complex_exp, dtime, x, y, f, first_frame, frame_binning, mask=None
+):
+    """Numba-compiled function to compute fourier_stack.
+
+    Parameters
+    ----------
+    stack : complex ndarray of shape (num_frames, num_harmonics, y_dim, x_dim)
+        Output stack. Photons outside its frames are ignored.
+    complex_exp : ndarray
+        Complex wave of dimensions (num_TAC_bins, num_harmonics)
+    first_frame : int
+        Frame corresponding to stack[0].
+    frame_binning : int
+        Number of frames in each element of stack.
+    """
+
+    num_frames, num_harm = stack.shape[:2]
+    for dt, xi, yi, fi in zip(dtime, x, y, f):
+        if fi < first_frame:
+            continue
+        k = (fi - first_frame) // frame_binning
+        if k >= num_frames:
+            continue
+        if mask is not None:
+            if not mask[yi, xi]:
+                continue
+        for h in range(num_harm):
+            stack[k, h, yi, xi] += complex_exp[dt, h]
+
+
+@nb.njit
+def _decay_image(decay, dtime, x, y, TAC_binning, mask=None):
+    """Numba-compiled function to compute decay_image.
+
+    Parameters
+    ----------
+    decay : ndarray of shape (num_bins, y_dim, x_dim)
+        Output decay image.
+    TAC_binning : int
+        Number of TAC bins in each bin of decay.
+    """
+    if mask is None:
+        for dt, xi, yi in zip(dtime, x, y):
+            decay[dt // TAC_binning, yi, xi] += 1
+    else:
+        for dt, xi, yi in zip(dtime, x, y):
+            if mask[yi, xi]:
+                decay[dt // TAC_binning, yi, xi] += 1
+
+
+@nb.njit
+def _region_histograms(hists, labels, dtime, x, y):
+    """Numba-compiled function to compute region_histograms."""
+    for dt, xi, yi in zip(dtime, x, y):
+        hists[labels[yi, xi], dt] += 1
+
+
+@nb.njit
+def _region_fourier(R, labels, complex_exp, dtime, x, y):
+    """Numba-compiled function to compute region_fourier."""
+    num_harm = complex_exp.shape[1]
+    for dt, xi, yi in zip(dtime, x, y):
+        label = labels[yi, xi]
+        for h in range(num_harm):
+            R[h, label] += complex_exp[dt, h]
+
+
 @nb.njit
 def _histogram(hist, dtime, x, y, mask=None):
     """Numba-compiled function to compute histogram.
@@ -114,3 +530,67 @@ def _histogram(hist, dtime, x, y, mask=None):
         for dt, xi, yi in zip(dtime, x, y):
             if mask[yi, xi]:
                 hist[dt] += 1
+
+
+@nb.njit
+def _sort_by_pixel(offsets, dtime, x, y, x_dim):
+    """Counting sort of dtime by pixel.
+
+    Parameters
+    ----------
+    offsets : ndarray of zeros, of size num_pixels + 1
+        Output offsets of each pixel.
+
+    Returns
+    -------
+    dtime : ndarray
+        Sorted dtime.
+    """
+    for xi, yi in zip(x, y):
+        offsets[yi * x_dim + xi + 1] += 1
+    for p in range(1, offsets.size):
+        offsets[p] += offsets[p - 1]
+
+    position = offsets[:-1].copy()
+    sorted_dtime = np.empty_like(dtime)
+    for dt, xi, yi in zip(dtime, x, y):
+        p = yi * x_dim + xi
+        sorted_dtime[position[p]] = dt
+        position[p] += 1
+    return sorted_dtime
+
+
+@nb.njit
+def _histogram_csr(hist, offsets, dtime, pixels):
+    for p in pixels:
+        for k in range(offsets[p], offsets[p + 1]):
+            hist[dtime[k]] += 1
+
+
+@nb.njit
+def _decay_image_csr(decay, offsets, dtime, pixels, TAC_binning):
+    x_dim = decay.shape[2]
+    for p in pixels:
+        yi, xi = p // x_dim, p % x_dim
+        for k in range(offsets[p], offsets[p + 1]):
+            decay[dtime[k] // TAC_binning, yi, xi] += 1
+
+
+def _fourier_image_csr(image, complex_exp, offsets, dtime, pixels):
+    """Compute fourier_image of the photons in pixels.
+
+    Each pixel is written by a single iteration, so that the
+    loop over pixels can run in parallel.
+    """
+    num_harm = complex_exp.shape[1]
+    x_dim = image.shape[2]
+    for i in nb.prange(pixels.size):
+        p = pixels[i]
+        yi, xi = p // x_dim, p % x_dim
+        for k in range(offsets[p], offsets[p + 1]):
+            for h in range(num_harm):
+                image[h, yi, xi] += complex_exp[dtime[k], h]
+
+
+_fourier_image_csr_parallel = nb.njit(parallel=True)(_fourier_image_csr)
+_fourier_image_csr = nb.njit(_fourier_image_csr)
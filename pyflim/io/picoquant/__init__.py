@@ -5,7 +5,23 @@ from enum import Enum
 import numpy as np
 
 from ...flimds import UncorrectedFLIMds
-from ..functions import fourier_image, histogram
+from ..cache import as_cache
+from ..functions import (
+    PixelIndex,
+    _decay_image,
+    _fourier_stack,
+    _region_fourier,
+    _region_histograms,
+    check_range,
+    complex_exp,
+    decay_image,
+    fourier_from_decay,
+    fourier_image,
+    fourier_stack,
+    histogram,
+    region_fourier,
+    region_histograms,
+)
 from . import pq_header
 from . import pq_numba as pq
 
@@ -16,12 +32,42 @@ class Scanner(Enum):
 
 
 class PTU(UncorrectedFLIMds):
-    def __init__(self, filename):
+    """PicoQuant .ptu file.
+
+    Parameters
+    ----------
+    filename : os.PathLike
+    chunk_size : int, optional
+        If given, photons are not kept in memory. histogram and
+        fourier_image are accumulated in a single pass over the
+        memory-mapped records, and other photon queries decode and
+        interpret them in chunks of chunk_size records, keeping memory
+        usage bounded regardless of file size.
+    parallel : bool, optional
+        If True, records are decoded using all numba threads. It is also
+        the default for the parallel argument of fourier_image, which is
+        ignored if chunk_size is given.
+    cache : PhotonCache or os.PathLike, optional
+        If given, interpreted photons are stored in and loaded from
+        this cache, so that reopening the file only memory-maps them.
+        As photons are not kept with chunk_size, both cannot be given.
+
+    Only the header is read on construction. Records are decoded the
+    first time photons are needed, e.g. by histogram, fourier_image or
+    the x, y, f and dtime attributes.
+    """
+
+    def __init__(self, filename, chunk_size=None, parallel=False, cache=None):
+        if chunk_size is not None and cache is not None:
+            raise ValueError("cache cannot be used with chunk_size.")
         self.file = filename
+        self.chunk_size = chunk_size
+        self.parallel = parallel
+        self.cache = as_cache(cache)
 
         # Read header
         self.header, self.records_start = pq_header.read_header_ptu(self.file)
-        self.num_records = self.header[u"TTResult_NumberOfRecords"]
+        self.num_records = self.header["TTResult_NumberOfRecords"]
         self.syncrate = self.header["TTResult_SyncRate"]
         self.resolution = self.header["MeasDesc_Resolution"]
         self.pixX = self.header["ImgHdr_PixX"]
@@ -38,29 +84,214 @@ class PTU(UncorrectedFLIMds):
             raise NotImplementedError
 
         self.TAC_period = 1 / (self.resolution * self.syncrate)
+        self._marker_index = None
+        self._pixel_index = None
+        self._loaded = False
+
+    # Attributes computed from the records, on first use.
+    _lazy_attributes = (
+        "x",
+        "y",
+        "f",
+        "dtime",
+        "num_TAC_bins",
+        "frame_range",
+        "line_time",
+    )
+
+    def __getattr__(self, name):
+        # Only called if name is not found. Records are loaded at most once.
+        if name in self._lazy_attributes and not self.__dict__.get("_loaded", True):
+            self._load()
+            return getattr(self, name)
+        raise AttributeError(f"{type(self).__name__!r} has no attribute {name!r}")
+
+    def _load(self):
+        """Decode and interpret the records."""
+        if self.chunk_size is not None:
+            self.line_time, self.num_TAC_bins, self.frame_range = pq.scan_LSM_records(
+                self._records(),
+                self.lsm_frame,
+                self.lsm_line_start,
+                self.lsm_line_stop,
+            )
+        elif self.cache is None:
+            self._load_photons()
+        else:
+            self._load_cached()
+        self._loaded = True
 
-        # Load data
-        self.x, self.y, self.f, self.dtime = self._interpret_records(
-            *self._read_records()
+    def _load_photons(self):
+        records = self._read_records()
+        # Before interpreting, which overwrites dtime.
+        self.line_time, _, _ = pq.scan_LSM(
+            [records], self.lsm_frame, self.lsm_line_start, self.lsm_line_stop
         )
+        self.x, self.y, self.f, self.dtime = self._interpret_records(*records)
         self.num_TAC_bins = self.dtime.max() + 1
+        self.frame_range = (self.f.min(), self.f.max())
+
+    def _load_cached(self):
+        key = self.cache.key(self.file, reader="PTU")
+        cached = self.cache.load(key)
+        if cached is None:
+            self._load_photons()
+            self.cache.save(
+                key,
+                {"x": self.x, "y": self.y, "f": self.f, "dtime": self.dtime},
+                num_TAC_bins=int(self.num_TAC_bins),
+                frame_range=[int(i) for i in self.frame_range],
+                line_time=float(self.line_time),
+            )
+        else:
+            arrays, attrs = cached
+            self.x, self.y, self.f, self.dtime = (
+                arrays[k] for k in ("x", "y", "f", "dtime")
+            )
+            self.num_TAC_bins = attrs["num_TAC_bins"]
+            self.frame_range = tuple(attrs["frame_range"])
+            self.line_time = attrs["line_time"]
 
     def _read_records(self):
-        channel, dtime, truetime = pq.read_records(
+        channel, dtime, macrotime = pq.read_records(
+            self.file, self.num_records, self.records_start, parallel=self.parallel
+        )
+        return channel, dtime, macrotime
+
+    def _records(self):
+        records = pq.memmap_records(self.file, self.records_start)
+        return records[: self.num_records]
+
+    def _fourier_records(self, harmonics, mask=None):
+        """Fourier image and histogram from a single pass over the records."""
+        return pq.fourier_LSM_records(
+            self._records(),
+            self.pixX,
+            self.pixY,
+            self.lsm_frame,
+            self.lsm_line_start,
+            self.lsm_line_stop,
+            self.line_time,
+            complex_exp(harmonics, self.num_TAC_bins, self.TAC_period),
+            mask=mask,
+        )
+
+    def _iter_records(self):
+        return pq.iter_records(
             self.file,
             self.num_records,
             self.records_start,
-            self.syncrate,
-            self.resolution,
+            chunk_size=self.chunk_size,
+        )
+
+    def _iter_photons(self):
+        """Yields chunks of x, y, f, dtime photon arrays."""
+        if self.chunk_size is None:
+            yield self.x, self.y, self.f, self.dtime
+        else:
+            yield from pq.iter_LSM(
+                self._iter_records(),
+                self.pixX,
+                self.pixY,
+                self.lsm_frame,
+                self.lsm_line_start,
+                self.lsm_line_stop,
+                self.line_time,
+            )
+
+    @property
+    def marker_index(self):
+        """Record offsets and macrotimes of frame and line markers."""
+        if self._marker_index is None:
+            self._marker_index = pq.index_LSM_markers(
+                self._records(),
+                self.lsm_frame,
+                self.lsm_line_start,
+                self.lsm_line_stop,
+            )
+        return self._marker_index
+
+    @property
+    def pixel_index(self):
+        """Photons sorted by pixel, used by queries with a mask.
+
+        Built on first use. Requires photons in memory.
+        """
+        if self._pixel_index is None:
+            self._pixel_index = PixelIndex.from_photons(
+                (self.pixY, self.pixX), self.dtime, self.x, self.y
+            )
+        return self._pixel_index
+
+    def _read_range(self, start, stop):
+        return pq.read_LSM_range(
+            self._records(),
+            self.marker_index,
+            start,
+            stop,
+            self.pixX,
+            self.pixY,
+            self.lsm_frame,
+            self.lsm_line_start,
+            self.lsm_line_stop,
+        )
+
+    def read_frames(self, start, stop=None):
+        """Decode and interpret only some frames.
+
+        Parameters
+        ----------
+        start, stop : int
+            Range of frames, as numbered in the f attribute.
+            Photons before the first frame marker belong to frame -1.
+            By default, only frame start.
+
+        Returns
+        -------
+        x, y, f, dtime : int16 arrays
+            Coordinates, frame and TAC bin of photons.
+
+        Raises
+        ------
+        IndexError
+            If start is not a frame, or stop <= start.
+        """
+        if stop is None:
+            stop = start + 1
+        offsets = np.append(self.marker_index.frame_offsets, self.num_records)
+        check_range(start, stop, offsets.size - 1, first=-1)
+        return self._read_range(
+            offsets[start] if start >= 0 else 0, offsets[min(stop, offsets.size - 1)]
         )
-        return channel, dtime, truetime
 
-    def _interpret_records(self, channel, dtime, truetime):
+    def read_lines(self, start, stop):
+        """Decode and interpret only some lines.
+
+        Parameters
+        ----------
+        start, stop : int
+            Range of lines, counted from the start of the file.
+
+        Returns
+        -------
+        x, y, f, dtime : int16 arrays
+            Coordinates, frame and TAC bin of photons.
+
+        Raises
+        ------
+        IndexError
+            If start is not a line, or stop <= start.
+        """
+        offsets = np.append(self.marker_index.line_start_offsets, self.num_records)
+        check_range(start, stop, offsets.size - 1)
+        return self._read_range(offsets[start], offsets[min(stop, offsets.size - 1)])
+
+    def _interpret_records(self, channel, dtime, macrotime):
         if self.scanner == Scanner.PI_E710:
             x, y, f, d = pq.interpret_PI(
                 channel,
                 dtime,
-                truetime,
+                macrotime,
                 self.pixX,
                 self.pixY,
                 self.TStartTo,
@@ -74,7 +305,7 @@ class PTU(UncorrectedFLIMds):
             x, y, f, d = pq.interpret_LSM(
                 channel,
                 dtime,
-                truetime,
+                macrotime,
                 self.pixX,
                 self.pixY,
                 self.lsm_frame,
@@ -88,11 +319,57 @@ class PTU(UncorrectedFLIMds):
         return self.syncrate
 
     def histogram(self, mask=None):
-        hist = histogram(self.dtime, self.x, self.y, self.num_TAC_bins, mask=mask)
+        if self.chunk_size is not None:
+            _, hist = self._fourier_records((), mask=mask)
+        elif mask is not None:
+            hist = self.pixel_index.histogram(self.num_TAC_bins, mask=mask)
+        else:
+            hist = histogram(self.dtime, self.x, self.y, self.num_TAC_bins)
         bins = np.arange(hist.size) * self.resolution
         return bins, hist
 
-    def fourier_image(self, harmonics, mask=None):
+    def decay_image(self, TAC_binning=1, mask=None):
+        if self.chunk_size is None and mask is not None:
+            return self.pixel_index.decay_image(
+                self.num_TAC_bins, TAC_binning=TAC_binning, mask=mask
+            )
+        elif self.chunk_size is None:
+            return decay_image(
+                (self.pixY, self.pixX),
+                self.dtime,
+                self.x,
+                self.y,
+                self.num_TAC_bins,
+                TAC_binning=TAC_binning,
+                mask=mask,
+            )
+
+        num_bins = -(-self.num_TAC_bins // TAC_binning)
+        decay = np.zeros((num_bins, self.pixY, self.pixX), dtype=np.uint32)
+        for x, y, _, dtime in self._iter_photons():
+            _decay_image(decay, dtime, x, y, TAC_binning, mask=mask)
+        return decay
+
+    def fourier_image(self, harmonics, mask=None, parallel=None, method="photons"):
+        if parallel is None:
+            parallel = self.parallel
+
+        if method == "decay":
+            return fourier_from_decay(
+                self.decay_image(mask=mask), harmonics, self.TAC_period
+            )
+        elif self.chunk_size is not None:
+            image, _ = self._fourier_records(harmonics, mask=mask)
+            return image
+        elif mask is not None:
+            return self.pixel_index.fourier_image(
+                harmonics,
+                self.num_TAC_bins,
+                self.TAC_period,
+                mask=mask,
+                parallel=parallel,
+            )
+
         return fourier_image(
             (self.pixY, self.pixX),
             harmonics,
@@ -102,4 +379,69 @@ class PTU(UncorrectedFLIMds):
             self.num_TAC_bins,
             self.TAC_period,
             mask=mask,
+            parallel=parallel,
+            method=method,
+        )
+
+    def fourier_sum(self, harmonics, mask=None):
+        # Reduced from the histogram, in O(num_TAC_bins) memory.
+        _, hist = self.histogram(mask=mask)
+        return hist @ complex_exp(harmonics, hist.size, self.TAC_period)
+
+    def region_histograms(self, labels):
+        labels = np.asarray(labels)
+        if self.chunk_size is None:
+            hists = region_histograms(
+                labels, self.dtime, self.x, self.y, self.num_TAC_bins
+            )
+        else:
+            hists = np.zeros((labels.max() + 1, self.num_TAC_bins), dtype=int)
+            for x, y, _, dtime in self._iter_photons():
+                _region_histograms(hists, labels, dtime, x, y)
+        bins = np.arange(self.num_TAC_bins) * self.resolution
+        return bins, hists
+
+    def region_fourier(self, labels, harmonics):
+        labels = np.asarray(labels)
+        if self.chunk_size is None:
+            return region_fourier(
+                labels,
+                harmonics,
+                self.dtime,
+                self.x,
+                self.y,
+                self.num_TAC_bins,
+                self.TAC_period,
+            )
+
+        R = np.zeros((len(harmonics), labels.max() + 1), dtype=complex)
+        exp = complex_exp(harmonics, self.num_TAC_bins, self.TAC_period)
+        for x, y, _, dtime in self._iter_photons():
+            _region_fourier(R, labels, exp, dtime, x, y)
+        return R
+
+    def fourier_stack(self, harmonics, frame_binning=1, mask=None):
+        if self.chunk_size is None:
+            return fourier_stack(
+                (self.pixY, self.pixX),
+                harmonics,
+                self.dtime,
+                self.x,
+                self.y,
+                self.f,
+                self.num_TAC_bins,
+                self.TAC_period,
+                frame_range=self.frame_range,
+                frame_binning=frame_binning,
+                mask=mask,
+            )
+
+        first, last = self.frame_range
+        num_frames = (last - first) // frame_binning + 1
+        stack = np.zeros(
+            (num_frames, len(harmonics), self.pixY, self.pixX), dtype=complex
         )
+        exp = complex_exp(harmonics, self.num_TAC_bins, self.TAC_period)
+        for x, y, f, dtime in self._iter_photons():
+            _fourier_stack(stack, exp, dtime, x, y, f, first, frame_binning, mask=mask)
+        return stack
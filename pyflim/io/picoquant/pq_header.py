@@ -22,14 +22,56 @@ class HeaderTypes(IntFlag):
     binary_blob = 0xFFFFFFFF
 
 
-def read_header_ptu(path):
+# Fixed-size part of a .ptu header tag. Tags with variable-length
+# payloads store the payload length in value, followed by the payload.
+TAG_DTYPE = np.dtype(
+    [("ident", "S32"), ("idx", "<i4"), ("type", "<u4"), ("value", "<i8")]
+)
+
+VARIABLE_LENGTH_TYPES = frozenset(
+    int(t)
+    for t in (
+        HeaderTypes.float8_array,
+        HeaderTypes.ANSI_string,
+        HeaderTypes.wide_string,
+        HeaderTypes.binary_blob,
+    )
+)
+FLOAT_TYPES = frozenset((int(HeaderTypes.float8), int(HeaderTypes.datetime)))
+FIXED_SIZE_TYPES = FLOAT_TYPES | frozenset(
+    int(t)
+    for t in (
+        HeaderTypes.empty8,
+        HeaderTypes.bool8,
+        HeaderTypes.int8,
+        HeaderTypes.bit_set64,
+        HeaderTypes.color8,
+    )
+)
+
+# Type and value of a tag, at offset 36 of the entry.
+TAG_TYPE_VALUE = struct.Struct("<Iq")
+HEADER_END = b"Header_End".ljust(32, b"\x00")
+
+# Size of the first read, which usually covers the whole header.
+HEADER_CHUNK_SIZE = 2 ** 13
+
+
+def read_header_ptu(path, tags=None):
     """
     Read header of a .ptu file.
 
+    The header is walked once, reading only the type of each tag to skip
+    over variable-length payloads. The fixed-size tags in between, or only
+    those that may be in tags, are then converted at once.
+
     Parameters
     ----------
     path : string or pathlib.Path
         The file to read.
+    tags : iterable of str, optional
+        Names of the tags to return. Payloads of other tags are skipped
+        without decoding. By default, all tags are returned.
 
     Returns
     -------
@@ -42,64 +84,191 @@ def read_header_ptu(path):
     def decode(s):
         return s.decode("utf-8").rstrip("\x00")
 
-    with open(path, "rb") as file:
-        s = file.read(16)
+    # Identifiers that may form the requested tag names, which end in the
+    # tag index if there is one. Other tags are skipped without decoding.
+    idents = None
+    if tags is not None:
+        tags = set(tags)
+        idents = {
+            ident.encode().ljust(32, b"\x00")
+            for tag in tags
+            for ident in (tag, tag.rstrip("0123456789"))
+        }
 
-        if decode(s[:8]) != "PQTTTR":
+    with open(path, "rb") as file:
+        buffer = file.read(HEADER_CHUNK_SIZE)
+
+        def ensure(buffer, size):
+            while len(buffer) < size:
+                block = file.read(max(size, 2 * len(buffer)) - len(buffer))
+                if not block:
+                    raise ValueError("Truncated .ptu header.")
+                buffer += block
+            return buffer
+
+        buffer = ensure(buffer, 16)
+        if decode(buffer[:8]) != "PQTTTR":
             raise ValueError("Not a .ptu file.")
 
-        header = {"Version": decode(s[8:])}
+        # Fixed-size entries, in runs if all tags are read, and
+        # variable-length tags with the number of fixed-size entries
+        # before them, to keep the file order.
+        fixed = []
+        num_fixed = 0
+        variable = []
+        unpack_from = TAG_TYPE_VALUE.unpack_from
+        empty8 = int(HeaderTypes.empty8)
+        run_start = position = 16
         while True:
-            s = file.read(48)
-            tag_id = decode(s[:32])
-            tag_idx, tag_type_code = struct.unpack("<iI", s[32:40])
-            tag_name = tag_id + str(tag_idx) if tag_idx > -1 else tag_id
-
-            if tag_type_code in (
-                HeaderTypes.empty8,
-                HeaderTypes.int8,
-                HeaderTypes.bit_set64,
-                HeaderTypes.color8,
-            ):
-                tag_int = struct.unpack("<q", s[40:])[0]
-                header[tag_name] = tag_int
-
-            elif tag_type_code == HeaderTypes.bool8:
-                tag_int = struct.unpack("<q", s[40:])[0]
-                header[tag_name] = bool(tag_int)
-
-            elif tag_type_code == HeaderTypes.float8:
-                tag_int = struct.unpack("<d", s[40:])[0]
-                header[tag_name] = tag_int
-
-            elif tag_type_code == HeaderTypes.float8_array:
-                tag_int = struct.unpack("<q", s[40:])[0]
-                ss = file.read(tag_int)
-                header[tag_name] = struct.unpack("<" + (tag_int / 8) * "d", ss)
-
-            elif tag_type_code == HeaderTypes.datetime:
-                tag_int = struct.unpack("<d", s[40:])[0]
-                header[tag_name] = tag_int
-
-            elif tag_type_code in (HeaderTypes.ANSI_string, HeaderTypes.wide_string):
-                tag_int = struct.unpack("<q", s[40:])[0]
-                ss = file.read(tag_int)
-                if tag_name in ("$Comment", "File_Comment"):
-                    continue
-                header[tag_name] = decode(ss)
-
-            elif tag_type_code == HeaderTypes.binary_blob:
-                tag_int = struct.unpack("<q", s[40:])[0]
-                ss = file.read(tag_int)
-                header[tag_name] = ss
+            end = position + TAG_DTYPE.itemsize
+            if end > len(buffer):
+                buffer = ensure(buffer, end)
+            tag_type, length = unpack_from(buffer, position + 36)
+            if tag_type not in VARIABLE_LENGTH_TYPES:
+                if idents is not None and buffer[position : end - 16] in idents:
+                    fixed.append(buffer[position:end])
+                    num_fixed += 1
+                position = end
+                if tag_type == empty8 and buffer[end - 48 : end - 16] == HEADER_END:
+                    if idents is None:
+                        fixed.append(buffer[run_start:end])
+                    break
+                continue
+
+            if idents is None:
+                fixed.append(buffer[run_start:position])
+                num_fixed += (position - run_start) // TAG_DTYPE.itemsize
+                tag_name = _tag_name(buffer[position:end])
+            elif buffer[position : end - 16] in idents:
+                tag_name = _tag_name(buffer[position:end])
             else:
-                raise
+                tag_name = None
+            if end + length > len(buffer):
+                buffer = ensure(buffer, end + length)
+            run_start = position = end + length
+            if tag_name is None or (tags is not None and tag_name not in tags):
+                continue
+            elif tag_type == HeaderTypes.float8_array:
+                value = struct.unpack_from("<" + (length // 8) * "d", buffer, end)
+            elif tag_type == HeaderTypes.binary_blob:
+                value = buffer[end:position]
+            elif tag_name in ("$Comment", "File_Comment"):
+                continue
+            else:
+                value = decode(buffer[end:position])
+            variable.append((num_fixed, tag_name, value))
 
-            if tag_id == "Header_End":
-                break
+    names, values = _convert_fixed_tags(np.frombuffer(b"".join(fixed), TAG_DTYPE))
 
-        records_start = file.tell()
-    return header, records_start
+    header = {}
+    if tags is None or "Version" in tags:
+        header["Version"] = decode(buffer[8:16])
+    start = 0
+    for stop, tag_name, value in variable + [(len(names), None, None)]:
+        header.update(zip(names[start:stop], values[start:stop]))
+        if tag_name is not None:
+            header[tag_name] = value
+        start = stop
+
+    if tags is not None:
+        header = {k: v for k, v in header.items() if k in tags}
+    return header, position
+
+
+def _tag_name(entry):
+    """Name of a tag, from its 48 bytes."""
+    tag_id = entry[:32].rstrip(b"\x00").decode("utf-8")
+    (tag_idx,) = struct.unpack_from("<i", entry, 32)
+    return tag_id + str(tag_idx) if tag_idx > -1 else tag_id
+
+
+def _convert_fixed_tags(entries):
+    """Names and values of tags without variable-length payloads.
+
+    Parameters
+    ----------
+    entries : ndarray of TAG_DTYPE
+
+    Returns
+    -------
+    names, values : lists
+    """
+    types = entries["type"]
+    unknown = set(types.tolist()) - FIXED_SIZE_TYPES
+    if unknown:
+        entry = entries[np.flatnonzero(np.isin(types, list(unknown)))[0]]
+        tag_name = _tag_name(entry.tobytes())
+        raise ValueError(f"Unknown type {int(entry['type']):#010x} of tag {tag_name}.")
+
+    values = entries["value"].tolist()
+    is_float = np.zeros(types.shape, dtype=bool)
+    for float_type in FLOAT_TYPES:
+        is_float |= types == float_type
+    for i, value in zip(
+        np.flatnonzero(is_float).tolist(),
+        entries["value"][is_float].view("<f8").tolist(),
+    ):
+        values[i] = value
+    for i in np.flatnonzero(types == int(HeaderTypes.bool8)).tolist():
+        values[i] = values[i] != 0
+
+    names = [
+        ident.decode("utf-8") + str(idx) if idx > -1 else ident.decode("utf-8")
+        for ident, idx in zip(entries["ident"].tolist(), entries["idx"].tolist())
+    ]
+    return names, values
+
+
+def write_header_ptu(file, tags, version="1.0.00"):
+    """
+    Write the header of a .ptu file.
+
+    Parameters
+    ----------
+    file : file object
+        Binary file, open for writing at its start.
+    tags : iterable of (str, HeaderTypes, value) tuples
+        Tags, without Header_End, which is appended. Names ending in a
+        number are not split into an index. ANSI_string and float8_array
+        payloads are padded to a multiple of 8 bytes.
+    version : str, optional
+
+    Returns
+    -------
+    value_offsets : dict
+        File location of the value of each fixed-size tag, so that it
+        can be overwritten once known, e.g. TTResult_NumberOfRecords.
+    """
+    file.write(b"PQTTTR".ljust(8, b"\x00") + version.encode().ljust(8, b"\x00"))
+
+    value_offsets = {}
+    tags = list(tags) + [("Header_End", HeaderTypes.empty8, 0)]
+    for name, tag_type, value in tags:
+        entry = np.zeros((), dtype=TAG_DTYPE)
+        entry["ident"] = name.encode()
+        entry["idx"] = -1
+        entry["type"] = tag_type
+
+        payload = b""
+        if tag_type == HeaderTypes.ANSI_string:
+            payload = value.encode()
+            payload += b"\x00" * (8 - len(payload) % 8)
+        elif tag_type == HeaderTypes.float8_array:
+            payload = struct.pack("<" + len(value) * "d", *value)
+        elif tag_type in (HeaderTypes.float8, HeaderTypes.datetime):
+            entry["value"] = np.float64(value).view("<i8")
+        elif tag_type in VARIABLE_LENGTH_TYPES:
+            raise ValueError(f"Unsupported type {tag_type!r} of tag {name}.")
+        else:
+            entry["value"] = value
+
+        if payload:
+            entry["value"] = len(payload)
+        else:
+            value_offsets[name] = file.tell() + TAG_DTYPE.fields["value"][1]
+        file.write(entry.tobytes() + payload)
+
+    return value_offsets
 
 
 def read_header_pt3(path):
@@ -1,5 +1,7 @@
 """Adapted from JediFLIM by Klaus Schuermann and tdflim by Peter Verveer."""
 
+from typing import NamedTuple
+
 import numba as nb
 import numpy as np
 
@@ -17,7 +19,7 @@ def _bit_get(value, shift, length):
 
 
 @nb.njit
-def _read_events(records, num_records, syncrate, resolution):
+def _read_events(records, num_records):
     """
     Read the TTTR data from an array-like object
 
@@ -27,28 +29,75 @@ def _read_events(records, num_records, syncrate, resolution):
         An array-like object over the uint32 records.
     num_records: int
         Number of records in file.
-    syncrate: int
-        Synchronization rate in Hz.
-    resolution: int
-        TAC resolution in s.
 
     Returns
     --------
     channel : int16 array
     dtime : int16 array
-    truetime : double array
+    macrotime : int64 array
+        Number of synchronization periods since the start of the measurement.
     """
+    channels, dtimes, macrotimes, _ = _read_events_chunk(records[:num_records], 0)
+    return channels, dtimes, macrotimes
 
-    syncperiod = 1.0e9 / syncrate
-    ofltime = np.uint64(0)
-    truensync = 0.0
-    event = 0
 
+@nb.njit
+def _read_events_chunk(records, ofltime):
+    """
+    Read a chunk of TTTR data, continuing from a previous chunk.
+
+    Parameters
+    -----------
+    records: array_like
+        An array-like object over the uint32 records of the chunk.
+    ofltime: int
+        Overflow time accumulated up to the start of the chunk.
+
+    Returns
+    --------
+    channel : int16 array
+    dtime : int16 array
+    macrotime : int64 array
+        Number of synchronization periods since the start of the measurement.
+    ofltime : int
+        Overflow time at the end of the chunk.
+    """
+
+    num_records = len(records)
     channels = np.empty(num_records, dtype=np.int16)
     dtimes = np.empty(num_records, dtype=np.int16)
-    truetimes = np.empty(num_records, dtype=np.double)
+    macrotimes = np.empty(num_records, dtype=np.int64)
+
+    event, ofltime = _decode_events(records, ofltime, channels, dtimes, macrotimes)
+    return channels[:event], dtimes[:event], macrotimes[:event], ofltime
+
+
+@nb.njit
+def _decode_events(records, ofltime, channels, dtimes, macrotimes):
+    """
+    Decode TTTR records into preallocated arrays.
 
-    for n in range(num_records):
+    Parameters
+    -----------
+    records: array_like
+        An array-like object over the uint32 records.
+    ofltime: int
+        Overflow time accumulated up to the first record.
+    channels, dtimes, macrotimes: arrays
+        Output arrays, with at least as many elements as events in records.
+
+    Returns
+    --------
+    event : int
+        Number of events written.
+    ofltime : int
+        Overflow time after the last record.
+    """
+
+    ofltime = np.int64(ofltime)
+    event = 0
+
+    for n in range(len(records)):
         record = records[n]  # all 32 bits
         nsync = _bit_get(record, 0, 16)  # lowest 16 bits
         channel = _bit_get(record, 32 - 4, 4)  # upper 4 bits
@@ -61,16 +110,107 @@ def _read_events(records, num_records, syncrate, resolution):
 
         dtime = _bit_get(record, 32 - 16, 12)
         if 1 <= channel <= 4 or channel == 15:  # Photon or spatial marker event
-            truensync = 1.0 * ofltime + 1.0 * nsync
             channels[event] = channel
             dtimes[event] = dtime
-            truetimes[event] = truensync * syncperiod + dtime * resolution
+            macrotimes[event] = ofltime + nsync
             event += 1
 
-    return channels[:event], dtimes[:event], truetimes[:event]
+    return event, ofltime
 
 
-def read_records(file, num_records, offset, syncrate, resolution):
+@nb.njit
+def _count_events(records):
+    """
+    Count the overflow time and number of events in TTTR records.
+
+    Returns
+    --------
+    ofltime : int
+        Overflow time accumulated over the records.
+    events : int
+        Number of events that _decode_events would write.
+    """
+    ofltime = 0
+    events = 0
+    for n in range(len(records)):
+        record = records[n]
+        channel = _bit_get(record, 32 - 4, 4)
+        if channel == 15:
+            if _bit_get(record, 32 - 16, 4) == 0:  # Overflow
+                ofltime += T3_WRAP_AROUND
+            else:
+                events += 1
+        elif 1 <= channel <= 4:
+            events += 1
+    return ofltime, events
+
+
+@nb.njit(parallel=True)
+def _read_events_parallel(records, num_records, num_chunks):
+    """
+    Read the TTTR data from an array-like object using multiple threads.
+
+    Records are split in chunks. The overflow time and number of events
+    of each chunk are counted in parallel, and their cumulative sums give
+    the starting overflow time and output position for decoding each chunk
+    independently. The result is identical to _read_events.
+
+    Parameters
+    -----------
+    records: array_like
+        An array-like object over the uint32 records.
+    num_records: int
+        Number of records in file.
+    num_chunks: int
+        Number of chunks to split the records into.
+
+    Returns
+    --------
+    channel : int16 array
+    dtime : int16 array
+    macrotime : int64 array
+    """
+    records = records[:num_records]
+    bounds = np.linspace(0, len(records), num_chunks + 1).astype(np.int64)
+
+    ofltimes = np.zeros(num_chunks + 1, dtype=np.int64)
+    events = np.zeros(num_chunks + 1, dtype=np.int64)
+    for c in nb.prange(num_chunks):
+        ofltimes[c + 1], events[c + 1] = _count_events(
+            records[bounds[c] : bounds[c + 1]]
+        )
+    ofltimes = np.cumsum(ofltimes)
+    events = np.cumsum(events)
+
+    channels = np.empty(events[-1], dtype=np.int16)
+    dtimes = np.empty(events[-1], dtype=np.int16)
+    macrotimes = np.empty(events[-1], dtype=np.int64)
+    for c in nb.prange(num_chunks):
+        start, stop = events[c], events[c + 1]
+        _decode_events(
+            records[bounds[c] : bounds[c + 1]],
+            ofltimes[c],
+            channels[start:stop],
+            dtimes[start:stop],
+            macrotimes[start:stop],
+        )
+
+    return channels, dtimes, macrotimes
+
+
+def memmap_records(file, offset):
+    """Memory-map the uint32 records of a pt3/ptu file.
+
+    Parameters
+    ----------
+    file : os.PathLike
+    offset : int
+        Number of bytes to skip until the start of the records.
+    """
+    return np.memmap(file, dtype="uint32", mode="r", offset=offset)
+
+
+def read_records(file, num_records, offset, parallel=False):
     """Read records of a pt3/ptu file.
 
     Parameters
@@ -80,32 +220,68 @@ def read_records(file, num_records, offset, syncrate, resolution):
         Maximum number of records to be read.
     offset : int
         Number of bytes to skip until the start of the records.
-    syncrate : int
-        Synchronization rate in Hz.
-    resolution : int
-        TAC resolution in s.
+    parallel : bool, optional
+        If True, records are decoded using all numba threads.
 
     Returns
     -------
     channel: int16 array
     dtime: int16 array
-    truetime: double array
+    macrotime: int64 array
+        Number of synchronization periods since the start of the measurement.
     """
 
-    records = np.memmap(file, dtype="uint32", mode="r", offset=offset)
-    channels, dtimes, truetimes = _read_events(
-        records, num_records, syncrate, resolution
-    )
+    records = memmap_records(file, offset)
+    if parallel:
+        channels, dtimes, macrotimes = _read_events_parallel(
+            records, num_records, 4 * nb.get_num_threads()
+        )
+    else:
+        channels, dtimes, macrotimes = _read_events(records, num_records)
+
+    return channels, dtimes, macrotimes
+
 
-    return channels, dtimes, truetimes
+def iter_records(file, num_records, offset, chunk_size=2 ** 20):
+    """Read records of a pt3/ptu file in chunks of bounded size.
+
+    The overflow time is carried across chunks, so that concatenating
+    the chunks gives the same result as read_records.
+
+    Parameters
+    ----------
+    file : os.PathLike
+    num_records : int
+        Maximum number of records to be read.
+    offset : int
+        Number of bytes to skip until the start of the records.
+    chunk_size : int, optional
+        Number of records decoded at a time.
+
+    Yields
+    ------
+    channel: int16 array
+    dtime: int16 array
+    macrotime: int64 array
+    """
+
+    records = memmap_records(file, offset)
+    num_records = min(num_records, records.size)
+    ofltime = 0
+    for start in range(0, num_records, chunk_size):
+        stop = min(start + chunk_size, num_records)
+        channels, dtimes, macrotimes, ofltime = _read_events_chunk(
+            records[start:stop], ofltime
+        )
+        yield channels, dtimes, macrotimes
 
 
 @nb.njit
 def interpret_LSM(
-    channel, dtime, truetime, pixX, pixY, lsm_frame, lsm_line_start, lsm_line_stop
+    channel, dtime, macrotime, pixX, pixY, lsm_frame, lsm_line_start, lsm_line_stop
 ):
     """
-    calculate the x, y position and the frame from truetime
+    calculate the x, y position and the frame from macrotime
 
     Parameters
     ----------
@@ -114,7 +290,7 @@ def interpret_LSM(
 
     dtime: int16 array
 
-    truetime: double array
+    macrotime: int64 array
 
     pixX: pixels in x
 
@@ -141,30 +317,139 @@ def interpret_LSM(
 
     dtime: dtime
     """
-    nb_events = len(channel)
-    x = np.empty(nb_events, dtype=np.int16)
-    y = np.empty(nb_events, dtype=np.int16)
-    f = np.empty(nb_events, dtype=np.int16)
+    # calculate the dwell time (time spent per line)
+    scan = _scan_LSM(
+        channel,
+        dtime,
+        macrotime,
+        lsm_frame,
+        lsm_line_start,
+        lsm_line_stop,
+        (0, 0, 0, False, -1, -1, 0, -1),
+    )
+    line_time = _line_time(scan)
+
+    (x, y, f, d), _ = _interpret_LSM_chunk(
+        channel,
+        dtime,
+        macrotime,
+        pixX,
+        pixY,
+        lsm_frame,
+        lsm_line_start,
+        lsm_line_stop,
+        line_time,
+        (0, -1, -1, False),
+    )
+    return x, y, f, d
 
-    line_start = 0.0
-    line_time = 0.0
-    lines = 0
 
-    # calculate the dwell time (time spent per line)
-    for i in range(nb_events):
+@nb.njit
+def _scan_LSM(
+    channel, dtime, macrotime, lsm_frame, lsm_line_start, lsm_line_stop, state
+):
+    """
+    accumulate the line durations, and the largest TAC bin and frame range
+    of photons inside lines
+
+    Parameters
+    ----------
+
+    state: (line_start, line_time, lines, line_started,
+            max_dtime, frame, first_frame, last_frame) tuple,
+        as returned by the previous chunk.
+
+    Returns
+    --------
+
+    state: updated state tuple.
+    """
+    (
+        line_start,
+        line_time,
+        lines,
+        line_started,
+        max_dtime,
+        frame,
+        first_frame,
+        last_frame,
+    ) = state
+
+    for i in range(len(channel)):
         if channel[i] == 15:
-            if dtime[i] == lsm_line_start:
-                line_start = truetime[i]
+            if dtime[i] == lsm_frame:
+                frame += 1
+            elif dtime[i] == lsm_line_start:
+                line_started = True
+                line_start = macrotime[i]
             elif dtime[i] == lsm_line_stop:
-                line_time += truetime[i] - line_start
+                line_started = False
+                line_time += macrotime[i] - line_start
                 lines += 1
-    line_time /= 1.0 * lines
+        elif line_started and channel[i] > 0:
+            if max_dtime < 0:
+                first_frame = frame
+            last_frame = frame
+            if dtime[i] > max_dtime:
+                max_dtime = dtime[i]
 
-    line_start = 0
-    line = -1
-    frame = -1
+    return (
+        line_start,
+        line_time,
+        lines,
+        line_started,
+        max_dtime,
+        frame,
+        first_frame,
+        last_frame,
+    )
+
+
+@nb.njit
+def _line_time(scan):
+    """Mean line duration from the state returned by _scan_LSM."""
+    line_time, lines = scan[1], scan[2]
+    return line_time / (1.0 * lines)
+
+
+@nb.njit
+def _interpret_LSM_chunk(
+    channel,
+    dtime,
+    macrotime,
+    pixX,
+    pixY,
+    lsm_frame,
+    lsm_line_start,
+    lsm_line_stop,
+    line_time,
+    state,
+):
+    """
+    calculate the x, y position and the frame from macrotime for a chunk of events
+
+    Parameters
+    ----------
+
+    line_time: mean line duration in synchronization periods, from _scan_LSM.
+
+    state: (line_start, line, frame, line_started) tuple,
+        as returned by the previous chunk.
+
+    Returns
+    --------
+
+    (x, y, f, dtime): photons in the chunk.
+
+    state: updated state tuple.
+    """
+    nb_events = len(channel)
+    x = np.empty(nb_events, dtype=np.int16)
+    y = np.empty(nb_events, dtype=np.int16)
+    f = np.empty(nb_events, dtype=np.int16)
+
+    line_start, line, frame, line_started = state
     x_pos = 0.0
-    line_started = False
     events_in_range = 0
 
     for i in range(nb_events):
@@ -175,7 +460,7 @@ def interpret_LSM(
 
             elif dtime[i] == lsm_line_start:
                 line_started = True
-                line_start = truetime[i]
+                line_start = macrotime[i]
                 line += 1
                 if line >= pixY:
                     line = 0
@@ -184,7 +469,7 @@ def interpret_LSM(
         elif line_started is False:
             continue
         elif channel[i] > 0:
-            x_pos = (truetime[i] - line_start) / line_time * 1.0 * (pixX - 1)
+            x_pos = (macrotime[i] - line_start) / line_time * 1.0 * (pixX - 1)
             x[events_in_range] = np.int16(x_pos)
             y[events_in_range] = line
             f[events_in_range] = frame
@@ -192,18 +477,437 @@ def interpret_LSM(
             events_in_range += 1
 
     return (
-        x[:events_in_range],
-        y[:events_in_range],
-        f[:events_in_range],
-        dtime[:events_in_range],
+        (
+            x[:events_in_range],
+            y[:events_in_range],
+            f[:events_in_range],
+            dtime[:events_in_range],
+        ),
+        (line_start, line, frame, line_started),
+    )
+
+
+def scan_LSM(records_iter, lsm_frame, lsm_line_start, lsm_line_stop):
+    """Compute the mean line duration, number of TAC bins and frame range of LSM records.
+
+    Parameters
+    ----------
+    records_iter : iterable of (channel, dtime, macrotime)
+        Chunks of records, as yielded by iter_records.
+    lsm_frame, lsm_line_start, lsm_line_stop : int
+        Markers for lsm frame, line start and line stop.
+
+    Returns
+    -------
+    line_time : float
+        Mean line duration in synchronization periods.
+    num_TAC_bins : int
+        Largest TAC bin of photons inside lines, plus one.
+    frame_range : tuple of ints
+        First and last frame of photons inside lines.
+    """
+    scan = (0, 0, 0, False, -1, -1, 0, -1)
+    for channel, dtime, macrotime in records_iter:
+        scan = _scan_LSM(
+            channel, dtime, macrotime, lsm_frame, lsm_line_start, lsm_line_stop, scan
+        )
+    return _line_time(scan), scan[4] + 1, (scan[6], scan[7])
+
+
+def iter_LSM(
+    records_iter,
+    pixX,
+    pixY,
+    lsm_frame,
+    lsm_line_start,
+    lsm_line_stop,
+    line_time,
+):
+    """Interpret chunks of LSM records.
+
+    The line and frame state is carried across chunks, so that
+    concatenating the chunks gives the same result as interpret_LSM.
+
+    Parameters
+    ----------
+    records_iter : iterable of (channel, dtime, macrotime)
+        Chunks of records, as yielded by iter_records.
+    pixX, pixY : int
+        Pixels in x and y.
+    lsm_frame, lsm_line_start, lsm_line_stop : int
+        Markers for lsm frame, line start and line stop.
+    line_time : float
+        Mean line duration in synchronization periods, as returned by scan_LSM.
+
+    Yields
+    ------
+    x, y, f, dtime : int16 arrays
+        Coordinates, frame and TAC bin of photons.
+    """
+    state = (0, -1, -1, False)
+    for channel, dtime, macrotime in records_iter:
+        photons, state = _interpret_LSM_chunk(
+            channel,
+            dtime,
+            macrotime,
+            pixX,
+            pixY,
+            lsm_frame,
+            lsm_line_start,
+            lsm_line_stop,
+            line_time,
+            state,
+        )
+        yield photons
+
+
+@nb.njit
+def scan_LSM_records(records, lsm_frame, lsm_line_start, lsm_line_stop):
+    """
+    compute the mean line duration, number of TAC bins and frame range
+    directly from records
+
+    Equivalent to scan_LSM over read_records, without decoding the events.
+
+    Parameters
+    ----------
+
+    records: uint32 array of records.
+
+    lsm_frame: marker for lsm frame
+
+    lsm_line_start: marker for lsm line start
+
+    lsm_line_stop: marker for lsm line stop
+
+    Returns
+    --------
+
+    line_time: mean line duration in synchronization periods.
+
+    num_TAC_bins: largest TAC bin of photons inside lines, plus one.
+
+    frame_range: first and last frame of photons inside lines.
+    """
+    ofltime = np.int64(0)
+
+    line_start = 0
+    line_time = 0
+    lines = 0
+    line_started = False
+    max_dtime = -1
+    frame = -1
+    first_frame = 0
+    last_frame = -1
+
+    for n in range(len(records)):
+        record = records[n]
+        channel = _bit_get(record, 32 - 4, 4)
+        dtime = _bit_get(record, 32 - 16, 12)
+
+        if channel == 15:
+            if _bit_get(record, 32 - 16, 4) == 0:  # Overflow
+                ofltime = ofltime + T3_WRAP_AROUND
+                continue
+
+            if dtime == lsm_frame:
+                frame += 1
+            elif dtime == lsm_line_start or dtime == lsm_line_stop:
+                macrotime = ofltime + _bit_get(record, 0, 16)
+                if dtime == lsm_line_start:
+                    line_started = True
+                    line_start = macrotime
+                else:
+                    line_started = False
+                    line_time += macrotime - line_start
+                    lines += 1
+        elif line_started and 1 <= channel <= 4:
+            if max_dtime < 0:
+                first_frame = frame
+            last_frame = frame
+            if dtime > max_dtime:
+                max_dtime = dtime
+
+    return line_time / (1.0 * lines), max_dtime + 1, (first_frame, last_frame)
+
+
+@nb.njit
+def fourier_LSM_records(
+    records,
+    pixX,
+    pixY,
+    lsm_frame,
+    lsm_line_start,
+    lsm_line_stop,
+    line_time,
+    complex_exp,
+    mask=None,
+):
+    """
+    compute the fourier image and histogram directly from records
+
+    Decodes, interprets and accumulates every photon in a single pass,
+    without building the photon table. Equivalent to interpret_LSM
+    followed by fourier_image and histogram.
+
+    Parameters
+    ----------
+
+    records: uint32 array of records.
+
+    pixX: pixels in x
+
+    pixY: pixels in Y
+
+    lsm_frame: marker for lsm frame
+
+    lsm_line_start: marker for lsm line start
+
+    lsm_line_stop: marker for lsm line stop
+
+    line_time: mean line duration in synchronization periods,
+        from scan_LSM_records.
+
+    complex_exp: complex wave of dimensions (num_TAC_bins, num_harmonics).
+
+    mask: ndarray of bools of shape (pixY, pixX), optional.
+
+    Returns
+    --------
+
+    image: complex array of shape (num_harmonics, pixY, pixX)
+
+    hist: int array of num_TAC_bins length
+    """
+    num_TAC_bins, num_harm = complex_exp.shape
+    image = np.zeros((num_harm, pixY, pixX), dtype=np.complex128)
+    hist = np.zeros(num_TAC_bins, dtype=np.int64)
+
+    ofltime = np.int64(0)
+
+    line_start = 0
+    line = -1
+    line_started = False
+
+    for n in range(len(records)):
+        record = records[n]
+        channel = _bit_get(record, 32 - 4, 4)
+
+        if channel == 15:
+            if _bit_get(record, 32 - 16, 4) == 0:  # Overflow
+                ofltime = ofltime + T3_WRAP_AROUND
+                continue
+        elif not (1 <= channel <= 4 and line_started):
+            continue
+
+        dtime = np.int16(_bit_get(record, 32 - 16, 12))
+        macrotime = ofltime + _bit_get(record, 0, 16)
+
+        if channel == 15:
+            if dtime == lsm_frame:
+                line = -1
+            elif dtime == lsm_line_start:
+                line_started = True
+                line_start = macrotime
+                line += 1
+                if line >= pixY:
+                    line = 0
+            elif dtime == lsm_line_stop:
+                line_started = False
+            continue
+
+        xi = np.int16((macrotime - line_start) / line_time * 1.0 * (pixX - 1))
+        if mask is not None:
+            if not mask[line, xi]:
+                continue
+        hist[dtime] += 1
+        for h in range(num_harm):
+            image[h, line, xi] += complex_exp[dtime, h]
+
+    return image, hist
+
+
+class MarkerIndex(NamedTuple):
+    """Record offsets and macrotimes of LSM markers."""
+
+    frame_offsets: np.ndarray
+    frame_times: np.ndarray
+    line_start_offsets: np.ndarray
+    line_start_times: np.ndarray
+    line_stop_offsets: np.ndarray
+    line_stop_times: np.ndarray
+
+    def line_time(self):
+        """Mean line duration in synchronization periods.
+
+        Same as returned by scan_LSM.
+        """
+        previous = np.searchsorted(self.line_start_offsets, self.line_stop_offsets)
+        starts = np.append(0, self.line_start_times)[previous]
+        return np.sum(self.line_stop_times - starts) / (1.0 * previous.size)
+
+    def LSM_state(self, offset, pixY):
+        """State of interpret_LSM just before the record at offset."""
+        frames = np.searchsorted(self.frame_offsets, offset)
+        frame_offset = self.frame_offsets[frames - 1] if frames > 0 else -1
+        starts = np.searchsorted(self.line_start_offsets, offset)
+        stops = np.searchsorted(self.line_stop_offsets, offset)
+
+        lines = starts - np.searchsorted(self.line_start_offsets, frame_offset)
+        line = (lines - 1) % pixY if lines > 0 else -1
+        line_start = self.line_start_times[starts - 1] if starts > 0 else 0
+        line_started = starts > 0 and (
+            stops == 0
+            or self.line_start_offsets[starts - 1] > self.line_stop_offsets[stops - 1]
+        )
+        return int(line_start), int(line), int(frames - 1), bool(line_started)
+
+    def macrotime(self, offset):
+        """Macrotime of the marker record at offset."""
+        for offsets, times in (
+            (self.frame_offsets, self.frame_times),
+            (self.line_start_offsets, self.line_start_times),
+            (self.line_stop_offsets, self.line_stop_times),
+        ):
+            i = np.searchsorted(offsets, offset)
+            if i < offsets.size and offsets[i] == offset:
+                return int(times[i])
+        raise ValueError(f"No marker at record {offset}.")
+
+
+@nb.njit
+def _index_markers(records, markers):
+    """
+    find the record offset and macrotime of marker records
+
+    Parameters
+    ----------
+
+    records: uint32 array of records.
+
+    markers: int array of marker values to index.
+
+    Returns
+    --------
+
+    offsets: int64 array of record offsets.
+
+    macrotimes: int64 array of macrotimes.
+
+    kinds: int64 array with the position in markers of each marker record.
+    """
+    offsets = nb.typed.List.empty_list(nb.int64)
+    macrotimes = nb.typed.List.empty_list(nb.int64)
+    kinds = nb.typed.List.empty_list(nb.int64)
+
+    ofltime = np.int64(0)
+    for n in range(len(records)):
+        record = records[n]
+        if _bit_get(record, 32 - 4, 4) != 15:
+            continue
+
+        if _bit_get(record, 32 - 16, 4) == 0:  # Overflow
+            ofltime = ofltime + T3_WRAP_AROUND
+            continue
+
+        marker = _bit_get(record, 32 - 16, 12)
+        for k in range(len(markers)):
+            if marker == markers[k]:
+                offsets.append(n)
+                macrotimes.append(ofltime + _bit_get(record, 0, 16))
+                kinds.append(k)
+                break
+
+    out = np.empty((3, len(offsets)), dtype=np.int64)
+    for i in range(len(offsets)):
+        out[0, i] = offsets[i]
+        out[1, i] = macrotimes[i]
+        out[2, i] = kinds[i]
+    return out[0], out[1], out[2]
+
+
+def index_LSM_markers(records, lsm_frame, lsm_line_start, lsm_line_stop):
+    """Build an index of the frame and line markers of LSM records.
+
+    Parameters
+    ----------
+    records : uint32 array
+        Records, as returned by memmap_records.
+    lsm_frame, lsm_line_start, lsm_line_stop : int
+        Markers for lsm frame, line start and line stop.
+
+    Returns
+    -------
+    MarkerIndex
+    """
+    markers = np.array((lsm_frame, lsm_line_start, lsm_line_stop))
+    offsets, macrotimes, kinds = _index_markers(records, markers)
+
+    index = []
+    for k in range(markers.size):
+        is_kind = kinds == k
+        index.extend((offsets[is_kind], macrotimes[is_kind]))
+    return MarkerIndex(*index)
+
+
+def read_LSM_range(
+    records,
+    index,
+    start,
+    stop,
+    pixX,
+    pixY,
+    lsm_frame,
+    lsm_line_start,
+    lsm_line_stop,
+):
+    """Decode and interpret only a range of LSM records.
+
+    The result is the same as the corresponding photons of
+    read_records followed by interpret_LSM over all records.
+
+    Parameters
+    ----------
+    records : uint32 array
+        Records, as returned by memmap_records.
+    index : MarkerIndex
+        Marker index of records, as returned by index_LSM_markers.
+    start : int
+        Offset of the first record. Must be 0 or a marker in index.
+    stop : int
+        Offset of the record after the last one.
+    pixX, pixY : int
+        Pixels in x and y.
+    lsm_frame, lsm_line_start, lsm_line_stop : int
+        Markers for lsm frame, line start and line stop.
+
+    Returns
+    -------
+    x, y, f, dtime : int16 arrays
+        Coordinates, frame and TAC bin of photons.
+    """
+    ofltime = index.macrotime(start) - (int(records[start]) & 0xFFFF) if start else 0
+    channel, dtime, macrotime, _ = _read_events_chunk(records[start:stop], ofltime)
+    photons, _ = _interpret_LSM_chunk(
+        channel,
+        dtime,
+        macrotime,
+        pixX,
+        pixY,
+        lsm_frame,
+        lsm_line_start,
+        lsm_line_stop,
+        index.line_time(),
+        index.LSM_state(start, pixY),
     )
+    return photons
 
 
 @nb.njit
 def interpret_PI(
     channel,
     dtime,
-    truetime,
+    macrotime,
     pixX,
     pixY,
     t_start_to,
@@ -213,7 +917,7 @@ def interpret_PI(
     bidirect=False,
 ):
     """
-    calculate the x, y position and the frame from truetime
+    calculate the x, y position and the frame from macrotime
 
     Parameters
     ----------
@@ -222,7 +926,7 @@ def interpret_PI(
 
     dtime: int16 array
 
-    truetime: double array
+    macrotime: int64 array
 
     pixX: pixels in x
 
@@ -256,7 +960,7 @@ def interpret_PI(
     y = np.zeros(nb_events, dtype=np.int16)
     f = np.zeros(nb_events, dtype=np.int16)
 
-    line_start = -1.0
+    line_start = -1
     line_time = 0.0
     lines = 0
     scanning_to = True
@@ -265,11 +969,11 @@ def interpret_PI(
     for i in range(nb_events):
         if channel[i] == 15:
             if line_start < 0:
-                line_start = truetime[i]
+                line_start = macrotime[i]
             else:
                 if scanning_to:
-                    line_time += truetime[i] - line_start
-                    line_start = truetime[i]
+                    line_time += macrotime[i] - line_start
+                    line_start = macrotime[i]
                     lines += 1
                 else:
                     line_start = -1
@@ -298,15 +1002,15 @@ def interpret_PI(
             if line > 0 and bidirect:
                 scanning_to = not scanning_to
             if scanning_to:
-                line_start = truetime[
+                line_start = macrotime[
                     i
                 ]  # reverse scanning uses the previous trigger signal
 
         elif channel[i] > 0:
             if scanning_to:
-                x_pos = (truetime[i] - line_start - offset_to) / dwell_t_to * pixX
+                x_pos = (macrotime[i] - line_start - offset_to) / dwell_t_to * pixX
             else:
-                x_pos = (truetime[i] - line_start - offset_fro) / dwell_t_fro * pixX
+                x_pos = (macrotime[i] - line_start - offset_fro) / dwell_t_fro * pixX
                 x_pos = pixX - x_pos - 1
             if x_pos > 0 and x_pos < pixX:
                 x[events_in_range] = x_pos
@@ -0,0 +1,259 @@
+"""Writer of synthetic PicoHarp T3 .ptu files."""
+
+import numba as nb
+import numpy as np
+
+from ..functions import WRITER_TAC_BINS
+from . import pq_header
+from .pq_header import HeaderTypes
+from .pq_numba import T3_WRAP_AROUND
+
+PICOHARP_T3 = 0x00010303
+
+OVERFLOW_RECORD = 0xF0000000
+
+
+@nb.njit
+def _append_record(records, n, ofltime, macrotime, value):
+    """Append a record, preceded by the overflow records needed to reach macrotime.
+
+    Returns
+    -------
+    n : int
+        Number of records written.
+    ofltime : int
+        Overflow time after the record.
+    """
+    while macrotime - ofltime >= T3_WRAP_AROUND:
+        records[n] = OVERFLOW_RECORD
+        ofltime += T3_WRAP_AROUND
+        n += 1
+    records[n] = value | (macrotime - ofltime)
+    return n + 1, ofltime
+
+
+@nb.njit
+def _encode_LSM_frame(
+    counts,
+    dtime,
+    channel,
+    pixel_syncs,
+    macrotime,
+    ofltime,
+    lsm_frame,
+    lsm_line_start,
+    lsm_line_stop,
+    records,
+):
+    """
+    encode a frame of an LSM scan as T3 records
+
+    The frame marker and each line start are followed by the photons of
+    each pixel, in order, and the line stop. Lines last pixel_syncs * pixX
+    synchronization periods, and photons are placed in time so that
+    interpret_LSM assigns them to their pixel.
+
+    Parameters
+    ----------
+
+    counts: int array of shape (pixY, pixX), number of photons per pixel.
+
+    dtime: int array of TAC bins of the photons, sorted by pixel.
+
+    channel: detector channel, from 1 to 4.
+
+    pixel_syncs: pixel dwell time in synchronization periods, at least 2.
+
+    macrotime: synchronization periods since the start, at the frame marker.
+
+    ofltime: overflow time up to the previous record.
+
+    records: uint32 output array, large enough for the frame.
+
+    Returns
+    --------
+
+    n: number of records written.
+
+    macrotime: at the start of the next frame.
+
+    ofltime: overflow time after the last record.
+    """
+    pixY, pixX = counts.shape
+    line_syncs = pixel_syncs * (pixX - 1)
+    photon = np.uint32(channel) << 28
+
+    n, ofltime = _append_record(
+        records, 0, ofltime, macrotime, np.uint32(0xF0000000 | (lsm_frame << 16))
+    )
+    i = 0
+    for y in range(pixY):
+        line_start = macrotime + y * pixel_syncs * pixX
+        n, ofltime = _append_record(
+            records,
+            n,
+            ofltime,
+            line_start,
+            np.uint32(0xF0000000 | (lsm_line_start << 16)),
+        )
+        for x in range(pixX):
+            num = counts[y, x]
+            for k in range(num):
+                # Strictly inside the pixel, except for the last one, which
+                # interpret_LSM maps to the end of the line only.
+                if x < pixX - 1:
+                    offset = x * pixel_syncs + 1 + (k * (pixel_syncs - 1)) // num
+                else:
+                    offset = line_syncs
+                n, ofltime = _append_record(
+                    records,
+                    n,
+                    ofltime,
+                    line_start + offset,
+                    photon | (np.uint32(dtime[i]) << 16),
+                )
+                i += 1
+        n, ofltime = _append_record(
+            records,
+            n,
+            ofltime,
+            line_start + line_syncs,
+            np.uint32(0xF0000000 | (lsm_line_stop << 16)),
+        )
+
+    return n, macrotime + pixY * pixel_syncs * pixX, ofltime
+
+
+class PTUWriter:
+    """Stream a synthetic LSM acquisition to a PicoHarp T3 .ptu file.
+
+    Frames are encoded and appended one at a time, so that files larger
+    than memory can be written. TTResult_NumberOfRecords is written when
+    the file is closed. Use as a context manager::
+
+        with PTUWriter("synthetic.ptu", pixX=256, pixY=256) as writer:
+            for counts, dtime in frames:
+                writer.write_frame(counts, dtime)
+
+    Parameters
+    ----------
+    file : os.PathLike
+    pixX, pixY : int
+        Image size.
+    syncrate : float, optional
+        Laser repetition rate in Hz.
+    resolution : float, optional
+        TAC bin width in s.
+    pixel_syncs : int, optional
+        Pixel dwell time in synchronization periods.
+    channel : int, optional
+        Detector channel of the photons, from 1 to 4.
+    """
+
+    # Marker bits, as numbered in the header.
+    lsm_line_start_bit = 1
+    lsm_line_stop_bit = 2
+    lsm_frame_bit = 3
+
+    def __init__(
+        self,
+        file,
+        pixX,
+        pixY,
+        syncrate=40e6,
+        resolution=16e-12,
+        pixel_syncs=40,
+        channel=1,
+    ):
+        if pixel_syncs < 2:
+            raise ValueError("pixel_syncs must be at least 2.")
+        if not 1 <= channel <= 4:
+            raise ValueError("channel must be between 1 and 4.")
+
+        self.pixX = pixX
+        self.pixY = pixY
+        self.syncrate = syncrate
+        self.resolution = resolution
+        self.pixel_syncs = pixel_syncs
+        self.channel = channel
+        self.num_records = 0
+        self.num_frames = 0
+        self._macrotime = 0
+        self._ofltime = 0
+
+        self._file = open(file, "wb")
+        self._value_offsets = pq_header.write_header_ptu(
+            self._file,
+            [
+                ("CreatorSW_Name", HeaderTypes.ANSI_string, "pyflim"),
+                ("Measurement_Mode", HeaderTypes.int8, 3),
+                ("Measurement_SubMode", HeaderTypes.int8, 3),
+                ("TTResultFormat_TTTRRecType", HeaderTypes.int8, PICOHARP_T3),
+                ("TTResultFormat_BitsPerRecord", HeaderTypes.int8, 32),
+                ("TTResult_SyncRate", HeaderTypes.int8, int(syncrate)),
+                ("MeasDesc_GlobalResolution", HeaderTypes.float8, 1 / syncrate),
+                ("MeasDesc_Resolution", HeaderTypes.float8, resolution),
+                ("ImgHdr_Dimensions", HeaderTypes.int8, 3),
+                ("ImgHdr_Ident", HeaderTypes.int8, 3),
+                ("ImgHdr_PixX", HeaderTypes.int8, pixX),
+                ("ImgHdr_PixY", HeaderTypes.int8, pixY),
+                ("ImgHdr_LineStart", HeaderTypes.int8, self.lsm_line_start_bit),
+                ("ImgHdr_LineStop", HeaderTypes.int8, self.lsm_line_stop_bit),
+                ("ImgHdr_Frame", HeaderTypes.int8, self.lsm_frame_bit),
+                ("ImgHdr_BiDirect", HeaderTypes.bool8, 0),
+                ("TTResult_NumberOfRecords", HeaderTypes.int8, 0),
+            ],
+        )
+
+    def write_frame(self, counts, dtime):
+        """Append a frame.
+
+        Parameters
+        ----------
+        counts : int array of shape (pixY, pixX)
+            Number of photons of each pixel.
+        dtime : int array
+            TAC bins of the photons, sorted by pixel in C order.
+        """
+        counts = np.asarray(counts)
+        dtime = np.asarray(dtime)
+        if counts.shape != (self.pixY, self.pixX):
+            raise ValueError(f"counts must have shape {(self.pixY, self.pixX)}.")
+        if dtime.size != counts.sum():
+            raise ValueError("dtime must have one TAC bin per photon.")
+        if dtime.size > 0 and not 0 <= dtime.min() <= dtime.max() < WRITER_TAC_BINS:
+            raise ValueError(f"dtime must be between 0 and {WRITER_TAC_BINS - 1}.")
+
+        frame_syncs = self.pixY * self.pixX * self.pixel_syncs
+        max_records = dtime.size + 2 * self.pixY + 1
+        max_records += (self._macrotime - self._ofltime + frame_syncs) // T3_WRAP_AROUND
+        records = np.empty(max_records, dtype=np.uint32)
+        n, self._macrotime, self._ofltime = _encode_LSM_frame(
+            counts,
+            dtime,
+            self.channel,
+            self.pixel_syncs,
+            self._macrotime,
+            self._ofltime,
+            1 << (self.lsm_frame_bit - 1),
+            1 << (self.lsm_line_start_bit - 1),
+            1 << (self.lsm_line_stop_bit - 1),
+            records,
+        )
+        records[:n].tofile(self._file)
+        self.num_records += n
+        self.num_frames += 1
+
+    def close(self):
+        """Write the number of records, and close the file."""
+        if self._file.closed:
+            return
+        self._file.seek(self._value_offsets["TTResult_NumberOfRecords"])
+        self._file.write(np.int64(self.num_records).tobytes())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,5 +1,12 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import numpy as np
 from binlets import binlet
+from binlets.modwt import imodwt_level_nd, modwt_level_mask_nd, modwt_level_nd
+from scipy import stats
 
 from .functions import phasor_covariance
 from .misc import complex_to_real
@@ -24,7 +31,53 @@ def _phasor_covariance(N, R1, R2, N_thres=1):
     return cov
 
 
+def _phasors(N, *R, harmonics, **kwargs):
+    """Phasors of harmonics as a real vector.
+
+    R are the Fourier coefficients at harmonics, followed by those
+    at the auxiliary harmonics needed by _phasors_covariance.
+    """
+    R1 = R[: len(harmonics)]
+    return np.concatenate([_phasor(N, r1, None) for r1 in R1], axis=-1)
+
+
+def _phasors_covariance(N, *R, harmonics, R_harmonics, N_thres=1):
+    """Covariance of _phasors, including that between harmonics.
+
+    R are the Fourier coefficients at R_harmonics, which start with
+    harmonics and include n + m and |n - m| for each pair n, m of them.
+    """
+    shape = np.broadcast(N, *R).shape
+    valid = N > N_thres
+    r = {0: np.ones(shape, dtype=complex)}
+    for h, Rh in zip(R_harmonics, R):
+        r[h] = np.divide(Rh, N, where=valid, out=np.zeros(shape, dtype=complex))
+
+    def rr(n):
+        return r[n] if n >= 0 else r[-n].conj()
+
+    cov = np.zeros(shape + (2 * len(harmonics), 2 * len(harmonics)))
+    for i, n in enumerate(harmonics):
+        block = slice(2 * i, 2 * i + 2)
+        cov[..., block, block] = phasor_covariance(N, r[n], r[2 * n], check_zero=False)
+        for j, m in enumerate(harmonics[:i]):
+            # Per photon, cos(n x) cos(m x) = (cos((n+m) x) + cos((n-m) x)) / 2,
+            # and similarly for the other products.
+            rs, rd = rr(n + m), rr(n - m)
+            cross = np.empty(shape + (2, 2))
+            cross[..., 0, 0] = (rs.real + rd.real) / 2 - r[n].real * r[m].real
+            cross[..., 0, 1] = (rs.imag - rd.imag) / 2 - r[n].real * r[m].imag
+            cross[..., 1, 0] = (rs.imag + rd.imag) / 2 - r[n].imag * r[m].real
+            cross[..., 1, 1] = (rd.real - rs.real) / 2 - r[n].imag * r[m].imag
+            cross /= np.expand_dims(N, (-2, -1))
+            cov[..., block, 2 * j : 2 * j + 2] = cross
+            cov[..., 2 * j : 2 * j + 2, block] = np.swapaxes(cross, -2, -1)
+    cov[~valid] = np.diag(np.inf * np.ones(2 * len(harmonics)))  # Inverse equals 0.
+    return cov
+
+
 _pawflim = binlet(_phasor, _phasor_covariance, False)
+_pawflim_harmonics = binlet(_phasors, _phasors_covariance, False)
 
 
 def pawflim(N, R1, R2, levels, p_value=0.05, N_thres=1, axes=None, mask=None):
@@ -78,3 +131,433 @@ def pawflim(N, R1, R2, levels, p_value=0.05, N_thres=1, axes=None, mask=None):
         bin_args=(R2,),
         kwargs={"N_thres": N_thres},
     )
+
+
+def pawflim_harmonics(
+    R,
+    harmonics,
+    levels,
+    p_value=0.05,
+    N_thres=1,
+    axes=None,
+    mask=None,
+    R_harmonics=None,
+):
+    """pawFLIM denoising of several harmonics at once.
+
+    The phasors of all harmonics are tested together, including their
+    covariance across harmonics, so a single binning decision is shared
+    by all of them. The test has 2 * len(harmonics) degrees of freedom.
+    With a single harmonic on a 2D image, it is equivalent to pawflim.
+
+    Parameters
+    ----------
+    R : array_like of shape (num_harmonics, ...)
+        Fourier coefficients, as returned by fourier_image. Must include
+        harmonic 0 (number of counts) and, for each pair n, m of
+        harmonics to denoise (including n == m), harmonics n + m
+        and |n - m|.
+    harmonics : sequence of ints
+        Harmonics to denoise.
+    levels : int
+        Decomposition level. Must be >= 0. If == 0, does nothing.
+        Sets maximum possible binning of size 2**level.
+    p_value : float, optional
+        Controls the level of denoising. Default is 0.05.
+    N_thres : float, optional
+        Pixels where N <= N_thres, automatically pass the test and are binned.
+        Minimum 1.
+
+    Returns
+    -------
+    N : ndarray
+        Denoised number of counts.
+    R : ndarray of shape (len(harmonics), ...)
+        Denoised Fourier coefficients.
+
+    Other Parameters
+    ----------------
+    axes : tuple, optional
+        Axes of R[0] over which transform is applied. Default is all axes.
+    mask : ndarray of bools, optional
+        Marks data to denoise. Data where mask==False is not denoised.
+        By default, all True.
+    R_harmonics : sequence of ints, optional
+        Harmonic of each element of R. By default, range(len(R)).
+    """
+    if N_thres < 1:
+        raise ValueError
+    if R_harmonics is None:
+        R_harmonics = range(len(R))
+    harmonics = tuple(harmonics)
+    # Harmonics needed for the covariance, besides those to denoise.
+    needed = {abs(n + s * m) for n in harmonics for m in harmonics for s in (1, -1)}
+    auxiliary = tuple(sorted(needed - set(harmonics) - {0}))
+    position = {h: i for i, h in enumerate(R_harmonics)}
+    try:
+        N = R[position[0]].real
+        R1 = tuple(R[position[h]] for h in harmonics)
+        R_aux = tuple(R[position[h]] for h in auxiliary)
+    except KeyError as e:
+        raise ValueError(f"Harmonic {e} is missing from R.") from None
+
+    # binlets thresholds with len(axes) degrees of freedom, but the
+    # phasors vector has 2 * len(harmonics) components.
+    if axes is None:
+        num_axes = np.count_nonzero(np.array(np.shape(N)) > 1)
+    else:
+        num_axes = len(axes)
+    p_value = stats.chi2.sf(stats.chi2.isf(p_value, df=2 * len(harmonics)), df=num_axes)
+
+    N, *R1 = _pawflim_harmonics(
+        (N, *R1),
+        levels=levels,
+        p_value=p_value,
+        axes=axes,
+        mask=mask,
+        bin_args=R_aux,
+        kwargs={
+            "harmonics": harmonics,
+            "R_harmonics": harmonics + auxiliary,
+            "N_thres": N_thres,
+        },
+    )
+    return N, np.stack(R1)
+
+
+def pawflim_sweep(N, R1, R2, levels, p_values, N_thres=1, axes=None, mask=None):
+    """pawFLIM denoising for several p-values.
+
+    Equivalent to calling pawflim for each p-value, but the wavelet
+    decomposition and the test statistics, which do not depend on the
+    p-value, are computed only once. Only thresholding and
+    reconstruction are repeated.
+
+    Parameters
+    ----------
+    N : array_like
+        Number of counts.
+    R1, R2 : array_like
+        Fourier harmonics n and 2n.
+    levels : int
+        Decomposition level. Must be >= 0. If == 0, does nothing.
+        Sets maximum possible binning of size 2**level.
+    p_values : sequence of floats
+        Levels of denoising.
+    N_thres : float, optional
+        Pixels where N <= N_thres, automatically pass the test and are binned.
+        Minimum 1.
+
+    Returns
+    -------
+    N, R1 : tuple of ndarrays
+        Denoised inputs, stacked along a first axis of len(p_values).
+
+    Other Parameters
+    ----------------
+    axes : tuple, optional
+        Axes over which transform is applied. Default is all axes.
+    mask : ndarray of bools, optional
+        Marks data to denoise. Data where mask==False is not denoised.
+        By default, all True.
+    """
+    if N_thres < 1:
+        raise ValueError
+    if levels < 0:
+        raise ValueError("Levels must be >= 0.")
+
+    shape = np.broadcast(N, R1).shape
+    if mask is None:
+        mask = np.ones(shape, dtype=bool)
+    if axes is None:
+        axes = np.nonzero(np.array(shape) > 1)[0]
+    else:
+        axes = tuple(np.mod(axes, len(shape)).tolist())
+
+    # Decomposition, keeping the largest statistic over detail coefficients.
+    approxs, bin_args = (N, R1), (R2,)
+    details_levels, statistics = [], []
+    for level in range(levels):
+        val = _phasor(*approxs, *bin_args, N_thres=N_thres)
+        cov = _phasor_covariance(*approxs, *bin_args, N_thres=N_thres)
+        _, diff = modwt_level_nd(val, level, axes)
+        inv_cov = np.linalg.inv(modwt_level_nd(cov, level, axes, approx_only=True))
+        statistic = np.max(
+            [np.einsum("...i,...ij,...j", d, inv_cov, d) for d in diff.values()],
+            axis=0,
+        )
+
+        approxs, details = zip(*(modwt_level_nd(x, level, axes) for x in approxs))
+        bin_args = tuple(
+            modwt_level_nd(x, level, axes, approx_only=True) for x in bin_args
+        )
+        details_levels.append(details)
+        statistics.append(statistic)
+
+    outputs = []
+    for p_value in p_values:
+        threshold = stats.chi2.isf(p_value, df=len(axes))
+
+        # Coefficients are zeroed where the test passes at this and all
+        # previous levels.
+        level_mask = np.array(mask, dtype=bool)
+        masks = []
+        for level, statistic in enumerate(statistics):
+            level_mask = modwt_level_mask_nd(level_mask, level, axes)
+            level_mask &= statistic < threshold
+            masks.append(level_mask.copy())
+
+        result = approxs
+        for level in reversed(range(levels)):
+            result = tuple(
+                imodwt_level_nd(
+                    a,
+                    {key: np.where(masks[level], 0, d) for key, d in details.items()},
+                    level,
+                    axes,
+                )
+                for a, details in zip(result, details_levels[level])
+            )
+        outputs.append(result)
+
+    N, R1 = zip(*outputs)
+    return np.stack(N), np.stack(R1)
+
+
+def pawflim_tiled(
+    N,
+    R1,
+    R2,
+    levels,
+    tile_shape=(1024, 1024),
+    p_value=0.05,
+    N_thres=1,
+    axes=None,
+    mask=None,
+    out=None,
+    n_workers=None,
+):
+    """pawFLIM denoising of large images, by tiles.
+
+    Tiles are read with a halo of 2**levels pixels on each side, which
+    covers the support of the transform, and denoised in a process pool.
+    The halo wraps around the image edges, as the transform does, so
+    that the result equals that of pawflim.
+
+    Only a bounded number of tiles are in flight at a time, so inputs
+    and outputs can be memory-mapped arrays larger than memory.
+
+    Parameters
+    ----------
+    N : array_like
+        Number of counts.
+    R1, R2 : array_like
+        Fourier harmonics n and 2n. Same shape as N.
+    levels : int
+        Decomposition level. Must be >= 0. If == 0, does nothing.
+        Sets maximum possible binning of size 2**level.
+    tile_shape : tuple of ints, optional
+        Shape of the tiles, without halo, along the transformed axes.
+    p_value : float, optional
+        Controls the level of denoising. Default is 0.05.
+    N_thres : float, optional
+        Pixels where N <= N_thres, automatically pass the test and are binned.
+        Minimum 1.
+
+    Returns
+    -------
+    N, R1 : tuple of ndarrays
+        Tuple of denoised inputs, or out if given.
+
+    Other Parameters
+    ----------------
+    axes : tuple, optional
+        Axes over which transform is applied. Default is all axes.
+    mask : ndarray of bools, optional
+        Marks data to denoise. Data where mask==False is not denoised.
+        By default, all True.
+    out : tuple of ndarrays, optional
+        Float and complex arrays of the same shape as N where the
+        results are written, such as np.memmap.
+    n_workers : int, optional
+        Number of processes. By default, os.cpu_count(). If 1, tiles
+        are denoised in the current process.
+    """
+    if N_thres < 1:
+        raise ValueError
+    if not (np.shape(N) == np.shape(R1) == np.shape(R2)):
+        raise ValueError("N, R1 and R2 must have the same shape.")
+
+    shape = np.shape(N)
+    if axes is None:
+        axes = tuple(np.nonzero(np.array(shape) > 1)[0].tolist())
+    else:
+        axes = tuple(np.mod(axes, len(shape)).tolist())
+    if len(tile_shape) != len(axes):
+        raise ValueError("tile_shape must have one element per transformed axis.")
+
+    tiles = [None] * len(shape)
+    halos = [0] * len(shape)
+    for axis, size in zip(axes, tile_shape):
+        tiles[axis] = size
+        halos[axis] = 2 ** levels if levels > 0 else 0
+
+    regions = _tile_regions(shape, tiles)
+    params = (levels, p_value, N_thres, axes)
+    return _pawflim_regions(N, R1, R2, mask, regions, halos, params, out, n_workers)
+
+
+def pawflim_batch(
+    N,
+    R1,
+    R2,
+    levels,
+    p_value=0.05,
+    N_thres=1,
+    axes=(-2, -1),
+    mask=None,
+    out=None,
+    n_workers=None,
+    batch_size=1,
+):
+    """pawFLIM denoising of a stack of independent images.
+
+    The transform is applied over axes only, so that every slice along
+    the other (batch) axes, such as frames or positions, is denoised
+    independently. Slices are denoised concurrently in a process pool,
+    and results are written into the output as they complete.
+
+    Only a bounded number of slices are in flight at a time, so inputs
+    and outputs can be memory-mapped arrays larger than memory.
+
+    Parameters
+    ----------
+    N : array_like
+        Number of counts, for instance of shape (frames, y, x).
+    R1, R2 : array_like
+        Fourier harmonics n and 2n. Same shape as N.
+    levels : int
+        Decomposition level. Must be >= 0. If == 0, does nothing.
+        Sets maximum possible binning of size 2**level.
+    p_value : float, optional
+        Controls the level of denoising. Default is 0.05.
+    N_thres : float, optional
+        Pixels where N <= N_thres, automatically pass the test and are binned.
+        Minimum 1.
+
+    Returns
+    -------
+    N, R1 : tuple of ndarrays
+        Tuple of denoised inputs, or out if given.
+
+    Other Parameters
+    ----------------
+    axes : tuple, optional
+        Axes over which transform is applied. Default is the last two.
+    mask : ndarray of bools, optional
+        Marks data to denoise. Data where mask==False is not denoised.
+        By default, all True.
+    out : tuple of ndarrays, optional
+        Float and complex arrays of the same shape as N where the
+        results are written, such as np.memmap.
+    n_workers : int, optional
+        Number of processes. By default, os.cpu_count(). If 1, slices
+        are denoised in the current process.
+    batch_size : int, optional
+        Number of consecutive slices along the last batch axis that are
+        denoised together in a single task.
+    """
+    if N_thres < 1:
+        raise ValueError
+    if not (np.shape(N) == np.shape(R1) == np.shape(R2)):
+        raise ValueError("N, R1 and R2 must have the same shape.")
+
+    shape = np.shape(N)
+    axes = tuple(np.mod(axes, len(shape)).tolist())
+    batch_axes = [axis for axis in range(len(shape)) if axis not in axes]
+
+    # Transformed axes are not split.
+    tiles = [None] * len(shape)
+    for axis in batch_axes:
+        tiles[axis] = 1
+    if batch_axes:
+        tiles[batch_axes[-1]] = batch_size
+
+    regions = _tile_regions(shape, tiles)
+    halos = [0] * len(shape)
+    params = (levels, p_value, N_thres, axes)
+    return _pawflim_regions(N, R1, R2, mask, regions, halos, params, out, n_workers)
+
+
+def _pawflim_regions(N, R1, R2, mask, regions, halos, params, out, n_workers):
+    """Denoise regions, with halo, and write them into out.
+
+    The halo wraps around the edges of the arrays.
+    """
+    shape = np.shape(N)
+    if out is None:
+        out = np.empty(shape, dtype=float), np.empty(shape, dtype=complex)
+
+    def read(region):
+        if any(halos):
+            index = np.ix_(
+                *(
+                    np.arange(s.start - h, s.stop + h) % n
+                    for s, h, n in zip(region, halos, shape)
+                )
+            )
+        else:
+            index = region
+        # Copies, as binlets modifies mask in place.
+        arrays = [np.array(x[index]) for x in (N, R1, R2)]
+        arrays.append(None if mask is None else np.array(mask[index]))
+        return arrays
+
+    def write(region, result):
+        for o, r in zip(out, result):
+            o[region] = r
+
+    interior = tuple(slice(h, -h if h > 0 else None) for h in halos)
+    params = (*params, interior)
+
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1:
+        for region in regions:
+            write(region, _pawflim_tile(*read(region), *params))
+        return out
+
+    # Forking a process after numba threads were started can deadlock.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+        max_pending = 2 * n_workers
+        pending = {}
+        for region in regions:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(pending.pop(future), future.result())
+            future = executor.submit(_pawflim_tile, *read(region), *params)
+            pending[future] = region
+        for future in pending:
+            write(pending[future], future.result())
+    return out
+
+
+def _tile_regions(shape, tiles):
+    """Yield tuples of slices covering shape with tiles.
+
+    If tiles[axis] is None, the axis is not split.
+    """
+    starts = [range(0, n, t or n) for n, t in zip(shape, tiles)]
+    for start in itertools.product(*starts):
+        yield tuple(
+            slice(s, min(s + (t or n), n)) for s, t, n in zip(start, tiles, shape)
+        )
+
+
+def _pawflim_tile(N, R1, R2, mask, levels, p_value, N_thres, axes, interior):
+    """Denoise a tile with halo, and return its interior."""
+    N, R1 = pawflim(
+        N, R1, R2, levels, p_value=p_value, N_thres=N_thres, axes=axes, mask=mask
+    )
+    return N[interior], R1[interior]
@@ -1,5 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numba as nb
 import numpy as np
 
+from .functions import phasor_from_lifetime
+from .io.functions import WRITER_TAC_BINS
+
 
 def _exponential_rv(t, tau, T):
     """Generate truncated exponential random variable from uniform [0, 1) random variable.
@@ -16,8 +22,57 @@ def _exponential_rv(t, tau, T):
     return -tau * np.log(1 - t * (1 - np.exp(-T / tau)))
 
 
+def _as_generator(rng):
+    """Convert a seed to a Generator. Generators pass through.
+
+    If None, the Generator is seeded from the global NumPy random state,
+    so that np.random.seed makes results reproducible.
+    """
+    if rng is None:
+        # uint32, as the default integer is int32 on Windows.
+        rng = np.random.randint(2 ** 32, dtype=np.uint32)
+    return np.random.default_rng(rng)
+
+
+# Length of the chunks with independent random streams.
+CHUNK_SIZE = 2 ** 16
+
+
+def _map_chunks(func, length, rng, n_workers):
+    """Call func(rng, chunk) for disjoint chunks of range(length).
+
+    Each chunk of CHUNK_SIZE gets an independent child stream, spawned
+    with SeedSequence.spawn from a seed drawn from rng. With n_workers > 1,
+    the chunks are computed concurrently in threads. As chunks do not
+    depend on n_workers, results depend on the seed only.
+
+    Parameters
+    ----------
+    func : callable
+        Called with a Generator and a slice.
+    length : int
+    rng : numpy.random.Generator
+    n_workers : int
+    """
+    starts = range(0, length, CHUNK_SIZE)
+    seeds = np.random.SeedSequence(rng.integers(2 ** 63)).spawn(len(starts))
+    chunks = [
+        (np.random.default_rng(seed), slice(start, start + CHUNK_SIZE))
+        for seed, start in zip(seeds, starts)
+    ]
+    if n_workers == 1:
+        for chunk_rng, chunk in chunks:
+            func(chunk_rng, chunk)
+        return
+
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(func, *chunk) for chunk in chunks]
+        for future in futures:
+            future.result()
+
+
 # VER PARAMETRO N
-def single_lifetime(tau, N, T):
+def single_lifetime(tau, N, T, rng=None, n_workers=1):
     """Generate single exponential samples.
 
     Parameters
@@ -28,17 +83,30 @@ def single_lifetime(tau, N, T):
         Number of samples.
     T : array-like
         Size of measurement window (inverse of measurement frequency).
+    rng : numpy.random.Generator, int or SeedSequence, optional
+        Random number generator, or seed. By default, seeded from the
+        global NumPy random state.
+    n_workers : int, optional
+        Number of threads. Chunks of the output are filled with independent
+        random streams, so results do not depend on n_workers.
 
     Returns
     -------
 
     """
-    t = np.random.random(size=N)
-    t = _exponential_rv(t, tau, T)
+    shape = (N,) if np.ndim(N) == 0 else tuple(N)
+    tau = np.broadcast_to(tau, shape)
+    T = np.broadcast_to(T, shape)
+    t = np.empty(shape)
+
+    def fill(rng, chunk):
+        t[chunk] = _exponential_rv(rng.random(t[chunk].shape), tau[chunk], T[chunk])
+
+    _map_chunks(fill, shape[0], _as_generator(rng), n_workers)
     return t
 
 
-def dual_lifetime(tau1, tau2, p, N, T):
+def dual_lifetime(tau1, tau2, p, N, T, rng=None, n_workers=1):
     """Generate bi-exponential samples.
 
     Parameters
@@ -51,41 +119,246 @@ def dual_lifetime(tau1, tau2, p, N, T):
         Number of samples.
     T : array-like
         Size of measurement window (inverse of measurement frequency).
+    rng : numpy.random.Generator, int or SeedSequence, optional
+        Random number generator, or seed. By default, seeded from the
+        global NumPy random state.
+    n_workers : int, optional
+        Number of threads. Chunks of the output are filled with independent
+        random streams, so results do not depend on n_workers.
 
     Returns
     -------
 
     """
-    return multi_lifetime((tau1, tau2), (p, 1 - p), N, T)
+    return multi_lifetime((tau1, tau2), (p, 1 - p), N, T, rng, n_workers)
 
 
-def multi_lifetime(taus, p, N, T):
+def multi_lifetime(taus, p, N, T, rng=None, n_workers=1):
     """Generate multi-exponential samples.
 
     Parameters
     ----------
     taus : list or array-like
-        List of lifetimes.
+        List of lifetimes, each broadcastable to the output shape.
     p : list or array-like
-        List of photon fractions.
-    N : array-like
-        Number of samples.
+        List of photon fractions, each broadcastable to the output shape.
+    N : int or tuple of ints
+        Number of samples, or output shape.
     T : array-like
         Size of measurement window (inverse of measurement frequency).
+    rng : numpy.random.Generator, int or SeedSequence, optional
+        Random number generator, or seed. By default, seeded from the
+        global NumPy random state.
+    n_workers : int, optional
+        Number of threads. Chunks of the output are filled with independent
+        random streams, so results do not depend on n_workers.
 
     Returns
     -------
 
     """
-    p = np.asarray(p)
-    p = p / p.sum(axis=0)  # Normalize photon fractions
+    shape = (N,) if np.ndim(N) == 0 else tuple(N)
+    taus = np.stack(np.broadcast_arrays(*map(np.asarray, taus)))
+    p = np.stack(np.broadcast_arrays(*map(np.asarray, p))).astype(float)
+    cum_p = np.cumsum(p / p.sum(axis=0), axis=0)  # Normalize photon fractions
 
-    b = np.random.multinomial(1, p, N)
-    b = np.argmax(b, axis=-1)
+    # Parameters are passed as broadcast views, without copies.
+    taus = _broadcast_components(taus, shape)
+    cum_p = _broadcast_components(cum_p, shape)
+    T = np.broadcast_to(T, shape)
+    t = np.empty(shape)
 
-    t = np.random.random(size=N)
-    for k, tau in enumerate(taus):
-        cond = b == k
-        t[cond] = _exponential_rv(t[cond], tau, T)
+    def fill(rng, chunk):
+        _multi_lifetime(
+            t[chunk].reshape(-1), taus[:, chunk], cum_p[:, chunk], T[chunk], rng
+        )
 
+    _map_chunks(fill, shape[0], _as_generator(rng), n_workers)
     return t
+
+
+def _broadcast_components(x, shape):
+    """Broadcast an array of shape (num_components, ...) to (num_components, *shape)."""
+    x = x.reshape(x.shape[:1] + (1,) * (len(shape) - x.ndim + 1) + x.shape[1:])
+    return np.broadcast_to(x, x.shape[:1] + shape)
+
+
+@nb.njit(nogil=True)
+def _multi_lifetime(out, taus, cum_p, T, rng):
+    """Numba-compiled function to generate multi-exponential samples.
+
+    For each sample, the component is chosen by a search on the
+    cumulative photon fractions, and the time is generated with
+    _exponential_rv.
+
+    Parameters
+    ----------
+    out : 1D ndarray
+        Output samples, flattened.
+    taus, cum_p : ndarray of shape (num_components, *shape)
+        Lifetimes and cumulative photon fractions.
+    T : ndarray of shape
+        Size of measurement window.
+    """
+    last = taus.shape[0] - 1
+    for i, index in enumerate(np.ndindex(T.shape)):
+        u = rng.random()
+        k = 0
+        while k < last and u >= cum_p[(k,) + index]:
+            k += 1
+        tau = taus[(k,) + index]
+        t = rng.random()
+        out[i] = -tau * np.log(1 - t * (1 - np.exp(-T[index] / tau)))
+
+
+def fourier_image(
+    taus, p, N, T, harmonics=(0, 1, 2), exact_below=16, rng=None, n_workers=1
+):
+    """Generate Fourier coefficients of multi-exponential samples.
+
+    Draws the sum over photons of exp(2j * pi * n * t / T) for every
+    pixel, without generating arrival times for every photon. Pixels
+    with more than exact_below photons are drawn from the asymptotic
+    (multivariate normal) distribution, with the exact mean and
+    covariance. Pixels with fewer photons are simulated photon by photon.
+
+    Parameters
+    ----------
+    taus : list or array-like
+        List of lifetimes, each broadcastable to the image shape.
+    p : list or array-like
+        List of photon fractions, each broadcastable to the image shape.
+    N : array-like of ints
+        Number of photons of each pixel.
+    T : float
+        Size of measurement window (inverse of measurement frequency).
+    harmonics : sequence of non-negative ints, optional
+        Harmonics to compute.
+    exact_below : int, optional
+        Pixels with N <= exact_below are simulated photon by photon.
+    rng : numpy.random.Generator, int or SeedSequence, optional
+        Random number generator, or seed. By default, seeded from the
+        global NumPy random state.
+    n_workers : int, optional
+        Number of threads. Chunks of the output are filled with independent
+        random streams, so results do not depend on n_workers.
+
+    Returns
+    -------
+    R : complex ndarray of shape (len(harmonics), *image.shape)
+        Fourier coefficients, as returned by fourier_image of a dataset.
+    """
+    shape = np.broadcast(*taus, *p, N).shape
+    taus = np.stack([np.broadcast_to(tau, shape).ravel() for tau in taus])
+    p = np.stack([np.broadcast_to(pk, shape).ravel() for pk in p]).astype(float)
+    p = p / p.sum(axis=0)  # Normalize photon fractions
+    N = np.broadcast_to(N, shape).ravel()
+
+    R = np.empty((len(harmonics), N.size), dtype=complex)
+
+    def fill(rng, chunk):
+        pixels = np.arange(N.size)[chunk]
+        exact = pixels[N[chunk] <= exact_below]
+        R[:, exact] = _exact_fourier(
+            taus[:, exact], p[:, exact], N[exact], T, harmonics, rng
+        )
+        asymptotic = pixels[N[chunk] > exact_below]
+        R[:, asymptotic] = _asymptotic_fourier(
+            taus[:, asymptotic], p[:, asymptotic], N[asymptotic], T, harmonics, rng
+        )
+
+    _map_chunks(fill, N.size, _as_generator(rng), n_workers)
+    return R.reshape(len(harmonics), *shape)
+
+
+def _exact_fourier(taus, p, N, T, harmonics, rng):
+    """Fourier coefficients by simulating each photon."""
+    pixel = np.repeat(np.arange(N.size), N)
+    t = multi_lifetime(taus[:, pixel], p[:, pixel], pixel.size, T, rng)
+    R = np.empty((len(harmonics), N.size), dtype=complex)
+    for i, n in enumerate(harmonics):
+        z = np.exp(2j * np.pi * n * t / T)
+        R[i] = np.bincount(pixel, z.real, N.size) + 1j * np.bincount(
+            pixel, z.imag, N.size
+        )
+    return R
+
+
+def _asymptotic_fourier(taus, p, N, T, harmonics, rng):
+    """Fourier coefficients from their asymptotic normal distribution."""
+
+    def r(n):
+        # Phasor of a single photon at harmonic n.
+        r = np.sum(p * phasor_from_lifetime(taus, abs(n) / T), axis=0)
+        return r if n >= 0 else r.conj()
+
+    # Real vector (cos, sin) of each non-zero harmonic.
+    nonzero = sorted({n for n in harmonics if n != 0})
+    mean = np.stack([f(r(n)) for n in nonzero for f in (np.real, np.imag)], axis=-1)
+    cov = np.empty((N.size, mean.shape[-1], mean.shape[-1]))
+    for i, a in enumerate(nonzero):
+        for j, b in enumerate(nonzero):
+            r_sum, r_diff = r(a + b), r(a - b)
+            cov[:, 2 * i, 2 * j] = (r_sum.real + r_diff.real) / 2
+            cov[:, 2 * i + 1, 2 * j + 1] = (r_diff.real - r_sum.real) / 2
+            cov[:, 2 * i, 2 * j + 1] = (r_sum.imag - r_diff.imag) / 2
+            cov[:, 2 * i + 1, 2 * j] = (r_sum.imag + r_diff.imag) / 2
+    cov -= mean[:, :, None] * mean[:, None, :]
+
+    # Square root of the covariance, robust to singular matrices.
+    eigval, eigvec = np.linalg.eigh(cov)
+    scale = eigvec * np.sqrt(np.clip(eigval, 0, None))[:, None, :]
+    z = rng.standard_normal(mean.shape)
+    x = N[:, None] * mean + np.sqrt(N)[:, None] * np.einsum("pij,pj->pi", scale, z)
+
+    R = np.empty((len(harmonics), N.size), dtype=complex)
+    for i, n in enumerate(harmonics):
+        if n == 0:
+            R[i] = N
+        else:
+            k = nonzero.index(n)
+            R[i] = x[:, 2 * k] + 1j * x[:, 2 * k + 1]
+    return R
+
+
+def write_frames(writer, taus, p, N, num_frames, rng=None):
+    """Write frames of multi-exponential photons with a file writer.
+
+    The number of photons of each pixel is Poisson distributed, and
+    their arrival times are binned in TAC bins of the writer resolution.
+    Photons beyond the last TAC bin are not recorded. Frames are
+    generated one at a time, so that memory usage does not depend on
+    num_frames.
+
+    Parameters
+    ----------
+    writer : PTUWriter or SPCWriter
+        With syncrate, resolution and write_frame(counts, dtime).
+    taus : list or array-like
+        List of lifetimes, each broadcastable to the image shape.
+    p : list or array-like
+        List of photon fractions, each broadcastable to the image shape.
+    N : 2D array-like
+        Mean number of photons of each pixel per frame.
+    num_frames : int
+    rng : numpy.random.Generator, int or SeedSequence, optional
+        Random number generator, or seed. By default, seeded from the
+        global NumPy random state.
+    """
+    rng = _as_generator(rng)
+    N = np.asarray(N)
+    taus = np.stack([np.broadcast_to(tau, N.shape).ravel() for tau in taus])
+    p = np.stack([np.broadcast_to(pk, N.shape).ravel() for pk in p])
+    T = 1 / writer.syncrate
+
+    for _ in range(num_frames):
+        counts = rng.poisson(N)
+        pixel = np.repeat(np.arange(N.size), counts.ravel())
+        t = multi_lifetime(taus[:, pixel], p[:, pixel], pixel.size, T, rng)
+        dtime = (t / writer.resolution).astype(np.int64)
+        if dtime.size > 0 and dtime.max() >= WRITER_TAC_BINS:
+            recorded = dtime < WRITER_TAC_BINS
+            dtime = dtime[recorded]
+            counts = np.bincount(pixel[recorded], minlength=N.size)
+            counts = counts.reshape(N.shape)
+        writer.write_frame(counts, dtime)
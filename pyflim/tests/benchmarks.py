@@ -0,0 +1,34 @@
+import unittest
+
+from pyflim import benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_cases(self):
+        cases = list(
+            benchmarks.cases(
+                ["fourier_image", "phasor_covariance"],
+                photons=[10, 100],
+                image_size=[8],
+                harmonics=[1, 2],
+            )
+        )
+        self.assertEqual(len(cases), 5)
+        self.assertEqual(cases[-1], ("phasor_covariance", {"image_size": 8}))
+
+    def test_run_case(self):
+        for name in ("read_events", "interpret_LSM", "interpret_AI", "histogram"):
+            with self.subTest(name=name):
+                params = {"photons": 1000, "image_size": 8}
+                result = benchmarks.run_case(name, params, repeat=2)
+                self.assertNotIn("error", result)
+                self.assertEqual(len(result["times"]), 2)
+                self.assertGreater(result["photons_per_s"], 0)
+                self.assertGreaterEqual(result["jit_time"], 0)
+
+        ratios = benchmarks.compare([result], [result])
+        self.assertEqual(list(ratios.values()), [1.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
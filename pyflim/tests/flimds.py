@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from pyflim.flimds import Constant, CorrectedFLIMds, FRETFLIMds
+
+
+class ConstantFLIMds(Constant):
+    frequency = 80e6
+
+
+class TestCorrectedFLIMds(unittest.TestCase):
+    def setUp(self):
+        self.ufds = ConstantFLIMds([10, 5 + 2j, 3 + 1j])
+        self.irf = Constant([1, 1, 1])
+        self.bg = Constant([0, 0, 0])
+
+    def test_phasor_cache(self):
+        cfds = FRETFLIMds(self.ufds, self.irf, self.bg, 0.5 + 0.2j, 0.7 + 0.4j)
+        mask = np.ones(3, dtype=bool)
+
+        with patch.object(
+            self.ufds, "fourier_image", wraps=self.ufds.fourier_image
+        ) as fourier_image:
+            for m in (None, mask):
+                cfds.mlt_image((1, 2), mask=m)
+                cfds.plt_image((1, 2), mask=m)
+                cfds.nlt_image((1, 2), mask=m)
+                cfds.p_image((1, 2), mask=m)
+                cfds.m_image((1, 2), mask=m)
+            self.assertEqual(fourier_image.call_count, 2)
+
+            # Same contents, different object.
+            cfds.phasor_image((1, 2), mask=mask.copy())
+            self.assertEqual(fourier_image.call_count, 2)
+
+            cfds.clear_cache()
+            r = cfds.phasor_image((1, 2))
+            self.assertEqual(fourier_image.call_count, 3)
+            np.testing.assert_allclose(r, [0.5 + 0.2j, 0.3 + 0.1j])
+
+            # Returned arrays are not shared with the cache.
+            r[:] = 0
+            r = cfds.phasor_image((1, 2))
+            self.assertEqual(fourier_image.call_count, 3)
+            self.assertTrue(r.flags.writeable)
+            np.testing.assert_allclose(r, [0.5 + 0.2j, 0.3 + 0.1j])
+
+    def test_cache_size(self):
+        cfds = CorrectedFLIMds(self.ufds, self.irf, self.bg, cache_size=1)
+
+        with patch.object(
+            self.ufds, "fourier_image", wraps=self.ufds.fourier_image
+        ) as fourier_image:
+            cfds.phasor_image((1,))
+            cfds.phasor_image((2,))
+            cfds.phasor_image((1,))
+            self.assertEqual(fourier_image.call_count, 3)
+
+        cfds = CorrectedFLIMds(self.ufds, self.irf, self.bg, cache_size=0)
+        self.assertTrue(cfds.phasor_image((1,)).flags.writeable)
@@ -0,0 +1,107 @@
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+
+from pyflim.io.becker_hickl import SPC, bh_numba
+from pyflim.io.becker_hickl.bh_writer import SPCWriter
+
+
+def make_records(rng, frames=3, lines=4, pixels=5):
+    """Records of a scan with frame (4), line (2) and pixel (1) markers."""
+    macrotime = 0
+    records = []
+
+    def append(kind, value):
+        nonlocal macrotime
+        macrotime += rng.integers(1, 6000)
+        record = value | (macrotime & 0xFFF)
+        if macrotime >= 0x1000:
+            overflows, macrotime = divmod(macrotime, 0x1000)
+            if overflows > 1:
+                records.append(0xC0000000 | (overflows - 1))  # only overflow
+            record |= 0x40000000
+        records.append(record | kind)
+
+    for _ in range(frames):
+        append(0x10000000, 4 << 12)
+        for _ in range(lines):
+            append(0x10000000, 2 << 12)
+            for _ in range(pixels):
+                append(0x10000000, 1 << 12)
+                for _ in range(rng.integers(5)):
+                    append(0, int(rng.integers(1, 4096)) << 16)
+    return np.array(records, dtype=np.uint32)
+
+
+class TestReader(unittest.TestCase):
+    def test_read_events_parallel(self):
+        records = np.random.default_rng(0).integers(2 ** 32, size=10 ** 5)
+        records = records.astype(np.uint32)
+        expected = bh_numba._read_events(records, records.size)
+
+        for nb_chunks in (1, 7, 64):
+            with self.subTest(nb_chunks=nb_chunks):
+                result = bh_numba._read_events_parallel(
+                    records, records.size, nb_chunks
+                )
+                for r, e in zip(result, expected):
+                    self.assertEqual(r.dtype, e.dtype)
+                    self.assertTrue(np.all(r == e))
+
+    def test_read_AI_range(self):
+        records = make_records(np.random.default_rng(0))
+        expected = bh_numba.interpret_AI(
+            *bh_numba._read_events(records, records.size), 0, 0, 4, 2, 1, 0
+        )[:4]
+        index = bh_numba.index_AI_markers(records, 4, 2)
+        self.assertEqual(index.frame_offsets.size, 3)
+        self.assertEqual(index.line_start_offsets.size, 12)
+
+        for start, stop in ((0, 1), (1, 2), (1, 3), (0, 3)):
+            with self.subTest(start=start, stop=stop):
+                result = bh_numba.read_AI_range(records, index, start, stop, 4, 2, 1, 0)
+                in_range = (expected[2] >= start) & (expected[2] < stop)
+                for r, e in zip(result, expected):
+                    self.assertTrue(np.all(r == e[in_range]))
+
+
+class TestWriter(unittest.TestCase):
+    def test_roundtrip(self):
+        rng = np.random.default_rng(0)
+        frames = []
+        for _ in range(3):
+            counts = rng.poisson(3, size=(7, 9))
+            frames.append((counts, rng.integers(4096, size=counts.sum())))
+
+        with tempfile.TemporaryDirectory() as directory:
+            file = pathlib.Path(directory, "synthetic.spc")
+            # Long pixels, so that there are multiple overflows between records.
+            with SPCWriter(file, macro_clock=12.5e-9, pixel_clocks=10000) as writer:
+                for counts, dtime in frames:
+                    writer.write_frame(counts, dtime)
+
+            spc = SPC(file, writer.tac_range)
+            self.assertAlmostEqual(spc.syncrate, 80e6)
+            self.assertEqual((spc.pixY, spc.pixX), (7, 9))
+            for f, (counts, dtime) in enumerate(frames):
+                y, x = np.indices(counts.shape)
+                in_frame = spc.f == f
+                self.assertTrue(
+                    np.all(spc.x[in_frame] == np.repeat(x.ravel(), counts.ravel()))
+                )
+                self.assertTrue(
+                    np.all(spc.y[in_frame] == np.repeat(y.ravel(), counts.ravel()))
+                )
+                self.assertTrue(np.all(spc.dtime[in_frame] == dtime))
+                self.assertTrue(np.all(spc.read_frames(f)[3] == dtime))
+
+            for start, stop in ((-1, None), (3, None), (1, 1)):
+                with self.subTest(start=start, stop=stop):
+                    with self.assertRaises(IndexError):
+                        spc.read_frames(start, stop)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from pyflim.io import catalog
+
+
+class TestCatalog(unittest.TestCase):
+    ptu_file = pathlib.Path("tests/io/picoquant/ptu_example.ptu")
+
+    def setUp(self):
+        self.directory = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        (self.directory / "sub").mkdir()
+        shutil.copy(self.ptu_file, self.directory / "a.ptu")
+        shutil.copy(self.ptu_file, self.directory / "sub" / "b.PTU")
+        # Header with invalid photon bit and a 12.5 ns macro clock.
+        np.array([0x80000000 | 125, 0], dtype=np.uint32).tofile(
+            self.directory / "c.spc"
+        )
+        (self.directory / "notes.txt").write_text("not indexed")
+
+    def test_update_catalog(self):
+        result = catalog.update_catalog(self.directory, n_workers=2)
+
+        self.assertEqual(list(result["path"]), ["a.ptu", "c.spc", "sub/b.PTU"])
+        self.assertEqual(list(result["format"]), ["ptu", "spc", "ptu"])
+        ptu = result[result["format"] == "ptu"]
+        self.assertTrue(np.all(ptu["num_records"] == 19418))
+        self.assertTrue(np.all(ptu["syncrate"] == 40e6))
+        self.assertTrue(np.all(ptu["pixX"] == 128))
+        self.assertTrue(np.all(ptu["scanner"] == 3))
+        spc = result[result["format"] == "spc"][0]
+        self.assertEqual(spc["num_records"], 2)
+        self.assertAlmostEqual(spc["syncrate"], 80e6)
+        self.assertEqual(spc["pixX"], -1)
+
+        catalog_file = self.directory / catalog.CATALOG_FILENAME
+        loaded = catalog.load_catalog(catalog_file)
+        self.assertEqual(loaded.dtype, result.dtype)
+        for name in ("path", "mtime_ns", "num_records"):
+            np.testing.assert_array_equal(loaded[name], result[name])
+
+    def test_incremental_update(self):
+        catalog.update_catalog(self.directory, n_workers=1)
+
+        (self.directory / "c.spc").unlink()
+        (self.directory / "d.ptu").write_bytes(b"broken")
+        os.utime(self.directory / "a.ptu", ns=(0, 0))
+        with unittest.mock.patch.object(
+            catalog, "_try_read_entry", wraps=catalog._try_read_entry
+        ) as read:
+            with self.assertWarns(UserWarning):
+                result = catalog.update_catalog(self.directory, n_workers=1)
+
+        read_paths = sorted(call.args[0].name for call in read.call_args_list)
+        self.assertEqual(read_paths, ["a.ptu", "d.ptu"])
+        self.assertEqual(list(result["path"]), ["a.ptu", "sub/b.PTU"])
+        self.assertEqual(result["mtime_ns"][0], 0)
@@ -1,10 +1,22 @@
 import json
 import pathlib
+import tempfile
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 
-from pyflim.io.picoquant import pq_header, pq_numba
+from pyflim.io.cache import PhotonCache
+from pyflim.io.functions import (
+    _fourier_image_parallel,
+    complex_exp,
+    decay_image,
+    fourier_from_decay,
+    fourier_image,
+    histogram,
+)
+from pyflim.io.picoquant import PTU, pq_header, pq_numba
+from pyflim.io.picoquant.pq_writer import PTUWriter
 
 
 class TestHeader(unittest.TestCase):
@@ -20,6 +32,67 @@ class TestHeader(unittest.TestCase):
         self.assertDictEqual(header, expected_header)
         self.assertEqual(records_start, expected_records_start)
 
+    def test_read_ptu_header_tags(self):
+        with open(self.ptu_file.with_suffix(".json")) as file:
+            expected_header, expected_records_start = json.load(file)
+
+        tags = ["MeasDesc_Resolution", "TTResult_SyncRate", "Missing"]
+        header, records_start = pq_header.read_header_ptu(self.ptu_file, tags=tags)
+        self.assertDictEqual(header, {k: expected_header[k] for k in tags[:2]})
+        self.assertEqual(records_start, expected_records_start)
+
+        with patch.object(pq_header, "HEADER_CHUNK_SIZE", 100):
+            header, records_start = pq_header.read_header_ptu(self.ptu_file)
+        self.assertDictEqual(header, expected_header)
+        self.assertEqual(records_start, expected_records_start)
+
+    def test_read_ptu_header_variable_length(self):
+        types = pq_header.HeaderTypes
+        tags = [("Empty", types.empty8, 0)]
+        for i in range(200):
+            tags += [
+                (f"String{i}", types.ANSI_string, "x" * (i % 20)),
+                (f"Int{i}", types.int8, -i),
+                (f"Bool{i}", types.bool8, i % 2),
+                (f"Float{i}", types.float8, i / 3),
+                (f"Array{i}", types.float8_array, [i, 0.5]),
+            ]
+        tags.append(("File_Comment", types.ANSI_string, "comment"))
+
+        expected = {"Version": "1.0.00"}
+        for name, tag_type, value in tags:
+            if tag_type == types.bool8:
+                value = bool(value)
+            elif tag_type == types.float8_array:
+                value = tuple(map(float, value))
+            expected[name] = value
+        del expected["File_Comment"]
+        expected["Header_End"] = 0
+
+        with tempfile.TemporaryDirectory() as directory:
+            file = pathlib.Path(directory, "header.ptu")
+            with open(file, "wb") as f:
+                pq_header.write_header_ptu(f, tags)
+                f.write(b"records")
+
+            for chunk_size in (100, 2 ** 20):
+                with patch.object(pq_header, "HEADER_CHUNK_SIZE", chunk_size):
+                    header, records_start = pq_header.read_header_ptu(file)
+                self.assertEqual(list(header.items()), list(expected.items()))
+                self.assertEqual(records_start, file.stat().st_size - 7)
+
+            # Only the fixed-size tags that may be requested are converted.
+            with patch.object(
+                pq_header, "_convert_fixed_tags", wraps=pq_header._convert_fixed_tags
+            ) as convert:
+                header, _ = pq_header.read_header_ptu(
+                    file, tags=["Int3", "String7", "Float12"]
+                )
+            self.assertDictEqual(
+                header, {"Int3": -3, "String7": "x" * 7, "Float12": 4.0}
+            )
+            self.assertEqual(len(convert.call_args.args[0]), 2)
+
     def test_read_pt3_header(self):
         with open(self.pt3_file.with_suffix(".json")) as file:
             expected_header, expected_records_start = json.load(file)
@@ -43,44 +116,451 @@ class TestReader(unittest.TestCase):
         self.resolution = self.header["MeasDesc_Resolution"]
 
         data = np.load(self.ptu_file.with_suffix(".npz"))
-        self.channels, self.dtimes, self.truetimes = data["read_records"]
+        self.channels, self.dtimes, truetimes = data["read_records"]
+        # Stored true times are in ns, with the TAC time added.
+        self.macrotimes = np.round(truetimes * 1e-9 * self.syncrate).astype(int)
         self.x, self.y, self.f, self.d = data["interpret_records"]
 
     def test_read_records(self):
-        channels, dtimes, truetimes = pq_numba.read_records(
+        for parallel in (False, True):
+            with self.subTest(parallel=parallel):
+                channels, dtimes, macrotimes = pq_numba.read_records(
+                    self.ptu_file,
+                    self.num_records,
+                    self.records_start,
+                    parallel=parallel,
+                )
+
+                self.assertTrue(np.all(channels == self.channels))
+                self.assertTrue(np.all(dtimes == self.dtimes))
+                self.assertTrue(np.all(macrotimes == self.macrotimes))
+
+    def test_read_events_parallel(self):
+        records = np.random.default_rng(0).integers(2 ** 32, size=10 ** 5)
+        records = records.astype(np.uint32)
+        expected = pq_numba._read_events(records, records.size)
+
+        for num_chunks in (1, 7, 64):
+            with self.subTest(num_chunks=num_chunks):
+                result = pq_numba._read_events_parallel(
+                    records, records.size, num_chunks
+                )
+                for r, e in zip(result, expected):
+                    self.assertEqual(r.dtype, e.dtype)
+                    self.assertTrue(np.all(r == e))
+
+    def test_interpret_LSM_records(self):
+        pixX = self.header["ImgHdr_PixX"]
+        pixY = self.header["ImgHdr_PixY"]
+        lsm_frame = 0x1 << (self.header["ImgHdr_Frame"] - 1)
+        lsm_line_start = 0x1 << (self.header["ImgHdr_LineStart"] - 1)
+        lsm_line_stop = 0x1 << (self.header["ImgHdr_LineStop"] - 1)
+        x, y, f, d = pq_numba.interpret_LSM(
+            self.channels,
+            self.dtimes,
+            self.macrotimes,
+            pixX,
+            pixY,
+            lsm_frame,
+            lsm_line_start,
+            lsm_line_stop,
+        )
+
+        self.assertTrue(np.all(x == self.x))
+        self.assertTrue(np.all(y == self.y))
+        self.assertTrue(np.all(f == self.f))
+        self.assertTrue(np.all(d == self.d))
+
+    def test_iter_records(self):
+        chunks = pq_numba.iter_records(
             self.ptu_file,
             self.num_records,
             self.records_start,
-            self.syncrate,
-            self.resolution,
+            chunk_size=1000,
         )
+        channels, dtimes, macrotimes = map(np.concatenate, zip(*chunks))
 
         self.assertTrue(np.all(channels == self.channels))
         self.assertTrue(np.all(dtimes == self.dtimes))
-        self.assertTrue(np.all(truetimes == self.truetimes))
+        self.assertTrue(np.all(macrotimes == self.macrotimes))
 
-    def test_interpret_LSM_records(self):
+    def test_iter_LSM_records(self):
         pixX = self.header["ImgHdr_PixX"]
         pixY = self.header["ImgHdr_PixY"]
         lsm_frame = 0x1 << (self.header["ImgHdr_Frame"] - 1)
         lsm_line_start = 0x1 << (self.header["ImgHdr_LineStart"] - 1)
         lsm_line_stop = 0x1 << (self.header["ImgHdr_LineStop"] - 1)
-        x, y, f, d = pq_numba.interpret_LSM(
-            self.channels,
-            self.dtimes,
-            self.truetimes,
+
+        def records_iter():
+            return pq_numba.iter_records(
+                self.ptu_file,
+                self.num_records,
+                self.records_start,
+                chunk_size=1000,
+            )
+
+        line_time, num_TAC_bins, frame_range = pq_numba.scan_LSM(
+            records_iter(), lsm_frame, lsm_line_start, lsm_line_stop
+        )
+        chunks = pq_numba.iter_LSM(
+            records_iter(),
             pixX,
             pixY,
             lsm_frame,
             lsm_line_start,
             lsm_line_stop,
+            line_time,
         )
+        x, y, f, d = map(np.concatenate, zip(*chunks))
 
+        self.assertEqual(num_TAC_bins, self.d.max() + 1)
+        self.assertEqual(frame_range, (self.f.min(), self.f.max()))
         self.assertTrue(np.all(x == self.x))
         self.assertTrue(np.all(y == self.y))
         self.assertTrue(np.all(f == self.f))
         self.assertTrue(np.all(d == self.d))
 
+    def test_fourier_LSM_records(self):
+        pixX = self.header["ImgHdr_PixX"]
+        pixY = self.header["ImgHdr_PixY"]
+        lsm_frame = 0x1 << (self.header["ImgHdr_Frame"] - 1)
+        lsm_line_start = 0x1 << (self.header["ImgHdr_LineStart"] - 1)
+        lsm_line_stop = 0x1 << (self.header["ImgHdr_LineStop"] - 1)
+        records = pq_numba.memmap_records(self.ptu_file, self.records_start)
+        records = records[: self.num_records]
+
+        line_time, num_TAC_bins, frame_range = pq_numba.scan_LSM_records(
+            records, lsm_frame, lsm_line_start, lsm_line_stop
+        )
+        self.assertEqual(num_TAC_bins, self.d.max() + 1)
+        self.assertEqual(frame_range, (self.f.min(), self.f.max()))
+
+        harmonics = (0, 1, 2)
+        TAC_period = 1 / (self.resolution * self.syncrate)
+        image, hist = pq_numba.fourier_LSM_records(
+            records,
+            pixX,
+            pixY,
+            lsm_frame,
+            lsm_line_start,
+            lsm_line_stop,
+            line_time,
+            complex_exp(harmonics, num_TAC_bins, TAC_period),
+        )
+        expected_image = fourier_image(
+            (pixY, pixX), harmonics, self.d, self.x, self.y, num_TAC_bins, TAC_period
+        )
+        expected_hist = histogram(self.d, self.x, self.y, num_TAC_bins)
+
+        self.assertTrue(np.all(image == expected_image))
+        self.assertTrue(np.all(hist == expected_hist))
+
+
+class TestPTU(unittest.TestCase):
+    ptu_file = pathlib.Path("tests/io/picoquant/ptu_example.ptu")
+
+    def setUp(self):
+        self.ptu = PTU(self.ptu_file)
+        self.chunked = PTU(self.ptu_file, chunk_size=1000)
+        self.harmonics = (0, 1, 2)
+        self.mask = np.zeros((self.ptu.pixY, self.ptu.pixX), dtype=bool)
+        self.mask[10:50, 20:80] = True
+
+    def test_chunked(self):
+        ptu, chunked, harmonics = self.ptu, self.chunked, self.harmonics
+
+        self.assertEqual(chunked.num_TAC_bins, ptu.num_TAC_bins)
+        for m in (None, self.mask):
+            self.assertTrue(
+                np.all(chunked.histogram(mask=m)[1] == ptu.histogram(mask=m)[1])
+            )
+            self.assertTrue(
+                np.all(
+                    chunked.fourier_image(harmonics, mask=m)
+                    == ptu.fourier_image(harmonics, mask=m)
+                )
+            )
+
+    def test_fourier_image_parallel(self):
+        ptu, harmonics = self.ptu, self.harmonics
+        exp = complex_exp(harmonics, ptu.num_TAC_bins, ptu.TAC_period)
+
+        for m in (None, self.mask):
+            expected = ptu.fourier_image(harmonics, mask=m)
+            np.testing.assert_allclose(
+                ptu.fourier_image(harmonics, mask=m, parallel=True), expected
+            )
+            for num_chunks in (1, 7):
+                image = np.zeros_like(expected)
+                _fourier_image_parallel(
+                    image, exp, ptu.dtime, ptu.x, ptu.y, num_chunks, mask=m
+                )
+                np.testing.assert_allclose(image, expected)
+
+    def test_decay_image(self):
+        ptu, harmonics = self.ptu, (0, 1, 2, 3)
+
+        for m in (None, self.mask):
+            decay = ptu.decay_image(mask=m)
+            self.assertEqual(decay.shape, (ptu.num_TAC_bins, ptu.pixY, ptu.pixX))
+            self.assertTrue(np.all(decay.sum(axis=(1, 2)) == ptu.histogram(mask=m)[1]))
+            self.assertTrue(np.all(self.chunked.decay_image(mask=m) == decay))
+
+            binned = ptu.decay_image(TAC_binning=3, mask=m)
+            self.assertTrue(np.all(binned.sum(axis=0) == decay.sum(axis=0)))
+
+            expected = ptu.fourier_image(harmonics, mask=m)
+            np.testing.assert_allclose(
+                ptu.fourier_image(harmonics, mask=m, method="decay"),
+                expected,
+                atol=1e-9,
+            )
+            np.testing.assert_allclose(
+                fourier_from_decay(
+                    decay, harmonics, ptu.TAC_period, pixels_per_block=1000
+                ),
+                expected,
+                atol=1e-9,
+            )
+
+    def test_pixel_index(self):
+        ptu, harmonics, mask = self.ptu, self.harmonics, self.mask
+        shape = mask.shape
+        mask[100, 100] = True
+
+        index = ptu.pixel_index
+        counts = np.bincount(ptu.y * ptu.pixX + ptu.x, minlength=mask.size)
+        self.assertTrue(np.all(np.diff(index.offsets) == counts))
+
+        self.assertTrue(
+            np.all(
+                ptu.histogram(mask=mask)[1]
+                == histogram(ptu.dtime, ptu.x, ptu.y, ptu.num_TAC_bins, mask=mask)
+            )
+        )
+        self.assertTrue(
+            np.all(
+                ptu.decay_image(mask=mask)
+                == decay_image(
+                    shape, ptu.dtime, ptu.x, ptu.y, ptu.num_TAC_bins, mask=mask
+                )
+            )
+        )
+        expected = fourier_image(
+            shape,
+            harmonics,
+            ptu.dtime,
+            ptu.x,
+            ptu.y,
+            ptu.num_TAC_bins,
+            ptu.TAC_period,
+            mask=mask,
+        )
+        self.assertTrue(np.all(ptu.fourier_image(harmonics, mask=mask) == expected))
+        np.testing.assert_allclose(
+            ptu.fourier_image(harmonics, mask=mask, parallel=True), expected
+        )
+
+    def test_mean_phasor(self):
+        ptu = self.ptu
+
+        for m in (None, self.mask):
+            for harmonics in ((1,), (0, 2)):
+                N, R = ptu.phasor_image(harmonics, mask=m, ret_N=True)
+                expected = np.sum(N * R) / np.sum(N)
+                np.testing.assert_allclose(ptu.mean_phasor(harmonics, mask=m), expected)
+                np.testing.assert_allclose(
+                    self.chunked.mean_phasor(harmonics, mask=m),
+                    ptu.mean_phasor(harmonics, mask=m),
+                )
+
+    def test_regions(self):
+        ptu, harmonics = self.ptu, (1, 2)
+        labels = np.zeros((ptu.pixY, ptu.pixX), dtype=int)
+        labels[self.mask] = 1
+        labels[60:, :30] = 3
+
+        _, hists = ptu.region_histograms(labels)
+        N, r = ptu.region_phasors(labels, harmonics, ret_N=True)
+        self.assertEqual(hists.shape, (4, ptu.num_TAC_bins))
+        self.assertEqual(r.shape, (2, 4))
+        self.assertTrue(np.all(self.chunked.region_histograms(labels)[1] == hists))
+        np.testing.assert_allclose(self.chunked.region_phasors(labels, harmonics), r)
+        np.testing.assert_allclose(
+            PTU.__mro__[1].region_fourier(ptu, labels, (0, *harmonics)),
+            ptu.region_fourier(labels, (0, *harmonics)),
+        )
+
+        for k in range(4):
+            mask = labels == k
+            self.assertTrue(np.all(hists[k] == ptu.histogram(mask=mask)[1]))
+            self.assertEqual(N[k], hists[k].sum())
+            if N[k] == 0:
+                self.assertTrue(np.all(r[:, k] == 0))
+                continue
+            for h in range(len(harmonics)):
+                np.testing.assert_allclose(
+                    r[h, k], ptu.mean_phasor((harmonics[h],), mask=mask)
+                )
+
+    def test_read_frames_and_lines(self):
+        ptu = self.ptu
+        index = ptu.marker_index
+        self.assertEqual(index.line_time(), self.chunked.line_time)
+
+        for start in np.unique(ptu.f):
+            with self.subTest(frame=start):
+                in_range = ptu.f == start
+                result = ptu.read_frames(start)
+                expected = (ptu.x, ptu.y, ptu.f, ptu.dtime)
+                for r, e in zip(result, expected):
+                    self.assertTrue(np.all(r == e[in_range]))
+
+        for start, stop in ((0, 10), (100, 101), (200, 256)):
+            with self.subTest(lines=(start, stop)):
+                result = ptu.read_lines(start, stop)
+                tail = ptu.read_lines(start, index.line_start_offsets.size)
+                n = tail[0].size
+                expected = (ptu.x[-n:], ptu.y[-n:], ptu.f[-n:], ptu.dtime[-n:])
+                for r, e in zip(result, expected):
+                    self.assertTrue(np.all(r == e[: r.size]))
+
+        num_frames = index.frame_offsets.size
+        num_lines = index.line_start_offsets.size
+        for read, start, stop in (
+            (ptu.read_frames, -2, None),
+            (ptu.read_frames, num_frames, None),
+            (ptu.read_frames, 1, 1),
+            (ptu.read_lines, -1, 1),
+            (ptu.read_lines, num_lines, num_lines + 1),
+            (ptu.read_lines, 10, 5),
+        ):
+            with self.subTest(read=read.__name__, start=start, stop=stop):
+                with self.assertRaises(IndexError):
+                    read(start, stop)
+
+    def test_fourier_stack(self):
+        ptu, harmonics = self.ptu, self.harmonics
+
+        stack = ptu.fourier_stack(harmonics)
+        first, last = ptu.frame_range
+        self.assertEqual(stack.shape, (last - first + 1, 3, ptu.pixY, ptu.pixX))
+        self.assertTrue(np.all(stack == self.chunked.fourier_stack(harmonics)))
+        for k, frame in enumerate(range(first, last + 1)):
+            in_frame = ptu.f == frame
+            expected = fourier_image(
+                (ptu.pixY, ptu.pixX),
+                harmonics,
+                ptu.dtime[in_frame],
+                ptu.x[in_frame],
+                ptu.y[in_frame],
+                ptu.num_TAC_bins,
+                ptu.TAC_period,
+            )
+            self.assertTrue(np.all(stack[k] == expected))
+
+        binned = ptu.fourier_stack(harmonics, frame_binning=last - first + 1)
+        self.assertEqual(binned.shape[0], 1)
+        self.assertTrue(np.allclose(binned[0], ptu.fourier_image(harmonics)))
+
+        N, r = ptu.phasor_stack((1,), ret_N=True)
+        self.assertTrue(np.all(N == stack[:, 0].real))
+        self.assertEqual(r.shape, stack[:, 1:2].shape)
+
+    def test_cache(self):
+        ptu = self.ptu
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PhotonCache(directory)
+            for _ in range(2):  # Saves, then loads.
+                cached = PTU(self.ptu_file, cache=cache)
+                for name in ("x", "y", "f", "dtime"):
+                    self.assertTrue(np.all(getattr(cached, name) == getattr(ptu, name)))
+                self.assertEqual(cached.num_TAC_bins, ptu.num_TAC_bins)
+                self.assertEqual(cached.frame_range, ptu.frame_range)
+                self.assertEqual(cached.line_time, ptu.line_time)
+            self.assertIsInstance(cached.x, np.memmap)
+            self.assertGreater(cache.size(), 0)
+
+            # A truncated entry is a miss, and is saved again.
+            key = cache.key(self.ptu_file, reader="PTU")
+            with open(cache.directory / key / "x.npy", "r+b") as file:
+                file.truncate(100)
+            self.assertIsNone(cache.load(key))
+            self.assertFalse((cache.directory / key).exists())
+            (cache.directory / key).mkdir()
+            (cache.directory / key / "meta.json").write_text('{"arrays": [')
+            self.assertIsNone(cache.load(key))
+            cached = PTU(self.ptu_file, cache=cache)
+            self.assertTrue(np.all(cached.x == ptu.x))
+            self.assertIsNotNone(cache.load(key))
+
+            cache.max_size = 0
+            cache.evict()
+            self.assertEqual(cache.size(), 0)
+
+            with self.assertRaises(ValueError):
+                PTU(self.ptu_file, chunk_size=1000, cache=cache)
+
+    def test_lazy(self):
+        header, _ = pq_header.read_header_ptu(self.ptu_file)
+        for chunk_size in (None, 1000):
+            with self.subTest(chunk_size=chunk_size):
+                ptu = PTU(self.ptu_file, chunk_size=chunk_size)
+                self.assertEqual(ptu.pixX, header["ImgHdr_PixX"])
+                self.assertNotIn("num_TAC_bins", vars(ptu))
+
+                ptu.histogram()
+                self.assertIn("num_TAC_bins", vars(ptu))
+                self.assertEqual(chunk_size is None, "x" in vars(ptu))
+                with self.assertRaises(AttributeError):
+                    ptu.missing
+
+                # Every lazy attribute is set by loading.
+                ptu = PTU(self.ptu_file, chunk_size=chunk_size)
+                self.assertAlmostEqual(ptu.line_time, ptu.marker_index.line_time())
+                for name in PTU._lazy_attributes:
+                    if chunk_size is None or name not in ("x", "y", "f", "dtime"):
+                        getattr(ptu, name)
+
+
+class TestWriter(unittest.TestCase):
+    def test_roundtrip(self):
+        rng = np.random.default_rng(0)
+        frames = []
+        for _ in range(3):
+            counts = rng.poisson(3, size=(7, 9))
+            frames.append((counts, rng.integers(1500, size=counts.sum())))
+
+        expected = {"x": [], "y": [], "f": [], "dtime": []}
+        for f, (counts, dtime) in enumerate(frames):
+            y, x = np.indices(counts.shape)
+            expected["x"].append(np.repeat(x.ravel(), counts.ravel()))
+            expected["y"].append(np.repeat(y.ravel(), counts.ravel()))
+            expected["f"].append(np.full(dtime.size, f))
+            expected["dtime"].append(dtime)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file = pathlib.Path(directory, "synthetic.ptu")
+            # Long pixels, so that lines span several overflows.
+            with PTUWriter(file, pixX=9, pixY=7, pixel_syncs=5000) as writer:
+                for counts, dtime in frames:
+                    writer.write_frame(counts, dtime)
+
+            header, _ = pq_header.read_header_ptu(file)
+            self.assertEqual(header["TTResult_NumberOfRecords"], writer.num_records)
+
+            ptu = PTU(file)
+            for name, value in expected.items():
+                self.assertTrue(np.all(getattr(ptu, name) == np.concatenate(value)))
+
+            chunked = PTU(file, chunk_size=100)
+            harmonics = (0, 1)
+            self.assertTrue(
+                np.allclose(
+                    chunked.fourier_image(harmonics), ptu.fourier_image(harmonics)
+                )
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+
+import numpy as np
+
+from pyflim.simulation import fourier_image
+
+try:
+    from pyflim import pawflim
+except ImportError:  # binlets 0.1 or scipy are not installed.
+    pawflim = None
+
+
+def _phasors(seed, shape):
+    rng = np.random.default_rng(seed)
+    N = rng.poisson(20, size=shape).astype(float)
+    tau = rng.uniform(0.05, 0.5, size=shape)
+    R1 = N / (1 - 2j * np.pi * tau)
+    R2 = N / (1 - 4j * np.pi * tau)
+    return N, R1, R2
+
+
+@unittest.skipIf(pawflim is None, "pawflim requires binlets 0.1 and scipy.")
+class TestPawflim(unittest.TestCase):
+    def setUp(self):
+        self.N, self.R1, self.R2 = _phasors(0, (40, 56))
+        self.mask = np.ones(self.N.shape, dtype=bool)
+        self.mask[5:15, 10:30] = False
+
+    def assert_results_equal(self, result, expected):
+        for r, e in zip(result, expected):
+            np.testing.assert_allclose(r, e)
+
+    def test_tiled(self):
+        N, R1, R2 = self.N, self.R1, self.R2
+        for mask in (None, self.mask):
+            # binlets modifies mask in place.
+            expected = pawflim.pawflim(
+                N, R1, R2, 2, mask=None if mask is None else mask.copy()
+            )
+            # Tiles that do not divide the image, and with halos that wrap
+            # around its edges.
+            for tile_shape in ((16, 16), (40, 24), (7, 100)):
+                with self.subTest(mask=mask is not None, tile_shape=tile_shape):
+                    result = pawflim.pawflim_tiled(
+                        N, R1, R2, 2, tile_shape, mask=mask, n_workers=1
+                    )
+                    self.assert_results_equal(result, expected)
+
+        result = pawflim.pawflim_tiled(N, R1, R2, 2, (16, 16), n_workers=2)
+        self.assert_results_equal(result, pawflim.pawflim(N, R1, R2, 2))
+
+    def test_batch(self):
+        N, R1, R2 = _phasors(1, (3, 24, 32))
+        mask = np.ones(N.shape, dtype=bool)
+        mask[1, 4:12, 8:20] = False
+
+        for m in (None, mask):
+            expected = [
+                pawflim.pawflim(
+                    N[i], R1[i], R2[i], 2, mask=None if m is None else m[i].copy()
+                )
+                for i in range(len(N))
+            ]
+            expected = tuple(map(np.stack, zip(*expected)))
+            for batch_size, n_workers in ((1, 1), (2, 1), (1, 2)):
+                with self.subTest(
+                    mask=m is not None, batch_size=batch_size, n_workers=n_workers
+                ):
+                    result = pawflim.pawflim_batch(
+                        N,
+                        R1,
+                        R2,
+                        2,
+                        mask=m,
+                        n_workers=n_workers,
+                        batch_size=batch_size,
+                    )
+                    self.assert_results_equal(result, expected)
+
+    def test_sweep(self):
+        N, R1, R2 = self.N, self.R1, self.R2
+        p_values = (0.5, 0.05, 1e-3)
+
+        for m in (None, self.mask):
+            result = pawflim.pawflim_sweep(
+                N, R1, R2, 3, p_values, mask=None if m is None else m.copy()
+            )
+            for i, p_value in enumerate(p_values):
+                with self.subTest(mask=m is not None, p_value=p_value):
+                    expected = pawflim.pawflim(
+                        N,
+                        R1,
+                        R2,
+                        3,
+                        p_value=p_value,
+                        mask=None if m is None else m.copy(),
+                    )
+                    self.assert_results_equal((result[0][i], result[1][i]), expected)
+
+    def test_harmonics(self):
+        N, R1, R2 = self.N, self.R1, self.R2
+        R = np.stack((N, R1, R2))
+
+        for m in (None, self.mask):
+            with self.subTest(mask=m is not None):
+                expected = pawflim.pawflim(
+                    N, R1, R2, 3, mask=None if m is None else m.copy()
+                )
+                N_, R_ = pawflim.pawflim_harmonics(
+                    R, (1,), 3, mask=None if m is None else m.copy()
+                )
+                self.assertEqual(R_.shape, (1, *N.shape))
+                self.assert_results_equal((N_, R_[0]), expected)
+
+        # Harmonics in a different order, as given by R_harmonics.
+        N_, R_ = pawflim.pawflim_harmonics(R[::-1], (1,), 3, R_harmonics=(2, 1, 0))
+        self.assert_results_equal((N_, R_[0]), pawflim.pawflim(N, R1, R2, 3))
+
+    def test_harmonics_denoising(self):
+        # On a uniform image, denoising more harmonics at once should bin
+        # about as much as pawflim on the first one.
+        rng = np.random.default_rng(0)
+        N = rng.poisson(50, size=(128, 128))
+        R = fourier_image((2.0,), (1.0,), N, 10.0, harmonics=range(5), rng=rng)
+
+        def variance(N, R1):
+            return np.var((R1 / N).real)
+
+        raw = variance(R[0].real, R[1])
+        expected = variance(*pawflim.pawflim(R[0].real, R[1], R[2], 3))
+        self.assertLess(expected, raw / 2)
+
+        N_, R_ = pawflim.pawflim_harmonics(R, (1, 2), 3)
+        self.assertLess(variance(N_, R_[0]), 1.25 * expected)
+
+        with self.assertRaises(ValueError):
+            pawflim.pawflim_harmonics(R[:4], (1, 2), 3)  # Harmonic 4 is missing.
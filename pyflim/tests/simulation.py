@@ -0,0 +1,153 @@
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from pyflim import simulation
+from pyflim.functions import phasor_from_lifetime
+from pyflim.io.becker_hickl import SPC
+from pyflim.io.becker_hickl.bh_writer import SPCWriter
+from pyflim.io.picoquant import PTU
+from pyflim.io.picoquant.pq_writer import PTUWriter
+
+
+class _Recorder:
+    """Forwards frames to a writer, and keeps their counts."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.syncrate = writer.syncrate
+        self.resolution = writer.resolution
+        self.counts = []
+
+    def write_frame(self, counts, dtime):
+        self.counts.append(counts)
+        self.writer.write_frame(counts, dtime)
+
+
+class TestSimulation(unittest.TestCase):
+    def test_seed(self):
+        taus, p, T = (0.5, 2.0), (0.3, 0.7), 12.5
+        N = np.full((40, 30), 20)
+        simulators = {
+            "single_lifetime": lambda **kw: simulation.single_lifetime(
+                1.0, 1000, T, **kw
+            ),
+            "multi_lifetime": lambda **kw: simulation.multi_lifetime(
+                taus, p, 1000, T, **kw
+            ),
+            "fourier_image": lambda **kw: simulation.fourier_image(
+                taus, p, N, T, exact_below=10, **kw
+            ),
+        }
+
+        # Small chunks, so that there are more chunks than workers.
+        with patch.object(simulation, "CHUNK_SIZE", 7):
+            for name, simulate in simulators.items():
+                with self.subTest(name):
+                    expected = simulate(rng=0)
+                    for n_workers in (1, 2, 3):
+                        result = simulate(rng=0, n_workers=n_workers)
+                        self.assertTrue(np.all(result == expected))
+                    self.assertFalse(np.all(simulate(rng=1) == expected))
+
+                    rng = np.random.default_rng(0)
+                    self.assertFalse(np.all(simulate(rng=rng) == simulate(rng=rng)))
+
+                    np.random.seed(0)
+                    expected = simulate()
+                    np.random.seed(0)
+                    self.assertTrue(np.all(simulate() == expected))
+
+    def test_multi_lifetime_distribution(self):
+        taus, p, T = np.array([0.5, 2.0]), np.array([0.3, 0.7]), 5.0
+        t = simulation.multi_lifetime(taus, p, 10 ** 6, T, rng=0)
+        self.assertTrue(np.all((t >= 0) & (t < T)))
+
+        # Truncated exponential mixture.
+        for x in (0.1, 0.5, 1.0, 2.0, 4.0):
+            with self.subTest(x=x):
+                cdf = np.sum(p * -np.expm1(-x / taus) / -np.expm1(-T / taus))
+                error = np.sqrt(cdf * (1 - cdf) / t.size)
+                self.assertLess(abs(np.mean(t < x) - cdf), 5 * error)
+
+    def test_multi_lifetime_broadcasting(self):
+        # Per-pixel lifetime of the first component, and photon fraction.
+        tau1 = np.array([[0.1, 0.5, 1.0], [0.2, 0.3, 2.0]])
+        p1 = np.array([[1.0], [0.5]])
+        T = 5.0
+        t = simulation.multi_lifetime(
+            (tau1, 1.0), (p1, 1 - p1), (10 ** 5, 2, 3), T, rng=0
+        )
+        self.assertEqual(t.shape, (10 ** 5, 2, 3))
+
+        def truncated_mean(tau):
+            return tau - T / np.expm1(T / tau)
+
+        expected = p1 * truncated_mean(tau1) + (1 - p1) * truncated_mean(1.0)
+        error = np.std(t, axis=0) / np.sqrt(len(t))
+        np.testing.assert_array_less(abs(t.mean(axis=0) - expected), 5 * error)
+
+    def test_fourier_image_moments(self):
+        taus, p, T = (0.5, 2.0), (0.3, 0.7), 12.5
+        N = np.full(20000, 30)
+        harmonics = (0, 1, 2)
+
+        exact = simulation.fourier_image(
+            taus, p, N, T, harmonics, exact_below=30, rng=0
+        )
+        asymptotic = simulation.fourier_image(
+            taus, p, N, T, harmonics, exact_below=0, rng=1
+        )
+        for R in (exact, asymptotic):
+            self.assertTrue(np.all(R[0] == N))
+
+        def moments(R):
+            x = np.concatenate((R[1:].real, R[1:].imag))
+            return x.mean(axis=1), np.cov(x)
+
+        (mean_exact, cov_exact), (mean_asym, cov_asym) = map(
+            moments, (exact, asymptotic)
+        )
+        # Standard error of the difference of means.
+        error = np.sqrt((np.diag(cov_exact) + np.diag(cov_asym)) / N.size)
+        np.testing.assert_array_less(abs(mean_asym - mean_exact), 5 * error)
+
+        # Relative standard error of a variance is sqrt(2 / size), i.e. 1%.
+        scale = np.sqrt(np.outer(np.diag(cov_exact), np.diag(cov_exact)))
+        np.testing.assert_array_less(abs(cov_asym - cov_exact), 0.05 * scale)
+
+    def test_write_frames(self):
+        taus, p = (1e-9, 4e-9), (0.4, 0.6)
+        N = np.full((8, 12), 200.0)
+        N[:4] = 50
+        expected_phasor = np.sum(np.multiply(p, phasor_from_lifetime(taus, 40e6)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            writers = {
+                "ptu": lambda file: PTUWriter(file, pixX=12, pixY=8),
+                "spc": lambda file: SPCWriter(file, macro_clock=25e-9, tac_range=50e-9),
+            }
+            for suffix, writer in writers.items():
+                with self.subTest(suffix):
+                    file = directory / f"simulated.{suffix}"
+                    with writer(file) as w:
+                        recorder = _Recorder(w)
+                        simulation.write_frames(recorder, taus, p, N, 3, rng=0)
+
+                    if suffix == "ptu":
+                        flim = PTU(file)
+                    else:
+                        flim = SPC(file, w.tac_range)
+                    counts = np.zeros(N.shape, dtype=int)
+                    np.add.at(counts, (flim.y, flim.x), 1)
+                    self.assertTrue(np.all(counts == sum(recorder.counts)))
+
+                    # Mean phasor, within five standard errors. Each
+                    # component of a photon phasor has a variance below 1/2.
+                    error = np.sqrt(0.5 / counts.sum())
+                    phasor = flim.mean_phasor((1,))
+                    self.assertLess(abs(phasor - expected_phasor), 5 * error)